@@ -248,6 +248,30 @@ class BibFilter:
         """
         return []
 
+    def prefetch_requests(self):
+        """
+        Return the items which this filter will need to have fetched from the
+        network by its cache accessors.
+
+        This function is called after the bibolamazi file and its cache are
+        loaded, but before any filter is run.  It should return a dictionary
+        ``{ AccessorClass: [ item1, item2, ... ], ... }``, where the keys are
+        among the accessors returned by :py:meth:`requested_cache_accessors`
+        and where the items are passed on to the accessor's
+        :py:meth:`~core.bibusercache.BibUserCacheAccessor.prefetch` method.
+        The items of all filters and of all services are then fetched at once
+        (see :py:meth:`~core.bibolamazifile.BibolamaziFile.prefetchCacheData`).
+
+        Prefetching is only an optimization: the filter should still make sure
+        that it has all the data it needs when it is run, e.g., by calling the
+        accessor's fetch function as usual (which won't do anything if the data
+        is already in the cache).  If this function raises an exception, the
+        exception is ignored.
+
+        The default implementation returns an empty dictionary.
+        """
+        return {}
+
 
 
 
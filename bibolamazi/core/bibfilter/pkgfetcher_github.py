@@ -41,6 +41,7 @@ import requests
 
 import bibolamazi.init
 from bibolamazi.core.butils import BibolamaziError
+from bibolamazi.core import transport
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +82,7 @@ class Fetcher:
         # check_cache_is_up_to_date() so that old cache can still correctly be
         # used ...
         try:
+            transport.check_online("github:{}/{}".format(self.username, self.repo))
             if self.auth_token:
                 self.G = github.Github(self.auth_token)
             else:
@@ -135,12 +137,17 @@ class Fetcher:
         # this should also work for private repositories as the URL should
         # include necessary tokens apparently
         # (https://developer.github.com/v3/repos/contents/#get-archive-link)
-        r = requests.get(zip_url, allow_redirects=True)
-        
         dnlzipfile = os.path.join(fullcachedir, self.sha+'.zip')
-        with open(dnlzipfile, 'wb') as fd:
-            for chunk in r.iter_content(chunk_size=128):
-                fd.write(chunk)
+        r = transport.get(zip_url, allow_redirects=True, stream=True)
+        try:
+            if r.status_code != 200:
+                raise BibolamaziError("Couldn't download filter package {}/{} (HTTP {})"
+                                      .format(self.username, self.repo, r.status_code))
+            with open(dnlzipfile, 'wb') as fd:
+                for chunk in transport.iter_content(r):
+                    fd.write(chunk)
+        finally:
+            r.close()
 
         # extract zip file
         xtractdir = os.path.join(fullcachedir, self.sha)
@@ -206,5 +213,5 @@ class GithubPackageProvider:
         
         try:
             return Fetcher(auth_token=self.auth_token, **m.groupdict())
-        except (requests.ConnectionError,github.GithubException) as e:
+        except (requests.ConnectionError,github.GithubException,transport.TransportError) as e:
             raise BibolamaziError("Cannot retrieve github package: {}".format(e))
@@ -34,22 +34,28 @@ import os.path
 from datetime import datetime
 import codecs
 import shlex
+import concurrent.futures
 #from urllib.parse import urlparse, urlencode
 from urllib.request import urlopen
 #from urllib.error import HTTPError
 #import pickle
 import logging
 
+import appdirs
+
 import bibolamazi.init
 
 import pybtex.database
 import pybtex.database.input.bibtex as inputbibtex
 import pybtex.database.output.bibtex as outputbibtex
-from pybtex.utils import OrderedCaseInsensitiveDict
 
 from . import butils
+from . import transport
 from .butils import BibolamaziError
-from .bibusercache import BibUserCache
+from .bibusercache import BibUserCache, parse_cache_size_limits
+from .bibusercache import cachefile
+from .bibusercache.fingerprints import EntryFingerprintIndex
+from .entrydict import EntryDict
 from .bibfilter import BibFilter, BibFilterError, factory
 from .bibfilter.factory import PrependOrderedDict
 
@@ -94,6 +100,12 @@ def _repl(s, dic):
         s = re.sub(k, v, s)
     return s
 
+def _new_bibliography_data():
+    # our bibliography data objects store their entries in an EntryDict
+    bibdata = pybtex.database.BibliographyData()
+    bibdata.entries = EntryDict()
+    return bibdata
+
 
 
 
@@ -204,7 +216,7 @@ sources loaded. See doc for :py:class:`BibolamaziFile`.
 
 
 
-BIBOLAMAZIFILE_COMMANDS = ['src', 'package', 'filter']
+BIBOLAMAZIFILE_COMMANDS = ['src', 'package', 'filter', 'cache']
 
 
 
@@ -254,7 +266,9 @@ class BibolamaziFile:
     def __init__(self, fname=None, create=False,
                  load_to_state=BIBOLAMAZIFILE_LOADED,
                  use_cache=True,
-                 default_cache_invalidation_time=None):
+                 default_cache_invalidation_time=None,
+                 use_shared_cache=True,
+                 cache_size_limits=None):
         """
         The constructor creates a BibolamaziFile object.
 
@@ -277,12 +291,25 @@ class BibolamaziFile:
 
         If `default_cache_invalidation_time` is given, then the default cache invalidation
         time is set before loading the cache.
+
+        If `use_shared_cache` is `True` (default), then the cache accessors which
+        declare their data to be independent of the bibolamazi file (see
+        :py:attr:`~core.bibusercache.BibUserCacheAccessor.shared_cache`) store
+        their data in the user-level shared cache (see
+        :py:meth:`sharedCacheFileName()`) instead of in this file's own cache.
+
+        If `cache_size_limits` is given, it should be a tuple `(max_items,
+        max_bytes)` of size limits for each sub-cache, which override any limits
+        specified with the ``cache:`` command in the configuration section.  See
+        :py:meth:`setCacheSizeLimits()`.
         """
         
         logger.debug("Opening bibolamazi file `%s'", fname)
         self._fname = None
         self._dir = None
         self._use_cache = use_cache
+        self._use_shared_cache = use_shared_cache
+        self._cache_size_limits_override = cache_size_limits
 
         if create:
             self._init_empty_template()
@@ -362,7 +389,11 @@ class BibolamaziFile:
             self._filters = []
             self._cache_accessors = {} # dict { class-type: class-instance }
             self._bibliographydata = None
+            self._entry_fingerprints = EntryFingerprintIndex(self.bibliographyData)
             self._user_cache = BibUserCache(cache_version=butils.get_version())
+            self._shared_cache = BibUserCache(cache_version=butils.get_version())
+            self._shared_cache_loaded = False
+            self._cache_size_limits = None
             
         if (to_state >= BIBOLAMAZIFILE_READ  and  self._load_state < BIBOLAMAZIFILE_READ):
             try:
@@ -584,6 +615,42 @@ class BibolamaziFile:
                                "bibliographyData()", __name__)
         return self.bibliographyData()
 
+    def entryFingerprintIndex(self):
+        """
+        Returns the :py:class:`~core.bibusercache.fingerprints.EntryFingerprintIndex`
+        which keeps track of the content fingerprints of the entries in
+        :py:meth:`bibliographyData()` during this run.
+
+        Token checkers and filters should use this object (or
+        :py:meth:`entryFingerprint()`) rather than hashing entries
+        themselves.
+        """
+        return self._entry_fingerprints
+
+    def entryFingerprint(self, key):
+        """
+        Returns the content fingerprint of the entry `key` (see
+        :py:func:`~core.bibusercache.fingerprints.entry_fingerprint`), or `None`
+        if there is no such entry.
+
+        The fingerprint is computed only once, until the entry is reported as
+        changed with :py:meth:`notifyEntryChanged()`.
+        """
+        return self._entry_fingerprints.fingerprint(key)
+
+    def notifyEntryChanged(self, key=None):
+        """
+        Inform this object that the entry `key` was modified, so that its content
+        fingerprint is recomputed the next time it is needed.  If `key` is
+        `None`, then all the entries are considered to have changed.
+
+        This is called automatically after each filter has run (see
+        :py:meth:`runFilter()`) and by :py:meth:`setEntries()`.  A filter that
+        modifies entries directly and then relies on their fingerprints within
+        the same run should call this method for the entries it modified.
+        """
+        self._entry_fingerprints.invalidate(key)
+
     def cacheFileName(self):
         """
         The file name where the cache will be stored. You don't need to access this
@@ -602,6 +669,25 @@ class BibolamaziFile:
         return fname + '.bibolamazicache'
         
 
+    @staticmethod
+    def sharedCacheFileName():
+        """
+        The file name of the user-level cache which is shared between all bibolamazi
+        files.  It is located in the user's cache directory (as given by
+        `appdirs.user_cache_dir("bibolamazi")`), unless the environment variable
+        `BIBOLAMAZI_SHARED_CACHE_DIR` is set, in which case it is located in that
+        directory.
+
+        Only the cache accessors whose data does not depend on the bibolamazi file
+        (typically, information fetched from the web) store their data in the
+        shared cache.  See
+        :py:attr:`~core.bibusercache.BibUserCacheAccessor.shared_cache`.
+        """
+        cachedir = os.environ.get('BIBOLAMAZI_SHARED_CACHE_DIR', None)
+        if not cachedir:
+            cachedir = appdirs.user_cache_dir("bibolamazi")
+        return os.path.join(cachedir, 'shared.bibolamazicache')
+
     def cacheAccessor(self, klass):
         """
         Returns the cache accessor instance corresponding to the given class.
@@ -612,6 +698,76 @@ class BibolamaziFile:
         If the cache accessor was not loaded, then `None` is returned.
         """
         return self._cache_accessors.get(klass, None)
+
+    def prefetchCacheData(self, filters=None):
+        """
+        Fetch, all at once, the remote data which the filters will need.
+
+        The filters (see :py:meth:`BibFilter.prefetch_requests()
+        <core.bibfilter.BibFilter.prefetch_requests>`) and the cache accessors
+        (see
+        :py:meth:`~core.bibusercache.BibUserCacheAccessor.prefetchRequests`)
+        are asked which items they will need.  Then, the
+        :py:meth:`~core.bibusercache.BibUserCacheAccessor.prefetch` method of
+        each concerned accessor is called, each in its own thread, so that
+        waiting on the different services overlaps.  Each accessor is
+        responsible for respecting its own service's rate limits.
+
+        The filters which are asked for their requests are `filters`, or the
+        filters given in the configuration section (see :py:meth:`filters()`)
+        if `filters` is `None`.
+
+        This function should be called once the file is loaded, before running
+        the filters.  It is only an optimization; errors are logged and ignored.
+        """
+        if self._load_state != BIBOLAMAZIFILE_LOADED:
+            logger.debug("prefetchCacheData(): file not loaded, nothing to do")
+            return
+
+        # collect the items to fetch for each accessor, in order and without
+        # duplicates
+        requests = {}
+        def add_requests(what, fn):
+            try:
+                reqs = fn()
+            except Exception as e:
+                logger.debug("Ignoring error while collecting prefetch requests of %s: %s: %s",
+                             what, e.__class__.__name__, e)
+                return
+            for (klass, items) in reqs.items():
+                if klass not in self._cache_accessors:
+                    logger.debug("%s wants to prefetch items for %s which isn't "
+                                 "a requested cache accessor", what, klass.__name__)
+                    continue
+                itemlist = requests.setdefault(klass, [])
+                itemlist += [ x for x in items if x not in itemlist ]
+
+        if filters is None:
+            filters = self._filters
+        for filtr in filters:
+            add_requests(filtr.name(), filtr.prefetch_requests)
+        for (klass, accessor) in self._cache_accessors.items():
+            add_requests(klass.__name__, accessor.prefetchRequests)
+
+        jobs = [ (self._cache_accessors[klass], items)
+                 for (klass, items) in requests.items()
+                 if items ]
+        if not jobs:
+            return
+
+        logger.debug("Prefetching data for %s",
+                     ", ".join( "%s (%d items)"%(acc.cacheName(), len(items))
+                                for (acc, items) in jobs ))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [ (accessor, executor.submit(accessor.prefetch, items))
+                        for (accessor, items) in jobs ]
+            for (accessor, future) in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.debug("Error while prefetching data for %s (ignored): %s: %s",
+                                 accessor.cacheName(), e.__class__.__name__, e)
         
 
     def setDefaultCacheInvalidationTime(self, time_delta):
@@ -637,6 +793,73 @@ class BibolamaziFile:
             return
 
         self._user_cache.setDefaultInvalidationTime(time_delta)
+        self._shared_cache.setDefaultInvalidationTime(time_delta)
+
+    def cacheStatistics(self):
+        """
+        Return the statistics collected during this run for all the sub-caches of
+        this file's own cache and of the shared cache, as a dictionary `{cache_name:
+        statistics}`.  The statistics are
+        :py:class:`~core.bibusercache.CacheStatistics` objects.
+
+        If a sub-cache was used both in this file's cache and in the shared cache
+        (e.g. when its data was moved to the shared cache), the statistics of the
+        shared cache are reported.
+        """
+        stats = self._user_cache.cacheStatistics()
+        if self._shared_cache_loaded:
+            stats.update(self._shared_cache.cacheStatistics())
+        return stats
+
+    def removeUnusedCaches(self):
+        """
+        Remove the sub-caches of this file's own cache which are not used by any
+        of the cache accessors requested by this file's filters, e.g. because a
+        filter was removed from the configuration section.  The sub-caches are
+        removed from the cache file the next time the cache is saved.
+
+        Returns the list of the names of the removed sub-caches.
+        """
+        used_cache_names = set([
+            accessor.cacheName()
+            for accessor in self._cache_accessors.values()
+            if accessor.cacheObject() is self._user_cache
+        ])
+        removed = []
+        for cache_name in list(self._user_cache.cachedic.dic.keys()):
+            if cache_name not in used_cache_names:
+                logger.debug("Removing unused cache ‘%s’", cache_name)
+                self._user_cache.removeCache(cache_name)
+                removed.append(cache_name)
+        return removed
+
+    def setCacheSizeLimits(self, max_items=None, max_bytes=None):
+        """
+        Limit the size of each sub-cache to `max_items` items and to `max_bytes`
+        bytes (either may be `None` for no limit).  When the cache is saved, the
+        least recently used items are evicted from the sub-caches which exceed
+        these limits (see
+        :py:meth:`~core.bibusercache.BibUserCache.enforceSizeLimits`).
+
+        These limits override any limits set with the ``cache: max-size=...``
+        command in the configuration section.  The limits apply to this file's
+        own cache as well as to the shared cache.
+        """
+        self._cache_size_limits_override = (max_items, max_bytes)
+
+    def cacheSizeLimits(self):
+        """
+        Return the size limits which apply to each sub-cache, as a tuple
+        `(max_items, max_bytes)`.  These are the limits set with
+        :py:meth:`setCacheSizeLimits()` if any, or else those set in the
+        configuration section with the ``cache: max-size=...`` command, or else
+        `(None, None)`.
+        """
+        if self._cache_size_limits_override is not None:
+            return self._cache_size_limits_override
+        if self._cache_size_limits is not None:
+            return self._cache_size_limits
+        return (None, None)
 
     def setConfigData(self, configdata):
         """
@@ -727,7 +950,8 @@ class BibolamaziFile:
         # cheat, we've loaded it manually
         self._load_state = BIBOLAMAZIFILE_LOADED
 
-        self._bibliographydata = pybtex.database.BibliographyData()
+        self._bibliographydata = _new_bibliography_data()
+        self._entry_fingerprints.invalidate()
 
         logger.longdebug('done with empty template init!')
 
@@ -911,6 +1135,7 @@ class BibolamaziFile:
         self._filterpath = PrependOrderedDict()
         self._filters = []
         self._cache_accessors = {}
+        self._cache_size_limits = None
 
         full_filter_path = self.fullFilterPath()
 
@@ -964,6 +1189,25 @@ class BibolamaziFile:
                 logger.debug("Added filter '"+filname+"': `"+filoptions.strip()+"'")
                 continue
 
+            if (cmd.cmd == "cache"):
+                try:
+                    cacheopts = shlex.split(cmd.text)
+                except ValueError as e:
+                    self._raise_parse_error("Syntax error in cache settings: %s"%(str(e)),
+                                            lineno=cmd.linenoend)
+                for cacheopt in cacheopts:
+                    optname, sep, optval = cacheopt.partition('=')
+                    if (optname == 'max-size' and sep):
+                        try:
+                            self._cache_size_limits = parse_cache_size_limits(optval)
+                        except ValueError as e:
+                            self._raise_parse_error(str(e), lineno=cmd.lineno)
+                        logger.debug("Cache size limits: %r", self._cache_size_limits)
+                        continue
+                    self._raise_parse_error("Invalid cache setting: `%s'" %(cacheopt),
+                                            lineno=cmd.lineno)
+                continue
+
             self._raise_parse_error("Unknown command: `%s'" %(cmd.cmd),
                                     lineno=cmd.lineno)
 
@@ -1047,19 +1291,15 @@ class BibolamaziFile:
         if num_conflicting_keys:
             logger.info(CONFLICT_KEY_INFO)
 
+        self.notifyEntryChanged()
+
         logger.info('{:+^80s}\n'.format(''))
 
         # Now, try to load the cache
         # --------------------------
         if self._use_cache:
             # then, try to load the cache if possible
-            cachefname = self.cacheFileName()
-            try:
-                with open(cachefname, 'rb') as f:
-                    logger.longdebug("Reading cache file %s", cachefname)
-                    self._user_cache.loadCache(f)
-            except (IOError, EOFError,):
-                logger.debug("Cache file `%s' nonexisting or not readable.", cachefname)
+            cachefile.load_cache_file(self._user_cache, self.cacheFileName())
 
         else:
             logger.debug("As requested, I have not attempted to load any existing cache file.")
@@ -1106,18 +1346,30 @@ class BibolamaziFile:
 
         # read data, decode it in the right charset
         data = None
-        if is_url:
+        if is_url and not re.match(r'^https?://', src, flags=re.IGNORECASE):
+            # e.g. file:// or ftp:// -- the transport layer only speaks HTTP
             logger.debug("Opening URL %r", src)
             try:
-                f = urlopen(src)
-                if (f is None):
-                    return (False,0)
-                data = butils.guess_encoding_decode(f.read())
-                logger.longdebug(" ... successfully read %d chars from URL resouce.", len(data))
-                f.close()
-            except IOError:
+                with urlopen(src) as f:
+                    data = butils.guess_encoding_decode(f.read())
+            except (IOError, ValueError):
                 # ignore source, will have to try next in list
                 return (False,0)
+            logger.longdebug(" ... successfully read %d chars from URL resouce.", len(data))
+        elif is_url:
+            logger.debug("Opening URL %r", src)
+            try:
+                r = transport.get(src)
+            except transport.TransportError as e:
+                logger.debug("Couldn't fetch %s: %s", src, e)
+                # ignore source, will have to try next in list
+                return (False,0)
+            if r.status_code != 200:
+                logger.debug("Couldn't fetch %s: HTTP %d", src, r.status_code)
+                # ignore source, will have to try next in list
+                return (False,0)
+            data = butils.guess_encoding_decode(r.content)
+            logger.longdebug(" ... successfully read %d chars from URL resouce.", len(data))
         else:
             logger.debug("Opening file %r", src)
             try:
@@ -1143,7 +1395,7 @@ class BibolamaziFile:
 
             if (self._bibliographydata is None):
                 # initialize bibliography data
-                self._bibliographydata = pybtex.database.BibliographyData()
+                self._bibliographydata = _new_bibliography_data()
 
             numconflictingkeys = 0
 
@@ -1182,17 +1434,21 @@ class BibolamaziFile:
             if hasattr(cacheaccessorinstance, '_bibolamazifile__initialized'):
                 continue
             #
+            # Determine in which cache object this accessor stores its data
+            #
+            cache_obj = self._cache_object_for(cacheaccessorinstance)
+            #
             # Ensure the existance of the cache dictionary instance in the cache
             #
-            self._user_cache.cacheFor(cacheaccessorinstance.cacheName())
+            cache_obj.cacheFor(cacheaccessorinstance.cacheName())
             #
             # Set the accessor's pointer to the cache object
             #
-            cacheaccessorinstance.setCacheObj(cache_obj=self._user_cache)
+            cacheaccessorinstance.setCacheObj(cache_obj=cache_obj)
             #
             # and initialize the cache accessor
             #
-            cacheaccessorinstance.initialize(self._user_cache)
+            cacheaccessorinstance.initialize(cache_obj)
             #
             # remember that we already initialized this cache
             #
@@ -1200,12 +1456,49 @@ class BibolamaziFile:
 
 
 
+    def _cache_object_for(self, cacheaccessorinstance):
+        """
+        Return the :py:class:`BibUserCache` object (either this file's own cache or
+        the shared cache) in which the given accessor should store its data.
+        """
+        if not (self._use_shared_cache and cacheaccessorinstance.shared_cache):
+            return self._user_cache
+
+        self._load_shared_cache()
+
+        # Caches written by older versions of bibolamazi have this data in the
+        # file's own cache.  Move it to the shared cache (unless the shared cache
+        # already has some data), and in any case remove it from our own cache.
+        cache_name = cacheaccessorinstance.cacheName()
+        olddic = self._user_cache.removeCache(cache_name)
+        if olddic is not None:
+            if cache_name not in self._shared_cache.cachedic:
+                logger.debug("Moving cache ‘%s’ to the shared cache", cache_name)
+                self._shared_cache.cachedic[cache_name] = olddic
+
+        return self._shared_cache
+
+    def _load_shared_cache(self):
+        if self._shared_cache_loaded:
+            return
+        self._shared_cache_loaded = True
+
+        if not self._use_cache:
+            logger.debug("As requested, I have not attempted to load the shared cache.")
+            return
+
+        # the shared cache is written by this version of bibolamazi in its
+        # data-only format, never unpickle anything from it
+        cachefile.load_cache_file(self._shared_cache, self.sharedCacheFileName(),
+                                  allow_pickle=False)
+
     def setBibliographyData(self, bibliographydata):
         """
         Set the `bibliographydata` database object directly.
 
         The object `bibliographydata` should be of instance
-        :py:class:`pybtex.database.BibliographyData`.
+        :py:class:`pybtex.database.BibliographyData`.  Its entries are stored
+        in an :py:class:`~core.entrydict.EntryDict` if they aren't already.
 
         .. warning:: Filters should NOT set a different bibliographydata object:
                      caches might have kept a pointer to this object (see, for
@@ -1213,7 +1506,10 @@ class BibolamaziFile:
                      :py:class:`~core.bibusercache.tokencheckers.EntryFieldsTokenChecker`). Please
                      use :py:meth:`setEntries()` instead.
         """
+        if not isinstance(bibliographydata.entries, EntryDict):
+            bibliographydata.entries = EntryDict(bibliographydata.entries.items())
         self._bibliographydata = bibliographydata
+        self.notifyEntryChanged()
 
     def setEntries(self, bibentries):
         """
@@ -1237,8 +1533,9 @@ class BibolamaziFile:
         # NOTE: Don't just set _bibliographydata to a new object, see warning in
         # doc of setBibliographyData().
         
-        self._bibliographydata.entries = OrderedCaseInsensitiveDict()
+        self._bibliographydata.entries = EntryDict()
         self._bibliographydata.add_entries(bibentries)
+        self.notifyEntryChanged()
 
 
     def runFilter(self, filter_instance):
@@ -1280,9 +1577,14 @@ class BibolamaziFile:
             #
             if (action == BibFilter.BIB_FILTER_BIBOLAMAZIFILE):
 
-                with _WrapFilterAction(self, logger, filtername, filter_instance):
+                try:
+                    with _WrapFilterAction(self, logger, filtername, filter_instance):
+
+                        filter_instance.filter_bibolamazifile(self)
 
-                    filter_instance.filter_bibolamazifile(self)
+                finally:
+                    # the filter may have changed any entry
+                    self.notifyEntryChanged()
 
                 logger.debug('filter ‘%s’ processed the full bibolamazifile.',
                              filter_instance.name())
@@ -1299,6 +1601,7 @@ class BibolamaziFile:
                     bibdata = self.bibliographyData()
                     for (k, entry) in bibdata.entries.items():
                         filter_instance.filter_bibentry(entry)
+                        self.notifyEntryChanged(k)
 
                 logger.debug('filter %s processed all the bibliographic entries.',
                              filter_instance.name())
@@ -1437,19 +1740,38 @@ class BibolamaziFile:
                   automatically saved and a separate call to `saveCache()` is
                   not necessary.
 
+        The shared cache (see :py:meth:`sharedCacheFileName()`) is saved as
+        well, unless `cachefname=False`.
+
+        Cache files are written atomically while holding a lock on the file
+        (see :py:mod:`~core.bibusercache.cachefile`).  Any valid data written
+        to the same file by another bibolamazi process since we loaded the
+        cache is merged into our cache before saving.  (This does not happen
+        for this file's own cache if we were asked not to use any existing
+        cache; it always happens for the shared cache, so that we don't wipe
+        out data that other bibolamazi files rely on.)
+
+        The least recently used items are evicted from the sub-caches which are
+        larger than the limits given by :py:meth:`cacheSizeLimits()`.
+
         Warning: This method will silently overwrite any existing file of the
         same name.
         """
         
         _, cachefname = self._get_fname_and_cachefname(None, cachefname)
 
-        if (cachefname and self._user_cache and self._user_cache.hasCache()):
-            try:
-                with open(cachefname, 'wb') as f:
-                    logger.debug("Writing cache to file ‘%s’", cachefname)
-                    self._user_cache.saveCache(f)
-            except IOError as e:
-                logger.debug("Error saving cache to file ‘%s’: %s", cachefname, e)
+        max_items, max_bytes = self.cacheSizeLimits()
+        self._user_cache.setSizeLimits(max_items, max_bytes)
+        self._shared_cache.setSizeLimits(max_items, max_bytes)
+
+        # (also save if sub-caches were removed, even if the cache is now empty)
+        if (cachefname and self._user_cache and
+            (self._user_cache.hasCache() or self._user_cache.removed_cache_names)):
+            cachefile.save_cache_file(self._user_cache, cachefname, merge=self._use_cache)
+
+        if (cachefname and self._shared_cache_loaded and self._shared_cache.hasCache()):
+            cachefile.save_cache_file(self._shared_cache, self.sharedCacheFileName(), merge=True,
+                                      allow_pickle=False)
 
 
 
@@ -27,6 +27,8 @@ except ImportError:
     from collections import MutableMapping, MutableSequence
 
 
+import re
+import time
 import inspect
 import pickle
 import traceback
@@ -57,6 +59,182 @@ def _to_bibusercacheobj(obj, parent):
 
 
 
+def _pickle_detached(obj):
+    # pickle a cached object, without following the pointer to the parent cache
+    # dictionary, which would pickle the whole cache
+    parent = None
+    if isinstance(obj, (BibUserCacheDic, BibUserCacheList)):
+        parent = obj.parent
+        obj.parent = None
+    try:
+        return pickle.dumps(obj, protocol=2)
+    finally:
+        if parent is not None:
+            obj.parent = parent
+
+def _pickled_size(obj):
+    # estimate the size of a cached object
+    try:
+        return len(_pickle_detached(obj))
+    except Exception as e:
+        logger.debug("Can't determine size of cached object: %s", e)
+        return 0
+
+def _stored_sizes(cache_name, subdic, items):
+    # Return (total_bytes, item_sizes), where total_bytes is the size of the
+    # sub-cache in the cache file.  Items are compressed together, so the share
+    # of each item is estimated from the length of its encoded representation.
+    from . import cacheformat
+    total_bytes = cacheformat.stored_size(cache_name, subdic)
+    try:
+        raw_sizes = [ cacheformat.encoded_length(dic.dic[k]) for (dic, k) in items ]
+    except (cacheformat.UnsupportedTypeError, ValueError):
+        # this sub-cache is pickled
+        raw_sizes = [ _pickled_size(dic.dic[k]) for (dic, k) in items ]
+    scale = float(total_bytes) / max(1, sum(raw_sizes))
+    return (total_bytes, [ scale*sz for sz in raw_sizes ])
+
+
+def _cache_items(subdic):
+    # the items of a sub-cache, as pairs (dic, key), in the sense of
+    # BibUserCache.enforceSizeLimits()
+    items = []
+    for key, val in subdic.dic.items():
+        if isinstance(val, BibUserCacheDic):
+            items += [ (val, k) for k in val.dic.keys() ]
+        else:
+            items.append( (subdic, key) )
+    return items
+
+
+_rx_size_limit = re.compile(r'^\s*(?P<num>\d+)\s*(?P<unit>(?:[kmg]i?)?b?)\s*$', flags=re.IGNORECASE)
+
+_size_units = {
+    '': 1,
+    'k': 1024,
+    'm': 1024*1024,
+    'g': 1024*1024*1024,
+}
+
+def parse_cache_size_limits(spec):
+    """
+    Parse a cache size limit specification, as given to the ``--cache-max-size``
+    command-line option or the ``cache: max-size=...`` configuration command.
+
+    The specification is a comma-separated list of at most one item count (a
+    plain integer, e.g. ``5000``) and at most one size in bytes (an integer
+    followed by a unit, e.g. ``20MB``, ``500k`` or ``1000B``; the units `K`, `M`
+    and `G` are powers of 1024).  The special value ``none`` means no limits.
+
+    Returns a tuple `(max_items, max_bytes)`, where either value may be `None`
+    if it was not specified.  Raises `ValueError` if `spec` is invalid.
+    """
+    max_items = None
+    max_bytes = None
+    if spec.strip().lower() in ('', 'none'):
+        return (None, None)
+    for part in spec.split(','):
+        m = _rx_size_limit.match(part)
+        if m is None:
+            raise ValueError("Invalid cache size limit: ‘{}’".format(part.strip()))
+        unit = m.group('unit').lower()
+        if not unit:
+            if max_items is not None:
+                raise ValueError("Item count specified twice in cache size limit ‘{}’"
+                                 .format(spec))
+            max_items = int(m.group('num'))
+            continue
+        if max_bytes is not None:
+            raise ValueError("Size in bytes specified twice in cache size limit ‘{}’"
+                             .format(spec))
+        max_bytes = int(m.group('num')) * _size_units[unit.rstrip('b').rstrip('i')]
+    return (max_items, max_bytes)
+
+
+
+
+class CacheStatistics:
+    """
+    Counters which keep track of how effective a sub-cache is during a single run
+    of bibolamazi.  These are not stored in the cache file.
+
+    Get these objects with :py:meth:`BibUserCache.cacheStatistics` or
+    :py:meth:`BibUserCacheAccessor.cacheStatistics`.
+
+    Attributes:
+
+      - `cache_name`: the name of the sub-cache;
+
+      - `hits`, `misses`: the number of times an existing item was read from the
+        sub-cache, and the number of times a missing item was requested (read or
+        tested for with ``in``).  Only the items of the dictionaries contained
+        in the sub-cache are counted (e.g. individual arXiv IDs in
+        ``cacheFor('arxiv_fetched_api_info')['fetched']``);
+
+      - `invalidations`: a dictionary `{token_checker_class_name: count}` of
+        items which were found to be out of date, by the token checker which
+        invalidated them;
+
+      - `network_fetches`: the number of network requests issued by the cache
+        accessor to fill the sub-cache (see
+        :py:meth:`BibUserCacheAccessor.recordNetworkFetch`);
+
+      - `bytes_loaded`, `bytes_saved`: the size of the sub-cache's data which
+        was read from and written to the cache file.
+    """
+    def __init__(self, cache_name, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_name = cache_name
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = {}
+        self.network_fetches = 0
+        self.bytes_loaded = 0
+        self.bytes_saved = 0
+
+    def record_invalidation(self, tokenchecker):
+        """
+        Count an invalidated item.  `tokenchecker` is the token checker instance
+        which invalidated the item.
+        """
+        name = type(tokenchecker).__name__
+        self.invalidations[name] = self.invalidations.get(name, 0) + 1
+
+    def num_invalidations(self):
+        """
+        Return the total number of invalidated items.
+        """
+        return sum(self.invalidations.values())
+
+    def as_dict(self):
+        """
+        Return the counters as a python dictionary.
+        """
+        return {
+            'cache_name': self.cache_name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': dict(self.invalidations),
+            'network_fetches': self.network_fetches,
+            'bytes_loaded': self.bytes_loaded,
+            'bytes_saved': self.bytes_saved,
+        }
+
+    def __str__(self):
+        invalidations = "{} invalidated".format(self.num_invalidations())
+        if self.invalidations:
+            invalidations += " ({})".format(", ".join([
+                "{}: {}".format(k, v) for k, v in sorted(self.invalidations.items())
+            ]))
+        return ("{}: {} hits, {} misses, {}, {} network fetches, "
+                "{} bytes loaded, {} bytes saved").format(
+                    self.cache_name, self.hits, self.misses, invalidations,
+                    self.network_fetches, self.bytes_loaded, self.bytes_saved
+                )
+
+    def __repr__(self):
+        return 'CacheStatistics(%r)' %(self.as_dict())
+
 
 
 class BibUserCacheDic(MutableMapping):
@@ -87,9 +265,16 @@ class BibUserCacheDic(MutableMapping):
     def _init_empty(self, on_set_bind_to_key=None, parent=None):
         self.dic = {}
         self.tokens = {}
+        # time of last access of each item (see access_time())
+        self.access_times = {}
         self.tokenchecker = None
         self._on_set_bind_to_key = on_set_bind_to_key
         self.parent = parent
+        # statistics -- not saved in the cache file.  `stats` is set on the
+        # dictionaries of each sub-cache by BibUserCache; `stats_for_item` is
+        # set on the root dictionary.
+        self.stats = None
+        self.stats_for_item = None
 
     def _guess_name_for_dbg(self):
         if not self.parent:
@@ -180,11 +365,100 @@ class BibUserCacheDic(MutableMapping):
         # don't know what type the value is. This way is safe, because if getitem is
         # called, automatically an empty dic will be created.
         logger.longdebug("Cache item `%s' is NO LONGER VALID; trashing.", key)
+        self._record_invalidation(key, val)
         del self.dic[key]
         if key in self.tokens:
             del self.tokens[key]
+        self.access_times.pop(key, None)
         return False
 
+    def _find_stats(self):
+        d = self
+        while d is not None:
+            if d.stats is not None:
+                return d.stats
+            d = d.parent
+        return None
+
+    def _record_invalidation(self, key, val):
+        if self.stats_for_item is not None:
+            stats = self.stats_for_item(key)
+        else:
+            stats = self._find_stats()
+        if stats is None:
+            return
+        try:
+            chk = self.tokenchecker.failed_checker(key=key, value=val,
+                                                   oldtoken=self.tokens.get(key, None))
+        except Exception:
+            chk = self.tokenchecker
+        stats.record_invalidation(chk)
+
+    def access_time(self, key):
+        """
+        Return the time (as given by `time.time()`) at which the item `key` was
+        last read or written, or `0` if this is not known (e.g. the item was
+        loaded from a cache file written by an older version of bibolamazi).
+        """
+        return self.access_times.get(key, 0)
+
+    def evict(self, key):
+        """
+        Remove the item `key` from this dictionary, in order to reduce the size of
+        the cache.
+
+        Contrary to `del dic[key]`, this does not count as a change of the
+        dictionary's contents, i.e., the validation tokens of the parent
+        dictionaries are not updated (which would e.g. postpone the expiry date
+        of the cache).
+        """
+        del self.dic[key]
+        self.tokens.pop(key, None)
+        self.access_times.pop(key, None)
+
+    def merge_from(self, other):
+        """
+        Merge the items of the :py:class:`BibUserCacheDic` `other` into this
+        dictionary.
+
+        Items of `other` whose key is not present in this dictionary are added,
+        along with their validation token, provided they are deemed valid by this
+        dictionary's token checker (if any).  If both dictionaries have a
+        :py:class:`BibUserCacheDic` value for the same key, they are merged
+        recursively.  Otherwise, our own value is kept.
+
+        The validation tokens of this dictionary's existing items are not
+        updated.  This is used to merge the data saved by a concurrent bibolamazi
+        process into our cache before saving it.
+        """
+        for key, val in other.dic.items():
+            if key in self.dic:
+                ourval = self.dic[key]
+                if isinstance(ourval, BibUserCacheDic) and isinstance(val, BibUserCacheDic):
+                    ourval.merge_from(val)
+                if other.access_time(key) > self.access_time(key):
+                    self.access_times[key] = other.access_times[key]
+                continue
+
+            oldtoken = other.tokens.get(key, None)
+            if self.tokenchecker:
+                try:
+                    ok = self.tokenchecker.cmp_tokens(key=key, value=val, oldtoken=oldtoken)
+                except Exception as e:
+                    logger.debug("%s: Got exception in cmp_tokens() while merging: %s", key, e)
+                    ok = False
+                if not ok:
+                    logger.longdebug("Not merging invalid cache item `%s' into `%s'",
+                                     key, self._guess_name_for_dbg())
+                    continue
+
+            logger.longdebug("Merging cache item `%s' into `%s'", key, self._guess_name_for_dbg())
+            self.dic[key] = _to_bibusercacheobj(val, parent=self)
+            if key in other.tokens:
+                self.tokens[key] = oldtoken
+            if key in other.access_times:
+                self.access_times[key] = other.access_times[key]
+
     def token_for(self, key):
         """
         Return the token that was stored associated with the given `key`.
@@ -222,10 +496,19 @@ class BibUserCacheDic(MutableMapping):
             
 
     def __getitem__(self, key):
-        return self.dic.get(key, BibUserCacheDic({}, parent=self, on_set_bind_to_key=key))
+        stats = self.parent.stats if self.parent is not None else None
+        if key not in self.dic:
+            if stats is not None:
+                stats.misses += 1
+            return BibUserCacheDic({}, parent=self, on_set_bind_to_key=key)
+        if stats is not None:
+            stats.hits += 1
+        self.access_times[key] = time.time()
+        return self.dic[key]
 
     def __setitem__(self, key, val):
         self.dic[key] = _to_bibusercacheobj(val, parent=self)
+        self.access_times[key] = time.time()
         self._do_pending_bind()
         # assume that we __setitem__ is called, the value is up-to-date, ie. update the
         # corresponding token.
@@ -235,6 +518,7 @@ class BibUserCacheDic(MutableMapping):
         del self.dic[key]
         if key in self.tokens:
             del self.tokens[key]
+        self.access_times.pop(key, None)
         if self.parent:
             self.parent.child_notify_changed(self)
 
@@ -248,7 +532,12 @@ class BibUserCacheDic(MutableMapping):
         return len(self.dic)
 
     def __contains__(self, key):
-        return key in self.dic
+        if key in self.dic:
+            # counted as a hit when the item is actually read
+            return True
+        if self.parent is not None and self.parent.stats is not None:
+            self.parent.stats.misses += 1
+        return False
 
 
     def child_notify_changed(self, obj):
@@ -289,6 +578,8 @@ class BibUserCacheDic(MutableMapping):
         self.parent = state['parent']
         self.dic = state['cache']
         self.tokens = state['tokens']
+        # access times were not stored by older versions
+        self.access_times = state.get('access', {})
 
 
     def __getstate__(self):
@@ -296,6 +587,7 @@ class BibUserCacheDic(MutableMapping):
             'parent': self.parent,
             'cache': self.dic,
             'tokens': self.tokens,
+            'access': self.access_times,
             }
         return state
 
@@ -353,7 +645,14 @@ class BibUserCache:
     """
     def __init__(self, cache_version=None):
         logger.longdebug("BibUserCache: Constructor!")
+        self.cache_version = cache_version
+        # statistics for each sub-cache, see cacheStatistics()
+        self.statistics = {}
         self.cachedic = BibUserCacheDic({})
+        self.cachedic.stats_for_item = self.cacheStatistics
+        # names of sub-caches which were removed with removeCache() and which
+        # should not be merged back by mergeCache()
+        self.removed_cache_names = set()
         self.entry_validation_checker = tokencheckers.TokenCheckerPerEntry()
         self.comb_validation_checker = tokencheckers.TokenCheckerCombine(
             tokencheckers.VersionTokenChecker(cache_version),
@@ -363,6 +662,15 @@ class BibUserCache:
         # an instance of an expiry_checker that several entries might share in
         # self.entry_validation_checker.
         self.expiry_checker = tokencheckers.TokenCheckerDate()
+        # size limits per sub-cache, see setSizeLimits()
+        self.max_items = None
+        self.max_bytes = None
+
+    def cacheVersion(self):
+        """
+        Return the cache version given to the constructor.
+        """
+        return self.cache_version
 
     def setDefaultInvalidationTime(self, time_delta):
         """
@@ -372,6 +680,100 @@ class BibUserCache:
         self.expiry_checker.set_time_valid(time_delta)
 
 
+    def setSizeLimits(self, max_items=None, max_bytes=None):
+        """
+        Set limits on the size of each sub-cache.  The limits are enforced when
+        the cache is saved (see :py:meth:`enforceSizeLimits`).
+
+        Arguments:
+
+          - `max_items`: the maximal number of items to keep in each sub-cache,
+            or `None` for no limit;
+
+          - `max_bytes`: the maximal size in bytes of each sub-cache in the cache
+            file, or `None` for no limit.
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+    def sizeLimits(self):
+        """
+        Return the size limits set with :py:meth:`setSizeLimits` as a tuple
+        `(max_items, max_bytes)`.
+        """
+        return (self.max_items, self.max_bytes)
+
+    def enforceSizeLimits(self):
+        """
+        Remove the least recently used items from each sub-cache which is larger
+        than the limits set with :py:meth:`setSizeLimits`.
+
+        The items of a sub-cache are the items of the dictionaries it contains
+        (e.g. the individual arXiv IDs in ``cacheFor('arxiv_fetched_api_info')
+        ['fetched']``), or the sub-cache's own items if they are not
+        dictionaries.  Items which were not accessed for the longest time are
+        evicted first (see :py:meth:`BibUserCacheDic.access_time`).
+
+        Returns the number of items that were evicted.
+        """
+        if self.max_items is None and self.max_bytes is None:
+            return 0
+
+        num_evicted = 0
+        for cache_name, subdic in list(self.cachedic.dic.items()):
+            if not isinstance(subdic, BibUserCacheDic):
+                continue
+
+            items = _cache_items(subdic)
+
+            sizes = None
+            total_bytes = 0
+            if self.max_bytes is not None:
+                (total_bytes, sizes) = _stored_sizes(cache_name, subdic, items)
+
+            num_items = len(items)
+            if ((self.max_items is None or num_items <= self.max_items) and
+                (self.max_bytes is None or total_bytes <= self.max_bytes)):
+                continue
+
+            order = sorted(range(len(items)),
+                           key=lambda j: items[j][0].access_time(items[j][1]))
+            n_before = num_evicted
+            for j in order:
+                if ((self.max_items is None or num_items <= self.max_items) and
+                    (self.max_bytes is None or total_bytes <= self.max_bytes)):
+                    break
+                (dic, k) = items[j]
+                dic.evict(k)
+                num_items -= 1
+                if sizes is not None:
+                    total_bytes -= sizes[j]
+                num_evicted += 1
+
+            logger.debug("Evicted %d least recently used items from cache ‘%s’",
+                         num_evicted - n_before, cache_name)
+
+        return num_evicted
+
+    def cacheNames(self):
+        """
+        Return a list of the names of the sub-caches present in this cache.
+        """
+        return list(self.cachedic.dic.keys())
+
+    def cacheSize(self, cache_name):
+        """
+        Return a tuple `(num_items, num_bytes)` with the number of items in the
+        sub-cache `cache_name` (in the sense of :py:meth:`enforceSizeLimits`)
+        and its size in bytes in the cache file.  Returns `(0, 0)` if there is
+        no such sub-cache.
+        """
+        from . import cacheformat
+        subdic = self.cachedic.dic.get(cache_name, None)
+        if not isinstance(subdic, BibUserCacheDic):
+            return (0, 0)
+        return (len(_cache_items(subdic)), cacheformat.stored_size(cache_name, subdic))
+
     def cacheFor(self, cache_name):
         """
         Returns the cache dictionary object for the given cache name. If the cache
@@ -379,10 +781,44 @@ class BibUserCache:
         """
         if not cache_name in self.cachedic:
             self.cachedic[cache_name] = {} # will be turned into a BibUserCacheDic automatically
+            self.removed_cache_names.discard(cache_name)
 
-        return self.cachedic[cache_name]
+        dic = self.cachedic[cache_name]
+        dic.stats = self.cacheStatistics(cache_name)
+        return dic
 
 
+    def cacheStatistics(self, cache_name=None):
+        """
+        Return the :py:class:`CacheStatistics` object which collects statistics
+        for the sub-cache `cache_name` during this run.
+
+        If `cache_name` is `None`, then return a dictionary `{cache_name:
+        CacheStatistics-instance}` with the statistics of all the sub-caches
+        which were used, loaded, or saved.
+        """
+        if cache_name is None:
+            return dict(self.statistics)
+        if cache_name not in self.statistics:
+            self.statistics[cache_name] = CacheStatistics(cache_name)
+        return self.statistics[cache_name]
+
+
+    def removeCache(self, cache_name):
+        """
+        Remove the cache dictionary for the given cache name, and return it (or
+        `None` if there was no such cache).
+
+        The cache will not be brought back by :py:meth:`mergeCache` when this
+        cache is saved, unless it is created again with :py:meth:`cacheFor`.
+        """
+        if cache_name not in self.cachedic:
+            return None
+        olddic = self.cachedic[cache_name]
+        del self.cachedic[cache_name]
+        self.removed_cache_names.add(cache_name)
+        return olddic
+
     def cacheExpirationTokenChecker(self):
         """
         Returns a cache expiration token checker validator which is configured with
@@ -447,48 +883,83 @@ class BibUserCache:
         """
         return bool(self.cachedic)
 
-    def loadCache(self, cachefobj):
+    def loadCache(self, cachefobj, allow_pickle=True):
         """
-        Load the cache from a file-like object `cachefobj`.
+        Load the cache from a binary file-like object `cachefobj`.
+
+        The cache may be stored in the data-only format of
+        :py:mod:`~core.bibusercache.cacheformat`, or may have been pickled by
+        an older version of bibolamazi.  If `allow_pickle` is `False`, pickled
+        data is ignored.  (Only use pickled data if you trust its source.)
 
-        This tries to unpickle the data and restore the cache. If the loading
-        fails, e.g.  because of an I/O error, the exception is logged but
-        ignored, and an empty cache is initialized.
+        If the loading fails, e.g.  because of an I/O error, the exception is
+        logged but ignored, and an empty cache is initialized.
 
         Note that at this stage only the basic validation is performed; the
         cache accessors should then each initialize their own subcaches with
         possibly their own specialized validators.
         """
+        from . import cacheformat
+
         try:
-            data = pickle.load(cachefobj);
-            self.cachedic = data['cachedic']
+            rawdata = cachefobj.read()
+            if rawdata.startswith(cacheformat.MAGIC):
+                self.cachedic = cacheformat.read_cache(rawdata, allow_pickle=allow_pickle,
+                                                       stats_fn=self.cacheStatistics)
+            elif not allow_pickle:
+                raise ValueError("Not loading pickled cache data")
+            else:
+                data = pickle.loads(rawdata)
+                self.cachedic = data['cachedic']
         except Exception as e:
-            logger.longdebug("EXCEPTION IN pickle.load():\n%s", traceback.format_exc())
-            logger.debug("IGNORING EXCEPTION IN pickle.load(): %s.", e)
+            logger.longdebug("EXCEPTION WHILE LOADING CACHE:\n%s", traceback.format_exc())
+            logger.debug("IGNORING EXCEPTION WHILE LOADING CACHE: %s.", e)
             self.cachedic = BibUserCacheDic({})
-        
+
+        self.cachedic.stats_for_item = self.cacheStatistics
         self.cachedic.set_validation(self.comb_validation_checker)
 
+    def mergeCache(self, other_cache):
+        """
+        Merge the data of the :py:class:`BibUserCache` object `other_cache` into
+        this cache.
+
+        Data present in `other_cache` but not in this cache is added, if it is
+        valid according to the token checkers installed in this cache; data we
+        already have is kept.  See :py:meth:`BibUserCacheDic.merge_from`.
+
+        This is used to avoid losing the data written by a concurrent bibolamazi
+        process to the same cache file (see
+        :py:func:`~core.bibusercache.cachefile.save_cache_file`).
+        """
+        otherdic = other_cache.cachedic
+        if self.removed_cache_names:
+            otherdic = BibUserCacheDic()
+            otherdic.dic = dict([ (k, v) for (k, v) in other_cache.cachedic.dic.items()
+                                  if k not in self.removed_cache_names ])
+            otherdic.tokens = other_cache.cachedic.tokens
+            otherdic.access_times = other_cache.cachedic.access_times
+        self.cachedic.merge_from(otherdic)
+
     def saveCache(self, cachefobj):
         """
-        Saves the cache to the file-like object `cachefobj`. This dumps a pickle-d
-        version of the cache information into the stream.
+        Saves the cache to the binary file-like object `cachefobj`, in the
+        data-only format of :py:mod:`~core.bibusercache.cacheformat`.
+
+        The size limits set with :py:meth:`setSizeLimits` are enforced before
+        the cache is written.
         """
+        from . import cacheformat
 
-        #
-        # TODO: first, serialize self.cachedic using compression to reduce file size.
-        #
+        self.enforceSizeLimits()
 
-        data = {
-            # cache pickle versions for Bibolamazi versions:
-            #   --1.4:  <no information saved, incompatible>
-            #   1.5:    1
-            #   2.0+:   2
-            'cachepickleversion': 2,
-            'cachedic': self.cachedic,
-            }
+        # Format history:
+        #   --1.4:  <no information saved, incompatible>
+        #   1.5:    pickle, 'cachepickleversion': 1
+        #   2.0+:   pickle, 'cachepickleversion': 2
+        #   4.6+:   data-only format, see cacheformat.py
         logger.longdebug("Saving cache. Cache keys are: %r", self.cachedic.dic.keys())
-        pickle.dump(data, cachefobj, protocol=2)
+        cacheformat.write_cache(self.cachedic, cachefobj, stats_fn=self.cacheStatistics)
 
 
 
@@ -557,7 +1028,19 @@ class BibUserCacheAccessor:
     parent constructor. The `cache_name` argument of this constructor should be
     a fixed string passed by the subclass, identifying this cache
     (e.g. 'arxiv_info').
+
+    Accessors whose data does not depend on the bibolamazi file (for instance,
+    information fetched from a web service, which is the same for everyone)
+    should set the class attribute :py:attr:`shared_cache` to `True`.  Their
+    data is then stored in a user-level cache which is shared by all bibolamazi
+    files, instead of in the cache file of each bibolamazi file.
     """
+
+    #: Set this class attribute to `True` in subclasses whose cached data is
+    #: independent of the bibolamazi file, so that it is stored in the shared
+    #: user-level cache.  See
+    #: :py:meth:`~core.bibolamazifile.BibolamaziFile.sharedCacheFileName`.
+    shared_cache = False
     
     def __init__(self, cache_name, bibolamazifile, **kwargs):
         super().__init__(**kwargs)
@@ -633,6 +1116,59 @@ class BibUserCacheAccessor:
         return self._cache_obj
 
 
+    def cacheStatistics(self):
+        """
+        Return the :py:class:`CacheStatistics` object for this accessor's cache.
+        """
+        return self._cache_obj.cacheStatistics(self.cacheName())
+
+
+    def recordNetworkFetch(self, num_requests=1):
+        """
+        Accessors which fetch information over the network should call this
+        function for each request they issue, in order to keep track of how
+        often the cache failed to spare us a network request (see
+        :py:meth:`cacheStatistics`).
+        """
+        self._cache_obj.cacheStatistics(self.cacheName()).network_fetches += num_requests
+
+
+    def prefetchRequests(self):
+        """
+        Return the items which other cache accessors will need to fetch from the
+        network in order for this accessor to work, as a dictionary ``{
+        AccessorClass: [ item1, item2, ... ], ... }``.  This allows accessors
+        which derive information from fetched data (for instance, the arXiv
+        information of each bibliography entry) to have the necessary data
+        fetched up front.  See
+        :py:meth:`~core.bibolamazifile.BibolamaziFile.prefetchCacheData`.
+
+        The default implementation returns an empty dictionary.
+        """
+        return {}
+
+
+    def prefetch(self, items):
+        """
+        Fetch the data for the given `items` (a list of items, as returned by
+        :py:meth:`~core.bibfilter.BibFilter.prefetch_requests` or
+        :py:meth:`prefetchRequests`), so that it is available in the cache when
+        the filters run.  Accessors that fetch data from the network should
+        reimplement this function; it is typically a call to the accessor's own
+        fetch function.
+
+        This function is called in a separate thread, at the same time as the
+        `prefetch()` functions of the other accessors.  It should only access
+        this accessor's own cache dictionary, and it should respect the rate
+        limits of the service it queries.  Errors may be reported by raising an
+        exception; they are logged and otherwise ignored, as the filters will
+        attempt to fetch any missing data again when they are run.
+
+        The default implementation does nothing.
+        """
+        pass
+
+
     def setCacheObj(self, cache_obj):
         """
         Sets the cache dictionary and cache object that will be returned by `cacheDic()`
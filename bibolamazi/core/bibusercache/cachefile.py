@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+Reading and writing cache files safely when several bibolamazi processes access
+the same cache file at the same time.
+
+Cache files are protected by an advisory lock on a separate lock file (see
+:py:func:`lock_file_name`): readers acquire a shared lock, and writers an
+exclusive lock.  New data is written to a temporary file which then atomically
+replaces the old cache file, so that readers never see a partially written
+cache.
+
+Before writing, the data currently on disk is merged into the cache that is
+about to be saved (see :py:meth:`~core.bibusercache.BibUserCache.mergeCache`),
+so that data which was saved by a concurrent process in the meantime is not
+lost.
+"""
+
+import os
+import os.path
+import time
+import binascii
+import hashlib
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+logger = logging.getLogger(__name__)
+
+
+
+def lock_file_name(cachefname):
+    """
+    Return the name of the lock file which protects the file `cachefname`.
+
+    Lock files are kept in the ``locks`` subdirectory of the directory of the
+    shared cache (see
+    :py:meth:`~core.bibolamazifile.BibolamaziFile.sharedCacheFileName()`), so
+    that no lock files are left next to the user's bibolamazi files.  (A lock
+    file can't be removed when the lock is released, as another process may be
+    waiting for a lock on it.)
+    """
+    # import here to avoid circular import
+    from ..bibolamazifile import BibolamaziFile
+
+    lockdir = os.path.join(os.path.dirname(BibolamaziFile.sharedCacheFileName()), 'locks')
+    fullname = os.path.realpath(os.path.abspath(cachefname))
+    return os.path.join(lockdir, '{}.{}.lock'.format(
+        os.path.basename(fullname),
+        hashlib.md5(fullname.encode('utf-8')).hexdigest()[:16]
+    ))
+
+
+class CacheFileLock:
+    """
+    Advisory lock protecting the cache file `cachefname`.  Use as a context
+    manager::
+
+        with CacheFileLock(cachefname, exclusive=True) as lock:
+            if lock.acquired:
+                ... # write the cache file
+
+    If `exclusive` is `False`, a shared lock is acquired, which allows several
+    processes to read the cache file at the same time.  (On platforms which don't
+    support shared locks, the lock is always exclusive.)
+
+    If the lock can't be acquired within `timeout` seconds, we give up and the
+    attribute `acquired` is set to `False`.  On platforms without any file
+    locking support, no lock is acquired but `acquired` is set to `True`.
+    """
+    def __init__(self, cachefname, exclusive=False, timeout=30, **kwargs):
+        super().__init__(**kwargs)
+        self.lockfname = lock_file_name(cachefname)
+        self.exclusive = exclusive
+        self.timeout = timeout
+        self.acquired = False
+        self._fobj = None
+
+    def __enter__(self):
+        if fcntl is None and msvcrt is None:
+            logger.debug("No file locking available on this platform, not locking %s",
+                         self.lockfname)
+            self.acquired = True
+            return self
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.lockfname)), exist_ok=True)
+            self._fobj = open(self.lockfname, 'a+b')
+        except (IOError, OSError) as e:
+            logger.debug("Can't open lock file %s: %s", self.lockfname, e)
+            return self
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self._do_lock()
+                self.acquired = True
+                return self
+            except (IOError, OSError):
+                pass
+            if time.monotonic() > deadline:
+                logger.warning("Timeout while waiting for lock on cache file %s",
+                               self.lockfname)
+                self._fobj.close()
+                self._fobj = None
+                return self
+            time.sleep(0.02)
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self._fobj is None:
+            return
+        try:
+            if self.acquired:
+                self._do_unlock()
+        except (IOError, OSError) as e:
+            logger.debug("Error while releasing lock %s: %s", self.lockfname, e)
+        finally:
+            self._fobj.close()
+            self._fobj = None
+
+    def _do_lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._fobj.fileno(),
+                        (fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+            return
+        self._fobj.seek(0)
+        msvcrt.locking(self._fobj.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _do_unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._fobj.fileno(), fcntl.LOCK_UN)
+            return
+        self._fobj.seek(0)
+        msvcrt.locking(self._fobj.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+
+def load_cache_file(cache, cachefname, allow_pickle=True):
+    """
+    Load the cache file `cachefname` into the
+    :py:class:`~core.bibusercache.BibUserCache` object `cache`, holding a shared
+    lock on the cache file.  Pickled data is only loaded if `allow_pickle` is
+    `True` (see :py:meth:`~core.bibusercache.BibUserCache.loadCache`).
+
+    Returns `True` if the cache file was read, or `False` if it doesn't exist or
+    couldn't be read.  (If the cache file is invalid, `cache` is reset to an
+    empty cache as described in
+    :py:meth:`~core.bibusercache.BibUserCache.loadCache`.)
+    """
+    with CacheFileLock(cachefname, exclusive=False):
+        try:
+            with open(cachefname, 'rb') as f:
+                logger.longdebug("Reading cache file %s", cachefname)
+                cache.loadCache(f, allow_pickle=allow_pickle)
+            return True
+        except (IOError, EOFError,):
+            logger.debug("Cache file `%s' nonexisting or not readable.", cachefname)
+            return False
+
+
+def save_cache_file(cache, cachefname, merge=True, allow_pickle=True):
+    """
+    Save the :py:class:`~core.bibusercache.BibUserCache` object `cache` to the file
+    `cachefname`, holding an exclusive lock on the cache file.
+
+    If `merge` is `True`, then any data which is in the existing cache file but
+    not in `cache` is merged into `cache` first (see
+    :py:meth:`~core.bibusercache.BibUserCache.mergeCache`); pickled data in the
+    existing file is only merged if `allow_pickle` is `True`.  The data is
+    written to a temporary file which then replaces `cachefname` atomically.
+
+    Errors are logged and ignored.  Returns `True` if the cache was written.
+    """
+    # import here to avoid circular import
+    from . import BibUserCache
+
+    with CacheFileLock(cachefname, exclusive=True) as lock:
+        if not lock.acquired:
+            logger.warning("Not saving cache file %s, couldn't lock it", cachefname)
+            return False
+
+        if merge and os.path.exists(cachefname):
+            ondisk = BibUserCache(cache_version=cache.cacheVersion())
+            try:
+                with open(cachefname, 'rb') as f:
+                    ondisk.loadCache(f, allow_pickle=allow_pickle)
+                cache.mergeCache(ondisk)
+            except (IOError, EOFError,) as e:
+                logger.debug("Couldn't read existing cache file %s to merge it: %s",
+                             cachefname, e)
+
+        return _write_cache_file(cache, cachefname)
+
+
+def rewrite_cache_file(cache, cachefname, update_fn=None, allow_pickle=True):
+    """
+    Load the cache file `cachefname` into the
+    :py:class:`~core.bibusercache.BibUserCache` object `cache`, call
+    `update_fn(cache)` (if `update_fn` is not `None`), and write the cache back
+    to `cachefname`.  The cache file is locked exclusively during the whole
+    operation, so that no data written by a concurrent bibolamazi process can
+    be lost.
+
+    This is meant for maintenance operations on the cache file, for instance
+    removing expired items.  Contrary to :py:func:`save_cache_file`, nothing is
+    merged back from the cache file after `update_fn` was called.  Pickled data
+    is only loaded if `allow_pickle` is `True`.
+
+    Returns `True` if the cache was written.
+    """
+    with CacheFileLock(cachefname, exclusive=True) as lock:
+        if not lock.acquired:
+            logger.warning("Not updating cache file %s, couldn't lock it", cachefname)
+            return False
+
+        try:
+            with open(cachefname, 'rb') as f:
+                cache.loadCache(f, allow_pickle=allow_pickle)
+        except (IOError, EOFError,) as e:
+            logger.debug("Cache file `%s' nonexisting or not readable: %s", cachefname, e)
+
+        if update_fn is not None:
+            update_fn(cache)
+
+        return _write_cache_file(cache, cachefname)
+
+
+def _write_cache_file(cache, cachefname):
+    # write the cache to a temporary file which then atomically replaces the
+    # cache file.  Must be called while holding an exclusive lock.
+    cachedir = os.path.dirname(os.path.abspath(cachefname))
+    tmpfname = None
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        fd, tmpfname = _create_temp_file(cachefname)
+        with os.fdopen(fd, 'wb') as f:
+            logger.debug("Writing cache to file ‘%s’", cachefname)
+            cache.saveCache(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpfname, cachefname)
+        tmpfname = None
+        return True
+    except (IOError, OSError) as e:
+        logger.debug("Error saving cache to file ‘%s’: %s", cachefname, e)
+        return False
+    finally:
+        if tmpfname is not None:
+            try:
+                os.remove(tmpfname)
+            except OSError:
+                pass
+
+
+def _create_temp_file(cachefname):
+    # Create a new temporary file next to `cachefname`.  Contrary to
+    # tempfile.mkstemp(), the file is created with the permissions a new file
+    # would get (as given by the umask); if the cache file already exists, its
+    # permissions are kept.
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        tmpfname = os.path.join(
+            os.path.dirname(os.path.abspath(cachefname)),
+            '.{}.{}.tmp'.format(os.path.basename(cachefname),
+                                binascii.hexlify(os.urandom(6)).decode('ascii'))
+        )
+        try:
+            fd = os.open(tmpfname, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        os.chmod(tmpfname, os.stat(cachefname).st_mode & 0o7777)
+    except OSError:
+        pass
+    return (fd, tmpfname)
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+A data-only file format for the bibolamazi cache.
+
+Contrary to python's `pickle`, loading a cache in this format never runs any
+code other than the reconstruction of a fixed set of types, so that cache files
+can safely be shared between users and machines, and the format does not depend
+on the module paths of the classes involved.
+
+A cache file consists of the magic string :py:data:`MAGIC`, followed by a
+header and by one data block per sub-cache.  The header and data blocks are
+zlib-compressed JSON documents.  Each sub-cache is stored in its own block, so
+that a corrupt sub-cache doesn't affect the others.
+
+The following python types can be stored: `None`, `bool`, `int`, `float`,
+`str`, `bytes`, `list`, `tuple`, `dict`, `set`, `datetime.datetime`,
+`datetime.timedelta`, as well as
+:py:class:`~core.bibusercache.BibUserCacheDic` and
+:py:class:`~core.bibusercache.BibUserCacheList`.  Further types can be made
+storable with :py:func:`register_object_codec`.  Sub-caches which contain other
+objects are pickled instead (see :py:func:`write_cache`).
+
+Dictionaries with string keys and lists are stored as the corresponding JSON
+values, so that a cache consisting of plain data loads about as fast as the
+JSON decoder can parse it.  The other types are stored as JSON objects whose
+key ``"$"`` identifies the type.
+"""
+
+import json
+import zlib
+import struct
+import base64
+import datetime
+import pickle
+import logging
+
+from . import BibUserCacheDic, BibUserCacheList
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'%BIBOLAMAZICACHE\n'
+"""
+The first bytes of a cache file in this format.
+"""
+
+FORMAT_VERSION = 1
+
+
+_object_codecs_by_type = {}
+_object_codecs_by_name = {}
+
+def register_object_codec(cls, name, encode, decode):
+    """
+    Make objects of the class `cls` storable in the cache.
+
+    The function `encode` is called with an instance of `cls` and should return
+    a value made of storable types (e.g. a `str` or a `dict` of `str`).  The
+    function `decode` is called with the value returned by `encode` and should
+    reconstruct the object.  The `name` is stored in the cache file to identify
+    the codec; it should be unique and should not change over time.
+
+    For instance, the arXiv cache accessor stores `arxiv2bib.Reference` objects
+    by their XML representation.
+    """
+    _object_codecs_by_type[cls] = (name, encode)
+    _object_codecs_by_name[name] = decode
+
+
+
+class UnsupportedTypeError(TypeError):
+    """
+    Raised by :py:func:`encode_value` if an object can't be stored.
+    """
+    pass
+
+
+def encode_value(obj):
+    """
+    Convert `obj` to a value which can be serialized with `json`.
+
+    Raises :py:exc:`UnsupportedTypeError` if `obj` contains an object which
+    can't be stored.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if type(obj) is dict:
+        return _encode_dict(obj)
+    if type(obj) is list:
+        return [ encode_value(x) for x in obj ]
+    if isinstance(obj, BibUserCacheDic):
+        d = { '$': 'D', 'v': _encode_dict(obj.dic) }
+        if obj.tokens:
+            d['T'] = _encode_dict(obj.tokens)
+        if obj.access_times:
+            d['A'] = _encode_dict(obj.access_times)
+        return d
+    if isinstance(obj, BibUserCacheList):
+        return { '$': 'L', 'v': [ encode_value(x) for x in obj.lst ] }
+    if type(obj) is tuple:
+        return { '$': 't', 'v': [ encode_value(x) for x in obj ] }
+    if type(obj) in (set, frozenset):
+        return { '$': 'S', 'v': [ encode_value(x) for x in obj ] }
+    if type(obj) is bytes:
+        return { '$': 'b', 'v': base64.b64encode(obj).decode('ascii') }
+    if type(obj) is datetime.datetime:
+        dt = [obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second, obj.microsecond]
+        if obj.tzinfo is not None:
+            dt.append(obj.utcoffset() // datetime.timedelta(seconds=1))
+        return { '$': 'dt', 'v': dt }
+    if type(obj) is datetime.timedelta:
+        return { '$': 'td', 'v': [obj.days, obj.seconds, obj.microseconds] }
+    codec = _object_codecs_by_type.get(type(obj), None)
+    if codec is not None:
+        name, encode = codec
+        return { '$': 'x', 'v': [ name, encode_value(encode(obj)) ] }
+    raise UnsupportedTypeError("Can't store object of type {} in cache".format(type(obj).__name__))
+
+def _encode_dict(d):
+    # Dictionaries with string keys are stored as JSON objects.  JSON objects
+    # with a '$' key are tagged values, which store the other types (see
+    # _decode_object()); dictionaries with a '$' key or with keys which aren't
+    # strings are stored as tagged flat lists [k1, v1, k2, v2, ...].
+    if '$' not in d and all(type(k) is str for k in d):
+        return dict([ (k, encode_value(v)) for (k, v) in d.items() ])
+    lst = []
+    for k, v in d.items():
+        lst.append(encode_value(k))
+        lst.append(encode_value(v))
+    return { '$': 'M', 'v': lst }
+
+
+def _set_parent(values, parent):
+    for v in values:
+        if type(v) is BibUserCacheDic or type(v) is BibUserCacheList:
+            v.parent = parent
+
+def _decode_object(d):
+    # This is called by the JSON decoder for each object, after its contents
+    # have been decoded, so it must be fast for plain dictionaries.
+    if '$' not in d:
+        return d
+    tag = d['$']
+    value = d['v']
+    if tag == 'D':
+        dic = BibUserCacheDic()
+        dic.dic = value
+        _set_parent(value.values(), dic)
+        if 'T' in d:
+            dic.tokens = d['T']
+        if 'A' in d:
+            dic.access_times = d['A']
+        return dic
+    if tag == 'L':
+        lst = BibUserCacheList()
+        lst.lst = value
+        _set_parent(value, lst)
+        return lst
+    if tag == 'M':
+        it = iter(value)
+        return dict(zip(it, it))
+    if tag == 't':
+        return tuple(value)
+    if tag == 'S':
+        return set(value)
+    if tag == 'b':
+        return base64.b64decode(value)
+    if tag == 'dt':
+        if len(value) > 7:
+            tz = datetime.timezone(datetime.timedelta(seconds=value[7]))
+            return datetime.datetime(*value[:7], tzinfo=tz)
+        return datetime.datetime(*value)
+    if tag == 'td':
+        return datetime.timedelta(*value)
+    if tag == 'x':
+        name, value = value
+        decode = _object_codecs_by_name.get(name, None)
+        if decode is None:
+            raise ValueError("Unknown object type in cache: {}".format(name))
+        return decode(value)
+    raise ValueError("Invalid object in cache: {!r}".format(tag))
+
+
+def _dump_block(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+def _load_block(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'), object_hook=_decode_object)
+
+
+
+def _dump_subcache(cache_name, subdic):
+    # returns (fmt, blob)
+    try:
+        return ('json', _dump_block(encode_value(subdic)))
+    except (UnsupportedTypeError, ValueError) as e:
+        logger.debug("Can't store cache %s as data, pickling it instead: %s", cache_name, e)
+    parent = subdic.parent
+    subdic.parent = None
+    try:
+        return ('pickle', pickle.dumps(subdic, protocol=2))
+    finally:
+        subdic.parent = parent
+
+
+def stored_size(cache_name, subdic):
+    """
+    Return the number of bytes which the sub-cache `subdic` takes in a cache file
+    written by :py:func:`write_cache`.
+    """
+    return len(_dump_subcache(cache_name, subdic)[1])
+
+
+def encoded_length(value):
+    """
+    Return the length of the (uncompressed) encoded representation of `value`.
+    Raises :py:exc:`UnsupportedTypeError` if `value` can't be stored in this
+    format.
+    """
+    return len(json.dumps(encode_value(value), separators=(',', ':')))
+
+
+
+def write_cache(cachedic, fobj, stats_fn=None):
+    """
+    Write the root cache dictionary `cachedic` (a
+    :py:class:`~core.bibusercache.BibUserCacheDic` whose values are the
+    sub-caches) to the binary file object `fobj`.
+
+    Sub-caches which contain objects which can't be stored in this format are
+    pickled instead, and a message is logged.
+
+    If `stats_fn` is not `None`, then `stats_fn(cache_name)` should return the
+    :py:class:`~core.bibusercache.CacheStatistics` object in which to record
+    the number of bytes written for that sub-cache.
+    """
+    blocks = []
+    subcaches = []
+    for cache_name, subdic in cachedic.dic.items():
+        (fmt, blob) = _dump_subcache(cache_name, subdic)
+        if stats_fn is not None:
+            stats_fn(cache_name).bytes_saved += len(blob)
+        subcaches.append( [cache_name, fmt, len(blob)] )
+        blocks.append(blob)
+
+    header = _dump_block({
+        'version': FORMAT_VERSION,
+        'tokens': _encode_dict(cachedic.tokens),
+        'access': _encode_dict(cachedic.access_times),
+        'subcaches': subcaches,
+    })
+
+    fobj.write(MAGIC)
+    fobj.write(struct.pack('>I', len(header)))
+    fobj.write(header)
+    for blob in blocks:
+        fobj.write(blob)
+
+
+def read_cache(data, allow_pickle=True, stats_fn=None):
+    """
+    Reconstruct the root cache dictionary from `data`, the contents of a cache
+    file written by :py:func:`write_cache` (a `bytes` object, starting with
+    :py:data:`MAGIC`).
+
+    If `allow_pickle` is `False`, then sub-caches which were pickled are
+    ignored.  Sub-caches which can't be read are ignored.
+
+    Raises `ValueError` if the header of the cache file is invalid.
+
+    If `stats_fn` is not `None`, then `stats_fn(cache_name)` should return the
+    :py:class:`~core.bibusercache.CacheStatistics` object in which to record
+    the number of bytes read for that sub-cache.
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a bibolamazi cache file")
+    pos = len(MAGIC)
+    (header_len,) = struct.unpack('>I', data[pos:pos+4])
+    pos += 4
+    try:
+        header = _load_block(data[pos:pos+header_len])
+    except (zlib.error, ValueError) as e:
+        raise ValueError("Invalid cache file header: {}".format(e))
+    pos += header_len
+    if header.get('version', None) != FORMAT_VERSION:
+        raise ValueError("Unsupported cache file format version: {}"
+                         .format(header.get('version', None)))
+
+    cachedic = BibUserCacheDic()
+    cachedic.tokens = header['tokens']
+    cachedic.access_times = header['access']
+
+    for (cache_name, fmt, blob_len) in header['subcaches']:
+        blob = data[pos:pos+blob_len]
+        pos += blob_len
+        try:
+            if fmt == 'json':
+                subdic = _load_block(blob)
+            elif fmt == 'pickle' and allow_pickle:
+                subdic = pickle.loads(blob)
+            else:
+                raise ValueError("won't load sub-cache stored as {}".format(fmt))
+            if not isinstance(subdic, BibUserCacheDic):
+                raise ValueError("invalid sub-cache")
+        except Exception as e:
+            logger.debug("Ignoring sub-cache %s: %s", cache_name, e)
+            cachedic.tokens.pop(cache_name, None)
+            continue
+        subdic.parent = cachedic
+        cachedic.dic[cache_name] = subdic
+        if stats_fn is not None:
+            stats_fn(cache_name).bytes_loaded += blob_len
+
+    return cachedic
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+Content fingerprints of bibliography entries.
+
+A *fingerprint* is an MD5 digest of an entry's type, of all its fields and of
+all its persons.  Two entries have the same fingerprint if and only if (up to
+hash collisions) they have the same contents.  The fingerprint does not depend
+on the entry key, nor on the order in which the fields were specified.
+
+The :py:class:`EntryFingerprintIndex` remembers the fingerprints of the entries
+of a bibolamazi file during a single run, so that token checkers, memoization
+layers and filters don't have to hash the same entries over and over again.
+"""
+
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+
+def entry_fingerprint(entry):
+    """
+    Compute the fingerprint of the :py:class:`pybtex.database.Entry` `entry`.
+
+    Returns a `bytes` object (an MD5 digest).
+    """
+    h = hashlib.md5()
+    h.update(entry.type.lower().encode('utf-8'))
+    for fld in sorted(entry.fields.keys(), key=lambda f: f.lower()):
+        h.update(b"\n\n" + fld.lower().encode('utf-8') + b"=" +
+                 entry.fields[fld].encode('utf-8'))
+    for role in sorted(entry.persons.keys()):
+        h.update(("\n\n" + role + ":" +
+                  ";".join([str(p) for p in entry.persons[role]])).encode('utf-8'))
+    return h.digest()
+
+
+
+class EntryFingerprintIndex:
+    """
+    Keeps track of the fingerprints of the entries of a bibolamazi file.
+
+    Fingerprints are computed lazily, the first time they are requested, and are
+    remembered until they are invalidated with :py:meth:`invalidate`.  The
+    :py:class:`~core.bibolamazifile.BibolamaziFile` invalidates the relevant
+    fingerprints whenever a filter had the chance to modify entries (see
+    :py:meth:`~core.bibolamazifile.BibolamaziFile.notifyEntryChanged`).
+
+    The index is meant to be used during a single run of bibolamazi; it is never
+    stored in the cache.  (The fingerprints themselves are stable across runs and
+    may be stored in the cache, though.)
+
+    Arguments:
+
+      - `bibliographydata_fn`: a callable which returns the current
+        :py:class:`pybtex.database.BibliographyData` object in which to look up
+        entries (typically the bibolamazi file's
+        :py:meth:`~core.bibolamazifile.BibolamaziFile.bibliographyData` method).
+    """
+    def __init__(self, bibliographydata_fn, **kwargs):
+        super().__init__(**kwargs)
+        self._bibliographydata_fn = bibliographydata_fn
+        self._fingerprints = {}
+
+    def fingerprint(self, key):
+        """
+        Return the fingerprint of the entry with the given `key`, or `None` if there
+        is no such entry.
+        """
+        lkey = key.lower() # entry keys are case-insensitive
+        try:
+            return self._fingerprints[lkey]
+        except KeyError:
+            pass
+
+        bibdata = self._bibliographydata_fn()
+        if bibdata is None:
+            return None
+        entry = bibdata.entries.get(key, None)
+        if entry is None:
+            return None
+
+        fp = entry_fingerprint(entry)
+        self._fingerprints[lkey] = fp
+        return fp
+
+    def invalidate(self, key=None):
+        """
+        Forget the fingerprint of the entry `key`, because the entry has changed.
+        If `key` is `None`, then all fingerprints are forgotten.
+        """
+        if key is None:
+            self._fingerprints.clear()
+            return
+        self._fingerprints.pop(key.lower(), None)
+
+    def __contains__(self, key):
+        return key.lower() in self._fingerprints
+
+    def __len__(self):
+        return len(self._fingerprints)
@@ -125,6 +125,18 @@ class TokenChecker:
             logger.debug("Got exception in TokenChecker.cmp_tokens: ignoring and invalidating: %s", e)
             return False
 
+    def failed_checker(self, key, value, oldtoken, **kwargs):
+        """
+        Return the token checker which is responsible for deeming the dictionary entry
+        `(key, value)` invalid.  This is only meant to be called for entries for which
+        :py:meth:`cmp_tokens` returned `False`, and is used to collect cache statistics.
+
+        The default implementation returns `self`.  Token checkers which delegate to
+        other token checkers (e.g. :py:class:`TokenCheckerCombine`) return the relevant
+        sub-checker.
+        """
+        return self
+
 
 class TokenCheckerDate(TokenChecker):
     """
@@ -198,6 +210,16 @@ class TokenCheckerCombine(TokenChecker):
     def new_token(self, key, value, **kwargs):
         return  tuple( (chk.new_token(key=key, value=value, **kwargs) for chk in self.subcheckers) )
 
+    def failed_checker(self, key, value, oldtoken, **kwargs):
+        try:
+            for k in range(len(self.subcheckers)):
+                chk = self.subcheckers[k]
+                if not chk.cmp_tokens(key=key, value=value, oldtoken=oldtoken[k], **kwargs):
+                    return chk.failed_checker(key=key, value=value, oldtoken=oldtoken[k], **kwargs)
+        except Exception:
+            pass
+        return self
+
 
 class TokenCheckerPerEntry(TokenChecker):
     """
@@ -270,6 +292,11 @@ class TokenCheckerPerEntry(TokenChecker):
             return True # no validation if we have no checkers
         return self.checkers[key].new_token(key=key, value=value, **kwargs)
 
+    def failed_checker(self, key, value, oldtoken, **kwargs):
+        if not key in self.checkers:
+            return self
+        return self.checkers[key].failed_checker(key=key, value=value, oldtoken=oldtoken, **kwargs)
+
 
 
 
@@ -279,6 +306,12 @@ class EntryFieldsTokenChecker(TokenChecker):
     bibliography entry have changed.
 
     This works by calculating a MD5 hash of the contents of the given fields.
+
+    Tokens are memoized per entry: the hash is only recalculated when one of the
+    checked fields, the type or the persons of the entry have changed since the
+    last time the token was computed.  (Changes are detected by comparing the
+    values themselves, so this also works for entries which are modified in
+    place.)
     """
     def __init__(self, bibdata, fields=[], store_type=False, store_persons=[], **kwargs):
         """
@@ -301,6 +334,8 @@ class EntryFieldsTokenChecker(TokenChecker):
         because `pybtex` treats the 'author' and 'editor' fields specially.
         """
         self.bibdata = bibdata
+        # memoized tokens: { lower-case-key: (token_inputs, token) }
+        self._memo_tokens = {}
         self.fields = fields
         self.store_type = store_type
         if (isinstance(store_persons, bool)):
@@ -311,8 +346,37 @@ class EntryFieldsTokenChecker(TokenChecker):
         super().__init__(**kwargs)
 
     def new_token(self, key, value, **kwargs):
-        entry = self.bibdata.entries.get(key,Entry('misc'))
+        entry = self.bibdata.entries.get(key, None)
+        if entry is None:
+            return self._calc_token(Entry('misc'))
+
+        # comparing the values is much cheaper than formatting the persons and
+        # hashing everything again
+        inputs = self._token_inputs(entry)
+        lkey = key.lower()
+        memo = self._memo_tokens.get(lkey, None)
+        if memo is not None and memo[0] == inputs:
+            return memo[1]
+
+        token = self._calc_token(entry)
+        self._memo_tokens[lkey] = (inputs, token)
+        return token
+
+    def _token_inputs(self, entry):
+        # everything _calc_token() depends on, as plain (copied) values
+        return (
+            entry.type if self.store_type else None,
+            tuple([ entry.fields.get(fld, '') for fld in self.fields ]),
+            tuple([
+                tuple([ (tuple(pers.first_names), tuple(pers.middle_names),
+                         tuple(pers.prelast_names), tuple(pers.last_names),
+                         tuple(pers.lineage_names))
+                        for pers in entry.persons.get(p, []) ])
+                for p in self.store_persons
+            ]),
+        )
 
+    def _calc_token(self, entry):
         data = b"\n\n".join( (entry.fields.get(fld, '').encode('utf-8')
                              for fld in self.fields) )
         if self.store_type:
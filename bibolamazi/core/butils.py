@@ -29,6 +29,8 @@ import re
 import types
 import math
 import datetime
+import functools
+import weakref
 import logging
 
 from pylatexenc import latex2text
@@ -357,6 +359,151 @@ _l2t = latex2text.LatexNodes2Text(
 )
 
 
-def latex_to_text(x):
 
-    return _l2t.latex_to_text(x, tolerant_parsing=True)
+
+# ------------------------------------------------------------------------------
+
+
+class ConversionStatistics:
+    """
+    Counters which keep track of how useful the memoization of a text conversion
+    was during a single run of bibolamazi.  Get these objects with
+    :py:meth:`MemoizedConversion.statistics()` or with
+    :py:func:`conversion_statistics()`.
+
+    Attributes:
+
+      - `name`: the name of the conversion these statistics refer to;
+
+      - `hits`: the number of conversions whose result was remembered;
+
+      - `misses`: the number of conversions which had to be computed;
+
+      - `passthrough`: the number of strings which were returned unchanged
+        because they can't be affected by the conversion;
+
+      - `currsize`, `maxsize`: the number of remembered results, and the maximum
+        number of results which are remembered.
+    """
+    def __init__(self, name, hits=0, misses=0, passthrough=0, currsize=0, maxsize=None, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.hits = hits
+        self.misses = misses
+        self.passthrough = passthrough
+        self.currsize = currsize
+        self.maxsize = maxsize
+
+    def as_dict(self):
+        """
+        Return the counters as a python dictionary.
+        """
+        return {
+            'name': self.name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'passthrough': self.passthrough,
+            'currsize': self.currsize,
+            'maxsize': self.maxsize,
+        }
+
+    def __str__(self):
+        return "{}: {} hits, {} misses, {} passed through unchanged ({}/{} results remembered)".format(
+            self.name, self.hits, self.misses, self.passthrough, self.currsize, self.maxsize
+        )
+
+    def __repr__(self):
+        return 'ConversionStatistics(%r)' %(self.as_dict())
+
+
+_memoized_conversions = weakref.WeakSet()
+
+class MemoizedConversion:
+    """
+    Wraps a (pure) string conversion function `fn` such that the results of the
+    last `maxsize` distinct conversions are remembered.  Bibliographies tend to
+    convert the same strings (journal names, author names, ...) many times over.
+
+    If `passthrough_rx` is given, it is a regular expression which matches
+    (with `fullmatch()`) those strings which the conversion is guaranteed to
+    return unchanged.  These strings are returned right away, without being
+    stored.
+
+    The statistics of the conversion are reported under the given `name`, see
+    :py:func:`conversion_statistics()`.  Several conversions may have the same
+    name (e.g. one per filter instance).
+    """
+    def __init__(self, name, fn, maxsize=4096, passthrough_rx=None, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.fn = fn
+        self.maxsize = maxsize
+        if isinstance(passthrough_rx, str):
+            passthrough_rx = re.compile(passthrough_rx)
+        self.passthrough_rx = passthrough_rx
+        self._cached_fn = functools.lru_cache(maxsize=maxsize)(fn)
+        self._num_passthrough = 0
+        _memoized_conversions.add(self)
+
+    def __call__(self, x):
+        if self.passthrough_rx is not None and self.passthrough_rx.fullmatch(x) is not None:
+            self._num_passthrough += 1
+            return x
+        return self._cached_fn(x)
+
+    def statistics(self):
+        """
+        Return a :py:class:`ConversionStatistics` instance for this conversion.
+        """
+        info = self._cached_fn.cache_info()
+        return ConversionStatistics(self.name, hits=info.hits, misses=info.misses,
+                                    passthrough=self._num_passthrough,
+                                    currsize=info.currsize, maxsize=info.maxsize)
+
+    def clear(self):
+        """
+        Forget all remembered results, and reset the statistics.
+        """
+        self._cached_fn.cache_clear()
+        self._num_passthrough = 0
+
+
+def conversion_statistics():
+    """
+    Return a dictionary `{name: stats}` of :py:class:`ConversionStatistics`
+    instances for all existing :py:class:`MemoizedConversion` objects.  The
+    statistics of conversions with the same name are added up.
+    """
+    stats = {}
+    for c in list(_memoized_conversions):
+        cstats = c.statistics()
+        if cstats.name not in stats:
+            stats[cstats.name] = cstats
+            continue
+        s = stats[cstats.name]
+        s.hits += cstats.hits
+        s.misses += cstats.misses
+        s.passthrough += cstats.passthrough
+        s.currsize += cstats.currsize
+        if s.maxsize is not None:
+            s.maxsize = None if cstats.maxsize is None else s.maxsize + cstats.maxsize
+    return stats
+
+
+# plain printable ASCII text without any LaTeX special characters or
+# constructs (note: '%' starts a comment, '&' is an alignment character, and
+# `` and '' are quotes)
+_rx_latex_to_text_passthrough = re.compile(r"[\t\n\r !\"#()*+,\-./0-9:;<=>?@A-Z\[\]^_a-z|]*")
+
+_memoized_latex_to_text = MemoizedConversion(
+    'latex_to_text',
+    lambda x: _l2t.latex_to_text(x, tolerant_parsing=True),
+    passthrough_rx=_rx_latex_to_text_passthrough,
+)
+
+def latex_to_text(x):
+    """
+    Convert the LaTeX string `x` to unicode text.  Results are memoized, see
+    :py:class:`MemoizedConversion`.
+    """
+    return _memoized_latex_to_text(x)
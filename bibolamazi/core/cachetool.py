@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2024 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+Implements the ``bibolamazi cache`` command, which provides maintenance
+operations on bibolamazi cache files::
+
+    bibolamazi cache stats   [--shared | BIBOLAMAZIFILE]
+    bibolamazi cache prune   [--shared | BIBOLAMAZIFILE]
+    bibolamazi cache compact [--shared | BIBOLAMAZIFILE]
+    bibolamazi cache export  [--shared | BIBOLAMAZIFILE] [--cache NAME] EXPORTFILE
+    bibolamazi cache import  [--shared | BIBOLAMAZIFILE] EXPORTFILE
+    bibolamazi cache arxiv-snapshot [--snapshot-file FILE] DUMPFILE
+
+Instead of a bibolamazi file, the name of a ``.bibolamazicache`` file may be
+given directly.
+"""
+
+import os
+import os.path
+import sys
+import importlib
+import pkgutil
+import datetime
+import argparse
+import logging
+
+from . import butils
+from .butils import BibolamaziError
+from .bibolamazifile import BibolamaziFile
+from .bibusercache import BibUserCache, BibUserCacheDic, BibUserCacheAccessor
+from .bibusercache import parse_cache_size_limits
+from .bibusercache import cachefile
+
+logger = logging.getLogger(__name__)
+
+
+
+def get_cache_args_parser():
+
+    parser = argparse.ArgumentParser(
+        prog='bibolamazi cache',
+        description="Inspect and maintain bibolamazi cache files.",
+    )
+
+    target_parser = argparse.ArgumentParser(add_help=False)
+    target_parser.add_argument(
+        '--shared', action='store_true', default=False,
+        help="Operate on the user-level cache which is shared by all bibolamazi "
+        "files (where information fetched from the web is stored)."
+    )
+    target_parser.add_argument(
+        'bibolamazifile', nargs='?', default=None,
+        help="The bibolamazi file (or directly the .bibolamazicache file) whose "
+        "cache to operate on."
+    )
+
+    subparsers = parser.add_subparsers(dest='cache_command', metavar='COMMAND')
+    subparsers.required = True
+
+    subparsers.add_parser(
+        'stats', parents=[target_parser],
+        help="Show the size and number of items of each sub-cache."
+    )
+
+    p = subparsers.add_parser(
+        'prune', parents=[target_parser],
+        help="Remove expired and invalid items, without running any filters.",
+        description="Remove expired and invalid items from the cache.  If a bibolamazi "
+        "file is given, its sources are read and its filters are set up (but not run) "
+        "so that their caches are validated; sub-caches which none of its filters use "
+        "are removed.  For the shared cache, items older than the cache timeout are "
+        "removed."
+    )
+    p.add_argument(
+        '-z', '--cache-timeout', dest='cache_timeout', type=butils.parse_timedelta,
+        default=None,
+        help="Consider items older than this to be expired. Format: '<N><unit>' with "
+        "unit=w/d/m/s"
+    )
+    p.add_argument(
+        '--cache-max-size', dest='cache_max_size', type=parse_cache_size_limits,
+        default=None, metavar="SIZE",
+        help="Also evict the least recently used items of sub-caches which exceed this "
+        "size (see 'bibolamazi --help')."
+    )
+
+    subparsers.add_parser(
+        'compact', parents=[target_parser],
+        help="Rewrite the cache file in the most efficient format."
+    )
+
+    p = subparsers.add_parser(
+        'export', parents=[target_parser],
+        help="Export cached data to a file which can be imported on another machine."
+    )
+    p.add_argument(
+        '--cache', dest='cache_names', action='append', default=None, metavar='NAME',
+        help="Only export the sub-cache NAME (may be specified several times). "
+        "By default, all sub-caches are exported."
+    )
+    p.add_argument('exportfile', help="The file to write the exported data to.")
+
+    p = subparsers.add_parser(
+        'import', parents=[target_parser],
+        help="Import data exported with 'bibolamazi cache export'.  Data already in "
+        "the cache is kept.  With --shared, only the data of filters which use the "
+        "shared cache is imported."
+    )
+    p.add_argument('exportfile', help="The file to read the exported data from.")
+
+    p = subparsers.add_parser(
+        'arxiv-snapshot',
+        help="Import a bulk arXiv metadata dump into a local database, where arXiv "
+        "information is looked up before querying arxiv.org.",
+        description="Import a bulk arXiv metadata dump into a local database.  The "
+        "dump should be in the JSON-lines format of arXiv's metadata snapshot (e.g. "
+        "the \"arXiv Dataset\" on Kaggle), possibly compressed with gzip.  Filters "
+        "look up arXiv information in this database before querying arxiv.org."
+    )
+    p.add_argument(
+        '--snapshot-file', dest='snapshot_file', default=None, metavar='FILE',
+        help="The database file to create or update.  By default, the file which "
+        "the filters use is updated (see environment variable BIBOLAMAZI_ARXIV_SNAPSHOT)."
+    )
+    p.add_argument('dumpfile', help="The JSON-lines metadata dump to import.")
+
+    return parser
+
+
+
+def cache_main(argv):
+    """
+    Run the ``bibolamazi cache`` command with the command-line arguments `argv`
+    (not including the leading ``cache``).
+    """
+    parser = get_cache_args_parser()
+    args = parser.parse_args(args=argv)
+
+    if args.cache_command == 'arxiv-snapshot':
+        return _cmd_arxiv_snapshot(args.dumpfile, args.snapshot_file)
+
+    bibolamazifile, cachefname = _get_target(args)
+
+    if args.cache_command == 'stats':
+        return _cmd_stats(cachefname)
+    if args.cache_command == 'prune':
+        return _cmd_prune(bibolamazifile, cachefname, args)
+    if args.cache_command == 'compact':
+        return _cmd_compact(cachefname)
+    if args.cache_command == 'export':
+        return _cmd_export(cachefname, args.exportfile, args.cache_names)
+    if args.cache_command == 'import':
+        return _cmd_import(cachefname, args.exportfile)
+
+    raise BibolamaziError("Unknown cache command: {}".format(args.cache_command))
+
+
+
+def _get_target(args):
+    # returns (bibolamazifile-name-or-None, cachefname)
+    if args.shared:
+        if args.bibolamazifile is not None:
+            raise BibolamaziError("Please specify either --shared or a bibolamazi file, not both")
+        return (None, BibolamaziFile.sharedCacheFileName())
+    if args.bibolamazifile is None:
+        raise BibolamaziError("Please specify a bibolamazi file or --shared")
+    if args.bibolamazifile.endswith('.bibolamazicache'):
+        return (None, args.bibolamazifile)
+    return (args.bibolamazifile, BibolamaziFile.cacheFileNameFor(args.bibolamazifile))
+
+
+def _new_cache():
+    return BibUserCache(cache_version=butils.get_version())
+
+
+def _allow_pickle(cachefname):
+    # only a bibolamazi file's own cache may contain data pickled by an older
+    # version of bibolamazi; never unpickle anything from the shared cache
+    return not _is_shared_cache(cachefname)
+
+
+def _is_shared_cache(cachefname):
+    return os.path.abspath(cachefname) == os.path.abspath(BibolamaziFile.sharedCacheFileName())
+
+
+def _import_filter_modules():
+    # import all modules of the filter packages, without reloading those which
+    # are already loaded (contrary to factory.detect_filters())
+    from .bibfilter import factory
+
+    def ignore(modname):
+        logger.debug("Can't import %s", modname)
+
+    for (fpkgname, fpkgdir) in factory.filterpath.items():
+        oldsyspath = sys.path
+        sys.path = ([fpkgdir] if fpkgdir else []) + oldsyspath
+        try:
+            fpkgmod = importlib.import_module(fpkgname)
+            for (_, modname, _) in pkgutil.walk_packages(fpkgmod.__path__, prefix=fpkgname+'.',
+                                                         onerror=ignore):
+                try:
+                    importlib.import_module(modname)
+                except Exception:
+                    ignore(modname)
+        except ImportError:
+            ignore(fpkgname)
+        finally:
+            sys.path = oldsyspath
+
+
+def _shared_cache_names():
+    # the names of the sub-caches which are stored in the shared cache, i.e.,
+    # those of the cache accessors which set `shared_cache`.  The accessors are
+    # defined in the filter modules, so make sure those are loaded.
+    _import_filter_modules()
+
+    names = set()
+    classes = [BibUserCacheAccessor]
+    while classes:
+        cls = classes.pop()
+        classes += cls.__subclasses__()
+        if not cls.shared_cache:
+            continue
+        try:
+            names.add(cls(bibolamazifile=None).cacheName())
+        except Exception as e:
+            logger.debug("Can't determine the cache name of %r: %s", cls, e)
+    return names
+
+
+def _load_cache(cachefname):
+    if not os.path.exists(cachefname):
+        raise BibolamaziError("No such cache file: {}".format(cachefname))
+    cache = _new_cache()
+    cachefile.load_cache_file(cache, cachefname, allow_pickle=_allow_pickle(cachefname))
+    return cache
+
+
+def _fmt_bytes(num_bytes):
+    for unit in ('B', 'kB', 'MB'):
+        if num_bytes < 1024:
+            return "{:.4g} {}".format(num_bytes, unit)
+        num_bytes /= 1024.0
+    return "{:.4g} GB".format(num_bytes)
+
+
+
+def _cmd_stats(cachefname):
+    cache = _load_cache(cachefname)
+
+    print("Cache file: {}  ({})".format(cachefname, _fmt_bytes(os.path.getsize(cachefname))))
+    print("")
+    for cache_name in sorted(cache.cacheNames()):
+        num_items, num_bytes = cache.cacheSize(cache_name)
+        print("  {:<32s} {:>8d} items {:>12s}".format(cache_name, num_items,
+                                                      _fmt_bytes(num_bytes)))
+    invalid = dict([ (name, stats.num_invalidations())
+                     for (name, stats) in cache.cacheStatistics().items()
+                     if stats.num_invalidations() ])
+    if invalid:
+        print("")
+        print("  Outdated sub-caches which will be discarded: {}".format(
+            ", ".join(sorted(invalid.keys()))))
+    print("")
+
+
+def _cmd_prune(bibolamazifile, cachefname, args):
+    if bibolamazifile is not None:
+        # let the filters' cache accessors validate the cache
+        kwargs = {}
+        if args.cache_timeout is not None:
+            kwargs['default_cache_invalidation_time'] = args.cache_timeout
+        if args.cache_max_size is not None:
+            kwargs['cache_size_limits'] = args.cache_max_size
+        bfile = BibolamaziFile(bibolamazifile, **kwargs)
+        removed = bfile.removeUnusedCaches()
+        if removed:
+            logger.info("Removing unused caches: %s", ", ".join(removed))
+        bfile.saveCache()
+        logger.info("Pruned cache of %s", bibolamazifile)
+        return
+
+    time_valid = args.cache_timeout
+    def do_prune(cache):
+        if time_valid is not None:
+            cache.setDefaultInvalidationTime(time_valid)
+        num_expired = _prune_expired(cache.cachedic, cache.cacheExpirationTokenChecker())
+        logger.info("Removed %d expired items", num_expired)
+        if args.cache_max_size is not None:
+            cache.setSizeLimits(*args.cache_max_size)
+            logger.info("Evicted %d items to enforce size limits", cache.enforceSizeLimits())
+
+    cachefile.rewrite_cache_file(_new_cache(), cachefname, do_prune,
+                                 allow_pickle=_allow_pickle(cachefname))
+
+
+def _is_expired(token, expiry_checker):
+    if isinstance(token, datetime.datetime):
+        return not expiry_checker.cmp_tokens(key=None, value=None, oldtoken=token)
+    if isinstance(token, tuple):
+        return any( _is_expired(t, expiry_checker) for t in token )
+    return False
+
+
+def _prune_expired(dic, expiry_checker):
+    # Without the cache accessors, we don't know which token checkers were
+    # installed.  But all the cache expiry dates are stored as dates by
+    # TokenCheckerDate, so remove all items with an expired date token.
+    num_expired = 0
+    for key in list(dic.dic.keys()):
+        if _is_expired(dic.tokens.get(key, None), expiry_checker):
+            dic.evict(key)
+            num_expired += 1
+            continue
+        val = dic.dic[key]
+        if isinstance(val, BibUserCacheDic):
+            num_expired += _prune_expired(val, expiry_checker)
+    return num_expired
+
+
+def _cmd_compact(cachefname):
+    if not os.path.exists(cachefname):
+        raise BibolamaziError("No such cache file: {}".format(cachefname))
+    size_before = os.path.getsize(cachefname)
+    cachefile.rewrite_cache_file(_new_cache(), cachefname,
+                                 allow_pickle=_allow_pickle(cachefname))
+    logger.info("Rewrote %s (%s -> %s)", cachefname, _fmt_bytes(size_before),
+                _fmt_bytes(os.path.getsize(cachefname)))
+
+
+def _cmd_export(cachefname, exportfname, cache_names):
+    cache = _load_cache(cachefname)
+
+    if cache_names is not None:
+        for cache_name in cache.cacheNames():
+            if cache_name not in cache_names:
+                cache.removeCache(cache_name)
+
+    try:
+        with open(exportfname, 'wb') as f:
+            cache.saveCache(f)
+    except IOError as e:
+        raise BibolamaziError("Couldn't write to {}: {}".format(exportfname, e))
+    logger.info("Exported %s to %s", ", ".join(sorted(cache.cacheNames())), exportfname)
+
+
+def _cmd_import(cachefname, exportfname):
+    imported = _new_cache()
+    try:
+        with open(exportfname, 'rb') as f:
+            # exported files may come from anywhere, so never unpickle them
+            imported.loadCache(f, allow_pickle=False)
+    except IOError as e:
+        raise BibolamaziError("Couldn't read {}: {}".format(exportfname, e))
+    if not imported.hasCache():
+        logger.warning("Nothing to import from %s (maybe it was exported by a "
+                       "different version of bibolamazi)", exportfname)
+        return
+
+    if _is_shared_cache(cachefname):
+        # data which depends on a specific bibolamazi file (such as 'arxiv_info')
+        # doesn't belong in the shared cache
+        shared_names = _shared_cache_names()
+        for cache_name in sorted(imported.cacheNames()):
+            if cache_name not in shared_names:
+                logger.warning("Not importing '%s' into the shared cache, because it "
+                               "holds data specific to a bibolamazi file", cache_name)
+                imported.removeCache(cache_name)
+        if not imported.hasCache():
+            logger.warning("Nothing to import into the shared cache from %s", exportfname)
+            return
+
+    def do_import(cache):
+        cache.mergeCache(imported)
+
+    if not cachefile.rewrite_cache_file(_new_cache(), cachefname, do_import,
+                                        allow_pickle=_allow_pickle(cachefname)):
+        raise BibolamaziError("Couldn't write to {}".format(cachefname))
+    logger.info("Imported %s into %s", ", ".join(sorted(imported.cacheNames())), cachefname)
+
+
+def _cmd_arxiv_snapshot(dumpfname, snapshotfname):
+    # the snapshot is used by the arxiv filter utilities
+    from bibolamazi.filters.util import arxivsnapshot
+
+    if snapshotfname is None:
+        snapshotfname = arxivsnapshot.default_snapshot_file()
+    snapshot = arxivsnapshot.ArxivSnapshot(snapshotfname)
+    try:
+        num_records = snapshot.import_jsonl(dumpfname)
+    except IOError as e:
+        raise BibolamaziError("Couldn't read {}: {}".format(dumpfname, e))
+    logger.info("Imported %d arXiv records into %s (%d records in total)",
+                num_records, snapshotfname, snapshot.num_papers())
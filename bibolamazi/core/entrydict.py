@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+The container in which the entries of a bibolamazi file are stored.
+
+:py:class:`EntryDict` is an ordered dictionary with case-insensitive keys, like
+pybtex's :py:class:`pybtex.utils.OrderedCaseInsensitiveDict` which it replaces
+for :py:meth:`BibolamaziFile.bibliographyData().entries
+<core.bibolamazifile.BibolamaziFile.bibliographyData>`.  Looking up, adding and
+deleting an entry take constant time independently of the pybtex version, and
+the entries can be reordered all at once (see :py:meth:`EntryDict.sort` and
+:py:meth:`EntryDict.reorder`).
+"""
+
+from collections.abc import ItemsView, ValuesView
+import logging
+
+from pybtex.utils import OrderedCaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+
+
+class _EntryDictItemsView(ItemsView):
+    def __iter__(self):
+        return iter(self._mapping._items.values())
+
+class _EntryDictValuesView(ValuesView):
+    def __iter__(self):
+        return ( value for (key, value) in self._mapping._items.values() )
+
+
+class EntryDict(OrderedCaseInsensitiveDict):
+    """
+    An ordered dictionary with case-insensitive keys.
+
+    Keys are remembered with the case they were last set with, and are
+    iterated over in the order in which they were first inserted (setting an
+    existing key doesn't change its position).
+
+    This class derives from pybtex's
+    :py:class:`pybtex.utils.OrderedCaseInsensitiveDict`, so that it can be used
+    wherever pybtex expects one, but it doesn't rely on its implementation.
+    """
+    def __init__(self, *args, **kwargs):
+        # { lowercase key: (key, value) }
+        self._items = {}
+        self.update(*args, **kwargs)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return ( key for (key, value) in self._items.values() )
+
+    def __contains__(self, key):
+        return key.lower() in self._items
+
+    def __getitem__(self, key):
+        return self._items[key.lower()][1]
+
+    def __setitem__(self, key, value):
+        self._items[key.lower()] = (key, value)
+
+    def __delitem__(self, key):
+        del self._items[key.lower()]
+
+    def get(self, key, default=None):
+        item = self._items.get(key.lower(), None)
+        if item is None:
+            return default
+        return item[1]
+
+    def items(self):
+        return _EntryDictItemsView(self)
+
+    def values(self):
+        return _EntryDictValuesView(self)
+
+    def clear(self):
+        self._items.clear()
+
+    def items_lower(self):
+        return ( (key.lower(), value) for (key, value) in self._items.values() )
+
+    def lower(self):
+        return type(self)(self.items_lower())
+
+    def sort(self, key=None, reverse=False):
+        """
+        Reorder the items by sorting the keys, as `sorted(keys, key=key,
+        reverse=reverse)` would.  The sort is stable.
+        """
+        if key is None:
+            sortkey = lambda item: item[1][0]
+        else:
+            sortkey = lambda item: key(item[1][0])
+        self._items = dict(sorted(self._items.items(), key=sortkey, reverse=reverse))
+
+    def reorder(self, keys):
+        """
+        Reorder the items so that they appear in the order given by `keys`.  The
+        iterable `keys` must contain each key of this dictionary exactly once
+        (in any case), otherwise a `ValueError` is raised and the dictionary is
+        left unchanged.
+        """
+        newitems = {}
+        for key in keys:
+            lkey = key.lower()
+            if lkey not in self._items or lkey in newitems:
+                raise ValueError("Invalid or repeated key in reorder(): {}".format(key))
+            newitems[lkey] = self._items[lkey]
+        if len(newitems) != len(self._items):
+            raise ValueError("Not all keys were given to reorder()")
+        self._items = newitems
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, list(self.items()))
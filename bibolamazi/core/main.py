@@ -45,8 +45,11 @@ import bibolamazi.init
 from . import blogger
 from . import version
 from .bibolamazifile import BibolamaziFile
+from .bibusercache import parse_cache_size_limits
 from . import argparseactions
 from . import butils
+from . import transport
+from . import ratelimit
 from .butils import BibolamaziError
 from .bibfilter import factory as filterfactory
 from .bibfilter import pkgprovider, pkgfetcher_github
@@ -130,7 +133,8 @@ def get_args_parser():
         epilog="Log messages will be produced in color by default "
         "if outputting to a TTY. To override the use of TTY colors, "
         "set environment variable BIBOLAMAZI_TTY_COLORS to 'yes', 'no' "
-        "or 'auto'.",
+        "or 'auto'.  Run 'bibolamazi cache --help' for commands to inspect and "
+        "maintain cache files.",
         add_help=False)
 
     group = parser.add_argument_group("Bibolamazi file")
@@ -160,6 +164,43 @@ def get_args_parser():
         help="The default timeout after which to consider items in cache to be invalid. "
         "Not all cache items honor this. Format: '<N><unit>' with unit=w/d/m/s"
     )
+    group.add_argument(
+        '--no-shared-cache', action='store_false', dest='use_shared_cache', default=True,
+        help="Store information fetched from the web (arXiv, doi.org, etc.) in this "
+        "file's own cache rather than in the user-level cache shared by all "
+        "bibolamazi files."
+    )
+    group.add_argument(
+        '--cache-max-size', dest='cache_max_size', type=parse_cache_size_limits,
+        default=None, metavar="SIZE",
+        help="Limit the size of each sub-cache (e.g. arXiv information), evicting the "
+        "least recently used items when the cache is saved.  Format: an item count, "
+        "a size in bytes with unit B/K/M/G, or both separated by a comma, e.g. "
+        "'5000', '20M' or '5000,20M'.  Overrides the limit set in the bibolamazi "
+        "file's configuration section."
+    )
+
+    group = parser.add_argument_group("Network")
+    group.add_argument(
+        '--offline', action='store_true', dest='offline', default=False,
+        help="Do not access the network.  Filters only use information which is "
+        "already in the cache; information which would have to be fetched from the "
+        "web (arXiv, doi.org, etc.) is skipped with a warning."
+    )
+    group.add_argument(
+        '--network-deadline', dest='network_deadline', type=float, default=None,
+        metavar="SECONDS",
+        help="Stop accessing the network once this many seconds have passed since "
+        "bibolamazi was started.  Information which wasn't fetched by then is skipped "
+        "with a warning, and the filters continue with the information which is "
+        "available."
+    )
+    group.add_argument(
+        '--network-timeout', dest='network_timeout', type=float, default=None,
+        metavar="SECONDS",
+        help="Give up on a network request if the server doesn't respond within "
+        "this many seconds (default: %d)."%(transport.default_request_timeout)
+    )
 
     group = parser.add_argument_group("Filter packages")
     group.add_argument(
@@ -182,6 +223,43 @@ def get_args_parser():
         "the stored authentication."
     )
 
+    add_verbosity_args(parser)
+
+    group = parser.add_argument_group("Help pages")
+    group.add_argument(
+        '--help', '-h', action=argparseactions.opt_action_help, nargs='?',
+        metavar='filter',
+        help='Show this help message and exit. If filter is given, show information and '
+        'help text for that filter. See --list-filters for a list of available filters.'
+    )
+    group.add_argument(
+        '--help-welcome', action=argparseactions.opt_action_helpwelcome, nargs=0,
+        help='Show a brief introduction to bibolamazi and how to use it.'
+    )
+    group.add_argument(
+        '-F', '--list-filters', action=argparseactions.opt_list_filters, dest='list_filters',
+        help="Show a list of available filters along with their description, and exit."
+    )
+    group.add_argument(
+        '--version', action=argparseactions.opt_action_version, nargs=0,
+        help='Show bibolamazi version number and exit.'
+    )
+
+    parser.add_argument(
+        'bibolamazifile',
+        # note the %'s are parsed as formatting:
+        help='The .bibolamazi.bib file to update, i.e. that contains the %%%%%%-BIB-OLA-MAZI '
+        'configuration tags.'
+    )
+
+    return parser
+
+
+def add_verbosity_args(parser):
+    """
+    Add the options which control the logging verbosity to the
+    `argparse.ArgumentParser` `parser`.
+    """
     group = parser.add_argument_group("Logging verbosity")
     group.add_argument(
         '--verbosity', action=argparseactions.opt_set_verbosity, nargs=1,
@@ -218,38 +296,11 @@ def get_args_parser():
         )
     )
 
-    group = parser.add_argument_group("Help pages")
-    group.add_argument(
-        '--help', '-h', action=argparseactions.opt_action_help, nargs='?',
-        metavar='filter',
-        help='Show this help message and exit. If filter is given, show information and '
-        'help text for that filter. See --list-filters for a list of available filters.'
-    )
-    group.add_argument(
-        '--help-welcome', action=argparseactions.opt_action_helpwelcome, nargs=0,
-        help='Show a brief introduction to bibolamazi and how to use it.'
-    )
-    group.add_argument(
-        '-F', '--list-filters', action=argparseactions.opt_list_filters, dest='list_filters',
-        help="Show a list of available filters along with their description, and exit."
-    )
-    group.add_argument(
-        '--version', action=argparseactions.opt_action_version, nargs=0,
-        help='Show bibolamazi version number and exit.'
-    )
-
-    parser.add_argument(
-        'bibolamazifile',
-        # note the %'s are parsed as formatting:
-        help='The .bibolamazi.bib file to update, i.e. that contains the %%%%%%-BIB-OLA-MAZI '
-        'configuration tags.'
-    )
-
-    return parser
 
 
-
-ArgsStruct = namedtuple('ArgsStruct', ('bibolamazifile', 'use_cache', 'cache_timeout', 'output'))
+ArgsStruct = namedtuple('ArgsStruct', ('bibolamazifile', 'use_cache', 'cache_timeout', 'output',
+                                       'use_shared_cache', 'cache_max_size', 'offline',
+                                       'network_deadline', 'network_timeout'))
 
 
 
@@ -436,6 +487,20 @@ def save_github_auth_token(github_auth_token):
 
 
 
+def _get_cache_command_args(argv):
+    # Returns the arguments to pass on to the "bibolamazi cache" command, or
+    # None if `argv` isn't a cache command.  The logging options may be given
+    # anywhere, e.g. "bibolamazi -v cache stats"; they are applied here.
+    if 'cache' not in argv:
+        return None
+    global_parser = argparse.ArgumentParser(prog='bibolamazi', add_help=False)
+    add_verbosity_args(global_parser)
+    (_, other_argv) = global_parser.parse_known_args(args=argv)
+    if not other_argv or other_argv[0] != 'cache':
+        return None
+    return other_argv[1:]
+
+
 def _main_helper(argv):
 
     # get some basic logging mechanism running
@@ -464,6 +529,15 @@ def _main_helper(argv):
     setup_filterpackages_from_env()
 
     
+    # maintenance of cache files: "bibolamazi cache <command> ..."
+    # -----------------------------------------------------------
+
+    cache_argv = _get_cache_command_args(argv)
+    if cache_argv is not None:
+        from . import cachetool
+        cachetool.cache_main(cache_argv)
+        return
+
     # parse the command line arguments
     # --------------------------------
 
@@ -480,7 +554,12 @@ def run_bibolamazi(bibolamazifile, **kwargs):
     kwargs2 = {
         'use_cache': True,
         'cache_timeout': None,
-        'output': None
+        'output': None,
+        'use_shared_cache': True,
+        'cache_max_size': None,
+        'offline': False,
+        'network_deadline': None,
+        'network_timeout': None,
         }
     kwargs2.update(kwargs)
     args = ArgsStruct(bibolamazifile, **kwargs2)
@@ -502,11 +581,18 @@ def run_bibolamazi_args(args):
                      }))
 
 
+    transport.set_offline(args.offline)
+    if args.offline:
+        logger.debug("offline mode: not accessing the network")
+    transport.set_deadline(args.network_deadline)
+    transport.set_default_timeout(args.network_timeout)
+
     # open the bibolamazifile, which is the main bibtex file
     # ------------------------------------------------------
 
     kwargs = {
-        'use_cache': args.use_cache
+        'use_cache': args.use_cache,
+        'use_shared_cache': args.use_shared_cache,
         }
 
     #
@@ -515,6 +601,9 @@ def run_bibolamazi_args(args):
     if args.cache_timeout is not None:
         logger.debug("default cache timeout: %r", args.cache_timeout)
         kwargs['default_cache_invalidation_time'] = args.cache_timeout
+    if args.cache_max_size is not None:
+        logger.debug("cache size limits: %r", args.cache_max_size)
+        kwargs['cache_size_limits'] = args.cache_max_size
     
 
     # open the bibolamazi file and create the BibolamaziFile object. This will parse the rules
@@ -528,6 +617,9 @@ def run_bibolamazi_args(args):
         raise BibolamaziNoSourceEntriesError()
 
 
+    # fetch all the remote data the filters will need, all at once
+    bfile.prefetchCacheData()
+
     # now, run the selected filters in the corresponding order.
     # ---------------------------------------------------------
 
@@ -553,6 +645,16 @@ def run_bibolamazi_args(args):
         # ...  or back to the original file:
         bfile.saveToFile()
 
+    # report how useful the cache was
+    for cache_name, stats in sorted(bfile.cacheStatistics().items()):
+        logger.debug("Cache statistics: %s", stats)
+    # ... and how long we were held back by rate limiting
+    for host, stats in sorted(ratelimit.statistics().items()):
+        logger.debug("Rate limiting statistics: %s", stats)
+    # ... and how often we could reuse LaTeX/text conversions
+    for name, stats in sorted(butils.conversion_statistics().items()):
+        logger.debug("Text conversion statistics: %s", stats)
+
 
     logger.debug('Done.')
 
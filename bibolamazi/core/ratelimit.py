@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+Rate limiting of the requests to remote services, shared by all the bibolamazi
+processes running on this machine.
+
+Remote services such as arxiv.org ask that clients don't issue requests faster
+than a given rate.  Each host for which a rate limit is set (see
+:py:func:`set_rate_limit`) is given a "token bucket": each request consumes a
+token, and tokens are replenished at the allowed rate, up to a maximum of
+`burst` tokens.  When no token is available, the request waits until one is.
+
+The state of the token buckets is stored in a small file next to the shared
+cache, i.e. in the user's cache directory or in the directory given by the
+environment variable `BIBOLAMAZI_SHARED_CACHE_DIR` (see
+:py:func:`state_file_name`).  The file is protected by a
+:py:class:`~core.bibusercache.cachefile.CacheFileLock`, so that concurrent
+bibolamazi processes share the same budget.
+
+Requests issued with :py:mod:`~core.transport` are rate limited automatically.
+"""
+
+import os
+import os.path
+import json
+import time
+import threading
+import logging
+
+from .bibusercache.cachefile import CacheFileLock
+
+logger = logging.getLogger(__name__)
+
+
+#: How long (in seconds) we wait at most for the lock on the state file.  If the
+#: lock can't be acquired, the rate is only limited within this process.
+lock_timeout = 10
+
+#: Buckets which haven't been used for this long (in seconds) are forgotten
+forget_after = 3600
+
+
+class RateLimitStatistics:
+    """
+    Counters which keep track of how long we were held back by rate limiting
+    during a single run of bibolamazi.  Get these objects with
+    :py:func:`statistics`.
+
+    Attributes:
+
+      - `host`: the host name these statistics refer to;
+
+      - `requests`: the number of requests to this host which were rate limited;
+
+      - `waits`: the number of these requests which had to wait for a token;
+
+      - `wait_time`: the total time (in seconds) we waited.
+    """
+    def __init__(self, host, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.requests = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def as_dict(self):
+        """
+        Return the counters as a python dictionary.
+        """
+        return {
+            'host': self.host,
+            'requests': self.requests,
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+        }
+
+    def __str__(self):
+        return "{}: {} requests, waited {} times for a total of {:.2f} seconds".format(
+            self.host, self.requests, self.waits, self.wait_time
+        )
+
+    def __repr__(self):
+        return 'RateLimitStatistics(%r)' %(self.as_dict())
+
+
+_lock = threading.Lock()
+_rate_limits = {}
+_local_state = {}
+_statistics = {}
+_state_file = None
+
+
+def set_rate_limit(host, rate, burst=1):
+    """
+    Allow at most `rate` requests per second to the given `host` (as in the
+    ``netloc`` part of a URL, e.g. ``'export.arxiv.org'``), with bursts of up to
+    `burst` requests.  If `rate` is `None` or zero, requests to `host` are not
+    rate limited.
+    """
+    with _lock:
+        if not rate:
+            _rate_limits.pop(host, None)
+        else:
+            _rate_limits[host] = (float(rate), max(1, burst))
+
+def rate_limit(host):
+    """
+    Return the rate limit set for `host` with :py:func:`set_rate_limit` as a
+    tuple `(rate, burst)`, or `None` if requests to `host` aren't rate limited.
+    """
+    return _rate_limits.get(host, None)
+
+def state_file_name():
+    """
+    The file in which the state of the token buckets is stored.  It is located
+    in the same directory as the shared cache (see
+    :py:meth:`~core.bibolamazifile.BibolamaziFile.sharedCacheFileName()`), so
+    it honors the environment variable `BIBOLAMAZI_SHARED_CACHE_DIR`, unless it
+    was set with :py:func:`set_state_file`.
+    """
+    if _state_file is not None:
+        return _state_file
+    from .bibolamazifile import BibolamaziFile
+    return os.path.join(os.path.dirname(BibolamaziFile.sharedCacheFileName()),
+                        'ratelimit.json')
+
+def set_state_file(fname):
+    """
+    Store the state of the token buckets in the file `fname`.  Set `fname` to
+    `None` to use the default location.
+    """
+    global _state_file
+    _state_file = fname
+
+def statistics():
+    """
+    Return a dictionary `{host: RateLimitStatistics-instance}` with the
+    statistics of all rate-limited hosts.
+    """
+    with _lock:
+        return dict(_statistics)
+
+
+def acquire(host, max_wait=None):
+    """
+    Wait until a request to `host` may be issued, according to the rate limit
+    set with :py:func:`set_rate_limit`.  Returns the time we waited, in
+    seconds.  If there is no rate limit for `host`, returns immediately.
+
+    If `max_wait` is not `None` and we would have to wait for longer than
+    `max_wait` seconds, then this function returns `None` immediately, without
+    using up the budget of `host`.
+    """
+    limit = _rate_limits.get(host, None)
+    if limit is None:
+        return 0
+    (rate, burst) = limit
+
+    with _lock:
+        # Reserve a token while holding the locks.  The locks are released
+        # before we wait, so that the other threads can reserve their own
+        # tokens in the meantime.
+        fname = state_file_name()
+        with CacheFileLock(fname, exclusive=True, timeout=lock_timeout) as flock:
+            state = _local_state
+            if flock.acquired:
+                state = _load_state(fname)
+            delay = _reserve_token(state, host, rate, burst, time.time(), max_wait)
+            if delay is None:
+                logger.debug("Rate limiting requests to %s: can't wait for longer than "
+                             "%.2f seconds", host, max_wait)
+                return None
+            _local_state.clear()
+            _local_state.update(state)
+            if flock.acquired:
+                _save_state(fname, state)
+
+        stats = _statistics.setdefault(host, RateLimitStatistics(host))
+        stats.requests += 1
+        if delay > 0:
+            stats.waits += 1
+            stats.wait_time += delay
+
+    if delay > 0:
+        logger.debug("Rate limiting requests to %s: waiting %.2f seconds", host, delay)
+        time.sleep(delay)
+    return delay
+
+
+def _reserve_token(state, host, rate, burst, now, max_wait=None):
+    # Take a token from the bucket of `host`.  The number of tokens may become
+    # negative: this means that we have to wait until the missing tokens are
+    # replenished.  Returns the time to wait, or None (and leaves `state`
+    # unchanged) if that time would exceed `max_wait`.
+    bucket = state.get(host, None)
+    if bucket is None:
+        tokens = float(burst)
+    else:
+        elapsed = max(0, now - bucket['updated'])
+        tokens = min(float(burst), bucket['tokens'] + elapsed * rate)
+    tokens -= 1
+    delay = 0 if tokens >= 0 else -tokens / rate
+    if max_wait is not None and delay > max_wait:
+        return None
+    state[host] = { 'tokens': tokens, 'updated': now }
+    return delay
+
+def _load_state(fname):
+    try:
+        with open(fname, 'r') as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(state, dict):
+        return {}
+    return dict([
+        (host, bucket) for (host, bucket) in state.items()
+        if isinstance(bucket, dict) and isinstance(bucket.get('tokens'), (int, float))
+        and isinstance(bucket.get('updated'), (int, float))
+    ])
+
+def _save_state(fname, state):
+    now = time.time()
+    state = dict([ (host, bucket) for (host, bucket) in state.items()
+                   if now - bucket['updated'] < forget_after ])
+    tmpfname = fname + '.tmp'
+    try:
+        with open(tmpfname, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmpfname, fname)
+    except (IOError, OSError) as e:
+        logger.debug("Can't save rate limiting state to %s: %s", fname, e)
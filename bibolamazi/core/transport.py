@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+A common transport layer for all the network accesses of bibolamazi and of its
+filters.
+
+All HTTP(S) requests should be issued with :py:func:`get` (or
+:py:func:`request`), so that:
+
+- connections are kept alive and reused, with a pool of connections per host
+  which can be used by several threads at the same time;
+
+- requests are subject to a default timeout (see
+  :py:func:`set_default_timeout`), and no request is issued after the run-wide
+  network deadline has passed (see :py:func:`set_deadline`);
+
+- requests to hosts for which a rate limit was set are held back as necessary,
+  in coordination with the other bibolamazi processes running on this machine
+  (see :py:mod:`~core.ratelimit`);
+
+- in offline mode (see :py:func:`set_offline`, or the ``--offline``
+  command-line option), no network access is attempted: requests fail
+  immediately with an :py:exc:`OfflineError`, so that bibolamazi only uses the
+  information which is already in its caches;
+
+- responses can be recorded into fixture files, and later replayed from these
+  files without any network access (see :py:func:`set_record_dir` and
+  :py:func:`set_replay_dir`).  This is meant for tests and benchmarks.
+  Recording and replaying can also be enabled by setting the environment
+  variables ``BIBOLAMAZI_HTTP_RECORD_DIR`` or ``BIBOLAMAZI_HTTP_REPLAY_DIR`` to
+  the directory in which the fixture files are stored.
+
+Connection errors are reported as :py:exc:`TransportError` exceptions.  HTTP
+error responses are returned as usual; the caller should inspect the status
+code of the returned `requests.Response` object.
+"""
+
+import os
+import os.path
+import re
+import json
+import base64
+import hashlib
+import time
+import tempfile
+import threading
+from urllib.parse import urlsplit
+import logging
+
+import requests
+import requests.adapters
+import requests.structures
+
+import bibolamazi.init
+from .butils import BibolamaziError
+from .version import version_str
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+
+class TransportError(BibolamaziError):
+    """
+    An error occurred while accessing the network (e.g., the host couldn't be
+    reached, or the request timed out).
+    """
+    def __init__(self, msg, url=None):
+        super().__init__(msg)
+        self.url = url
+
+class OfflineError(TransportError):
+    """
+    Raised when attempting to access the network in offline mode.
+    """
+    def __init__(self, url):
+        super().__init__("Network access is disabled (offline mode), can't fetch {}".format(url),
+                         url=url)
+
+class DeadlineExceededError(TransportError):
+    """
+    Raised when attempting to access the network after the network deadline
+    (see :py:func:`set_deadline`) has passed.
+    """
+    def __init__(self, url):
+        super().__init__("Network deadline exceeded, can't fetch {}".format(url), url=url)
+
+class NoRecordedResponseError(TransportError):
+    """
+    Raised in replay mode when no response was recorded for a request.
+    """
+    def __init__(self, url, fname):
+        super().__init__("No recorded response for {} (expected in {})".format(url, fname),
+                         url=url)
+        self.fname = fname
+
+
+#: The maximum number of connections which are kept open to a single host
+pool_maxsize = 16
+
+#: The default timeout of requests, in seconds, unless set otherwise with
+#: :py:func:`set_default_timeout`
+default_request_timeout = 30
+
+_lock = threading.Lock()
+_session = None
+_offline = False
+_default_timeout = default_request_timeout
+_deadline = None
+_record_dir = os.environ.get('BIBOLAMAZI_HTTP_RECORD_DIR', None) or None
+_replay_dir = os.environ.get('BIBOLAMAZI_HTTP_REPLAY_DIR', None) or None
+
+
+def set_offline(offline):
+    """
+    Enable or disable offline mode.  In offline mode, any network access fails
+    immediately with an :py:exc:`OfflineError` (unless responses are replayed,
+    see :py:func:`set_replay_dir`).
+    """
+    global _offline
+    _offline = bool(offline)
+
+def is_offline():
+    """
+    Return `True` if we are in offline mode, see :py:func:`set_offline`.
+    """
+    return _offline
+
+def check_online(what):
+    """
+    Raise :py:exc:`OfflineError` if we are in offline mode.  Call this before
+    accessing the network by other means than :py:func:`request` (e.g., through a
+    third-party library).  The argument `what` is the URL or the name of the
+    resource that was going to be accessed, for the error message.
+    """
+    if _offline and _replay_dir is None:
+        raise OfflineError(what)
+
+def set_default_timeout(timeout):
+    """
+    Set the default timeout, in seconds, of requests which don't specify a
+    timeout explicitly.  (See the `timeout` argument of `requests.get()`.)  If
+    `timeout` is `None`, :py:data:`default_request_timeout` is used.
+    """
+    global _default_timeout
+    _default_timeout = timeout if timeout is not None else default_request_timeout
+
+def default_timeout():
+    """
+    Return the default timeout set by :py:func:`set_default_timeout`.
+    """
+    return _default_timeout
+
+def set_deadline(seconds):
+    """
+    Don't access the network any more once `seconds` seconds have passed from
+    now.  After that, requests fail immediately with a
+    :py:exc:`DeadlineExceededError`, and the timeout of the requests issued
+    before is shortened so that they don't last beyond the deadline.  Set
+    `seconds` to `None` to remove the deadline.
+    """
+    global _deadline
+    if seconds is None:
+        _deadline = None
+    else:
+        _deadline = time.monotonic() + seconds
+
+def time_remaining():
+    """
+    Return the number of seconds left until the network deadline (see
+    :py:func:`set_deadline`), or `None` if there is no deadline.
+    """
+    if _deadline is None:
+        return None
+    return max(0, _deadline - time.monotonic())
+
+def check_deadline(what):
+    """
+    Raise :py:exc:`DeadlineExceededError` if the network deadline has passed.
+    The argument `what` is as for :py:func:`check_online`.
+    """
+    if _deadline is not None and time.monotonic() >= _deadline:
+        raise DeadlineExceededError(what)
+
+def set_record_dir(dirname):
+    """
+    Record all responses into fixture files in the directory `dirname`.  Set
+    `dirname` to `None` to stop recording.
+    """
+    global _record_dir
+    _record_dir = dirname
+
+def set_replay_dir(dirname):
+    """
+    Serve all requests from the fixture files in the directory `dirname`
+    (recorded with :py:func:`set_record_dir`), without accessing the network.
+    If no response was recorded for a request, a
+    :py:exc:`NoRecordedResponseError` is raised.  Set `dirname` to `None` to
+    access the network again.
+    """
+    global _replay_dir
+    _replay_dir = dirname
+
+
+def get_session():
+    """
+    Return the `requests.Session` object which is shared by all requests.  It
+    may be used from several threads.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = 'bibolamazi/{} {}'.format(
+                version_str, session.headers.get('User-Agent', '')
+            ).strip()
+            _session = session
+        return _session
+
+def close_session():
+    """
+    Close all connections which are kept open.  A new session is created the
+    next time a request is issued.
+    """
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def request(method, url, params=None, headers=None, timeout=None, stream=False, **kwargs):
+    """
+    Perform an HTTP request, and return the `requests.Response` object.
+
+    The arguments are as for `requests.request()`.  If `timeout` is `None`, the
+    default timeout is used.
+
+    If `stream` is `True`, the response body is not downloaded right away.
+    Read it with :py:func:`iter_content`, and close the response when done.
+    (When responses are recorded or replayed, the body is read into memory
+    anyway.)
+
+    Raises :py:exc:`OfflineError` in offline mode,
+    :py:exc:`DeadlineExceededError` if the network deadline has passed,
+    :py:exc:`NoRecordedResponseError` if we are replaying responses and this
+    request wasn't recorded, and :py:exc:`TransportError` if the request failed
+    for any other reason.
+    """
+    full_url = requests.Request(method, url, params=params).prepare().url
+    fixture_fname = None
+    if _replay_dir is not None or _record_dir is not None:
+        fixture_fname = _fixture_file_name(method, full_url, headers)
+
+    if _replay_dir is not None:
+        return _load_fixture(os.path.join(_replay_dir, fixture_fname), full_url)
+
+    check_online(full_url)
+    check_deadline(full_url)
+
+    # don't wait for the rate limit beyond the deadline
+    if ratelimit.acquire(urlsplit(full_url).netloc, max_wait=time_remaining()) is None:
+        raise DeadlineExceededError(full_url)
+
+    if timeout is None:
+        timeout = _default_timeout
+    remaining = time_remaining()
+    if remaining is not None:
+        check_deadline(full_url)
+        timeout = min(timeout, remaining) if timeout is not None else remaining
+
+    logger.longdebug("%s %s", method, full_url)
+    try:
+        r = get_session().request(method, url, params=params, headers=headers,
+                                  timeout=timeout, stream=stream, **kwargs)
+    except requests.RequestException as e:
+        if _deadline is not None and time.monotonic() >= _deadline:
+            raise DeadlineExceededError(full_url) from e
+        raise TransportError("Error fetching {}: {}".format(full_url, e), url=full_url) from e
+
+    if _record_dir is not None:
+        _save_fixture(os.path.join(_record_dir, fixture_fname), method, full_url, headers, r)
+
+    return r
+
+def get(url, **kwargs):
+    """
+    Shorthand for ``request('GET', url, **kwargs)``.
+    """
+    return request('GET', url, **kwargs)
+
+
+def iter_content(r, chunk_size=64*1024):
+    """
+    Iterate over the body of the response `r`, as returned by :py:func:`request`
+    with `stream=True`, in chunks of (at most) `chunk_size` bytes.
+
+    Raises :py:exc:`DeadlineExceededError` if the network deadline passes
+    during the download, and :py:exc:`TransportError` if the download fails
+    for any other reason.
+    """
+    try:
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            yield chunk
+            check_deadline(r.url)
+    except requests.RequestException as e:
+        if _deadline is not None and time.monotonic() >= _deadline:
+            raise DeadlineExceededError(r.url) from e
+        raise TransportError("Error fetching {}: {}".format(r.url, e), url=r.url) from e
+
+
+# ------------------------------------------------------------------------------
+# record & replay
+# ------------------------------------------------------------------------------
+
+def _fixture_file_name(method, full_url, headers):
+    # the Accept: header is relevant, e.g. for doi.org's content negotiation
+    accept = ''
+    if headers:
+        accept = requests.structures.CaseInsensitiveDict(headers).get('Accept', '')
+    key = "\n".join([method.upper(), full_url, accept]).encode('utf-8')
+    host = re.sub(r'[^A-Za-z0-9.-]+', '_', urlsplit(full_url).netloc)
+    return "{}-{}.json".format(host, hashlib.sha1(key).hexdigest()[:20])
+
+def _save_fixture(fname, method, full_url, headers, r):
+    data = {
+        'method': method.upper(),
+        'url': full_url,
+        'accept': requests.structures.CaseInsensitiveDict(headers or {}).get('Accept', ''),
+        'status_code': r.status_code,
+        'reason': r.reason,
+        'headers': dict(r.headers),
+        'encoding': r.encoding,
+    }
+    try:
+        data['text'] = r.content.decode('utf-8')
+    except UnicodeDecodeError:
+        data['content_base64'] = base64.b64encode(r.content).decode('ascii')
+
+    dirname = os.path.dirname(fname)
+    os.makedirs(dirname, exist_ok=True)
+    # write atomically, requests may be recorded from several threads
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmpname, fname)
+    logger.debug("Recorded response for %s in %s", full_url, fname)
+
+def _load_fixture(fname, full_url):
+    try:
+        with open(fname, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise NoRecordedResponseError(full_url, fname)
+
+    r = requests.Response()
+    r.status_code = data['status_code']
+    r.reason = data.get('reason')
+    r.headers = requests.structures.CaseInsensitiveDict(data.get('headers', {}))
+    r.encoding = data.get('encoding')
+    r.url = data['url']
+    if 'text' in data:
+        r._content = data['text'].encode('utf-8')
+    else:
+        r._content = base64.b64decode(data['content_base64'])
+    r._content_consumed = True
+    logger.longdebug("Replaying response for %s from %s", full_url, fname)
+    return r
@@ -117,6 +117,8 @@ class CiteArxivFilter(BibFilter):
         if not self.search_dirs:
             self.search_dirs = ['.', '_cleanlatexfiles'] # also for my cleanlatex utility :)
 
+        self._cited_arxiv_ids = None
+
         logger.debug('citearxiv: jobname=%r' % (self.jobname,))
 
 
@@ -129,45 +131,21 @@ class CiteArxivFilter(BibFilter):
 
     def requested_cache_accessors(self):
         return [
-            arxivutil.ArxivFetchedAPIInfoCacheAccessor
+            arxivutil.ArxivFetchedAPIInfoCacheAccessor,
+            auxfile.AuxCitationIndexCacheAccessor,
             ]
 
+    def prefetch_requests(self):
+        return {
+            arxivutil.ArxivFetchedAPIInfoCacheAccessor: self._get_cited_arxiv_ids()
+            }
+
     def filter_bibolamazifile(self, bibolamazifile):
 
         arxiv_api_accessor = self.cacheAccessor(arxivutil.ArxivFetchedAPIInfoCacheAccessor)
 
-        citearxiv_uselist = []
-
-        #
-        # find and analyze jobname.aux. Look for \citation{...}'s and collect them.
-        #
-
-        def add_to_cite_list(citekey):
-            if self.prefix:
-                if not citekey.startswith(self.prefix+":"):
-                    return
-                citekey = citekey[len(self.prefix)+1:]
-
-            if (not arxiv2bib.NEW_STYLE.match(citekey) and
-                not arxiv2bib.OLD_STYLE.match(citekey)):
-                # this is not an arxiv citation key
-                return
-
-            # citekey is an arxiv ID
-            arxivid = citekey
-            if (arxivid not in citearxiv_uselist):
-                citearxiv_uselist.append(arxivid)
-
-        
-        jobname = auxfile.get_action_jobname(self.jobname, bibolamazifile)
+        citearxiv_uselist = self._get_cited_arxiv_ids()
 
-        auxfile.get_all_auxfile_citations(jobname, bibolamazifile,
-                                          filtername=self.name(),
-                                          search_dirs=self.search_dirs,
-                                          return_set=False,
-                                          callback=add_to_cite_list,
-                                          )
-        
         #
         # Now, fetch all bib entries that we need.
         #
@@ -218,6 +196,49 @@ class CiteArxivFilter(BibFilter):
         
         return
 
+    def _get_cited_arxiv_ids(self):
+        # the aux file is parsed only once, both for prefetch_requests() and
+        # for filter_bibolamazifile()
+        if self._cited_arxiv_ids is not None:
+            return self._cited_arxiv_ids
+
+        bibolamazifile = self.bibolamaziFile()
+
+        citearxiv_uselist = []
+
+        #
+        # find and analyze jobname.aux. Look for \citation{...}'s and collect them.
+        #
+
+        def add_to_cite_list(citekey):
+            if self.prefix:
+                if not citekey.startswith(self.prefix+":"):
+                    return
+                citekey = citekey[len(self.prefix)+1:]
+
+            if (not arxiv2bib.NEW_STYLE.match(citekey) and
+                not arxiv2bib.OLD_STYLE.match(citekey)):
+                # this is not an arxiv citation key
+                return
+
+            # citekey is an arxiv ID
+            arxivid = citekey
+            if (arxivid not in citearxiv_uselist):
+                citearxiv_uselist.append(arxivid)
+
+        
+        jobname = auxfile.get_action_jobname(self.jobname, bibolamazifile)
+
+        auxfile.get_all_auxfile_citations(jobname, bibolamazifile,
+                                          filtername=self.name(),
+                                          search_dirs=self.search_dirs,
+                                          return_set=False,
+                                          callback=add_to_cite_list,
+                                          )
+
+        self._cited_arxiv_ids = citearxiv_uselist
+        return citearxiv_uselist
+
 
 def bibolamazi_filter_class():
     return CiteArxivFilter
@@ -25,18 +25,24 @@ import re
 #import os
 #import os.path
 import io
+import time
+import datetime
+import threading
 import warnings
+import email.utils
+import concurrent.futures
+from urllib.parse import urlsplit
 import logging
 logger = logging.getLogger(__name__)
 
-import requests
-
 #from pybtex.database import BibliographyData
 import pybtex.database.input.bibtex as inputbibtex
 
 from bibolamazi.core.bibfilter import BibFilter #, BibFilterError
 from bibolamazi.core.bibfilter.argtypes import CommaStrList
 from bibolamazi.core.bibusercache import BibUserCacheAccessor
+from bibolamazi.core import transport
+from bibolamazi.core import ratelimit
 #from bibolamazi.core.butils import getbool
 
 from .util import auxfile
@@ -53,11 +59,90 @@ rx_doi = re.compile(r'^10\.[0-9a-zA-Z._+-]+/.+$')
 
 
 
+class _HostRetryDeferrer:
+    """
+    Holds back the requests made to each host, possibly from several threads,
+    after a server asked us to come back later.  (The rate at which requests
+    are issued in normal operation is limited by :py:mod:`core.ratelimit`.)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_time = {}
+
+    def wait(self, host):
+        """
+        Wait until we may send the next request to `host`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            t = self._next_time.get(host, now)
+        if t > now:
+            time.sleep(t - now)
+
+    def defer(self, host, delay):
+        """
+        Don't send any request to `host` for the next `delay` seconds (e.g., if
+        the server told us so with a `Retry-After:` header).
+        """
+        with self._lock:
+            t = time.monotonic() + delay
+            self._next_time[host] = max(t, self._next_time.get(host, t))
+
+
+def _parse_retry_after(value):
+    # The Retry-After: header is either a number of seconds, or an HTTP date.
+    # Returns the number of seconds to wait, or None if there's no valid value.
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+
 class DoiOrgFetchedInfoCacheAccessor(BibUserCacheAccessor):
     """
     A `BibUserCacheAccessor` for fetching and accessing information obtained
     from doi.org.
     """
+
+    # the fetched information is the same for all bibolamazi files
+    shared_cache = True
+
+    #: The URL to which the DOI is appended in order to resolve it
+    doi_base_url = 'https://doi.org/'
+
+    #: How many DOIs may be resolved at the same time
+    max_concurrent_requests = 8
+
+    #: The minimal time interval (in seconds) between two requests to doi.org.
+    #: This is enforced across all bibolamazi processes (see
+    #: :py:mod:`~bibolamazi.core.ratelimit`).
+    min_request_interval = 0.1
+
+    #: Timeout (in seconds) for each request.  If `None`, the default timeout
+    #: of the transport layer is used (see
+    #: :py:func:`~bibolamazi.core.transport.set_default_timeout`).
+    request_timeout = None
+
+    #: How many times we attempt to fetch a DOI before giving up
+    max_tries = 5
+
+    #: Initial delay (in seconds) before retrying a failed request.  The delay is
+    #: doubled after each failure, up to `max_retry_delay`, unless the server
+    #: specifies a delay with a `Retry-After:` header.
+    retry_delay = 1
+    max_retry_delay = 60
+
     def __init__(self, **kwargs):
         super().__init__(
             cache_name='doi_org_fetched_info',
@@ -86,14 +171,21 @@ class DoiOrgFetchedInfoCacheAccessor(BibUserCacheAccessor):
         The argument `doilist` should be any iterable yielding DOIs.
 
         Only those requested entries which are not already in the cache are fetched.
+
+        Up to :py:attr:`max_concurrent_requests` DOIs are resolved at the same
+        time.  Failed requests are retried with an increasing delay, honoring
+        any `Retry-After:` header sent by the server.
         """
 
         cache_entrydic = self.cacheDic()['fetched']
 
         missing_keys = []
+        seen_keys = set()
         for doi in doilist:
-            if doi not in missing_keys and \
-               (doi not in cache_entrydic or cache_entrydic.get(doi) is None):
+            if doi in seen_keys:
+                continue
+            seen_keys.add(doi)
+            if doi not in cache_entrydic or cache_entrydic.get(doi) is None:
                 missing_keys.append(doi)
 
         if not missing_keys:
@@ -101,59 +193,141 @@ class DoiOrgFetchedInfoCacheAccessor(BibUserCacheAccessor):
             # nothing to fetch
             return True
 
+        try:
+            transport.check_online(self.doi_base_url)
+            transport.check_deadline(self.doi_base_url)
+        except transport.OfflineError:
+            logger.warning("citedoi: Offline mode, not fetching information for %d DOI(s) "
+                           "from doi.org", len(missing_keys))
+            return False
+        except transport.DeadlineExceededError:
+            logger.warning("citedoi: Network deadline exceeded, not fetching information for "
+                           "DOI(s) %s", ", ".join(missing_keys))
+            return False
+
         logger.info("citedoi: Fetching missing information from doi.org ...")
 
-        # use a Session() so that we keep the connection alive and reuse it multiple times
-        # for the different requests
-        with requests.Session() as reqsession:
+        logger.longdebug('fetching missing doi list %r', missing_keys)
+
+        ratelimit.set_rate_limit(
+            urlsplit(self.doi_base_url).netloc,
+            1.0/self.min_request_interval if self.min_request_interval else None
+        )
+        deferrer = _HostRetryDeferrer()
+
+        exc = None
+        done_keys = set()
+        num_workers = min(self.max_concurrent_requests, len(missing_keys))
+        # The warnings filters are global, so they are set here once rather than
+        # in each worker thread (catch_warnings() isn't thread-safe).
+        with warnings.catch_warnings():
+            # ignore ResourceWarning: unclosed <socket.socket ...>
+            warnings.simplefilter("ignore", ResourceWarning)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = dict([
+                    (executor.submit(self._fetch_one_doi, doi, deferrer), doi)
+                    for doi in missing_keys
+                ])
+                # store the results from this thread, as they come in
+                for future in concurrent.futures.as_completed(futures):
+                    doi = futures[future]
+                    try:
+                        bibtex, num_requests = future.result()
+                    except concurrent.futures.CancelledError:
+                        continue
+                    except Exception as e:
+                        if exc is None:
+                            # don't insist with the other DOIs
+                            exc = e
+                            for f in futures:
+                                f.cancel()
+                        continue
+                    done_keys.add(doi)
+                    self.recordNetworkFetch(num_requests)
+                    if bibtex is not None:
+                        cache_entrydic[doi]['bibtex'] = bibtex
+
+        if isinstance(exc, transport.DeadlineExceededError):
+            logger.warning("citedoi: Network deadline exceeded, information for DOI(s) %s "
+                           "was not fetched",
+                           ", ".join([ doi for doi in missing_keys if doi not in done_keys ]))
+            return False
+        if exc is not None:
+            raise exc
 
-            # Header: Accept: application/x-bibtex  -- to get the bibtex entry
-            reqsession.headers.update({ 'Accept': 'application/x-bibtex; charset=utf-8' })
+        logger.longdebug("citedoi info: Got all references. cacheDic() is now:  %r", self.cacheDic())
+        logger.longdebug("... and cacheObject().cachedic is now:  %r", self.cacheObject().cachedic)
 
-            logger.longdebug('fetching missing doi list %r', missing_keys)
+        return True
 
-            r = None
-            for doi in missing_keys:
-                # perform individual request
-                logger.longdebug("requesting bibtex entry for doi %s", doi)
-                for tries in range(5):
-                    try:
-                        exc = None
-                        url = 'https://doi.org/' + doi
+    def _fetch_one_doi(self, doi, deferrer):
+        #
+        # Runs in a worker thread.  Returns a tuple (bibtex, num_requests), where
+        # bibtex is None if the DOI couldn't be resolved.  Raises the last
+        # exception if all attempts failed with an exception.
+        #
+        url = self.doi_base_url + doi
+        host = urlsplit(url).netloc
+
+        logger.longdebug("requesting bibtex entry for doi %s", doi)
+
+        exc = None
+        r = None
+        num_requests = 0
+        for tries in range(self.max_tries):
+            backoff = min(self.retry_delay * 2**tries, self.max_retry_delay)
+
+            deferrer.wait(host)
+            try:
+                exc = None
+                num_requests += 1
+                # Header: Accept: application/x-bibtex  -- to get the bibtex entry
+                r = transport.get(url, headers={'Accept': 'application/x-bibtex; charset=utf-8'},
+                                  timeout=self.request_timeout)
+
+            except (transport.OfflineError, transport.DeadlineExceededError):
+                raise
+            except Exception as e:
+                # meant to catch SSLError -- we can't rely on
+                #    ``from requests.packages.urllib3.exceptions import SSLError``
+                # because that doesn't always exist, depending on the `requests`
+                # version/edition/installation
+                logger.debug("Got exception in requests(), tries=%d: %s", tries, e)
+                exc = e
+                if tries + 1 < self.max_tries:
+                    remaining = transport.time_remaining()
+                    time.sleep(backoff if remaining is None else min(backoff, remaining))
+                continue
 
-                        with warnings.catch_warnings():
-                            # ignore ResourceWarning: unclosed <socket.socket ...>
-                            warnings.simplefilter("ignore", ResourceWarning)
+            if r.status_code == 429 or r.status_code >= 500:
+                # rate limiting or temporary server error -- try again later
+                delay = _parse_retry_after(r.headers.get('Retry-After'))
+                if delay is None:
+                    delay = backoff
+                logger.debug("Got HTTP %d for doi %s, tries=%d, retrying in %s seconds",
+                             r.status_code, doi, tries, delay)
+                deferrer.defer(host, delay)
+                continue
 
-                            r = reqsession.get(url)
+            break
 
-                    except Exception as e:
-                        # meant to catch SSLError -- we can't rely on
-                        #    ``from requests.packages.urllib3.exceptions import SSLError``
-                        # because that doesn't always exist, depending on the `requests`
-                        # version/edition/installation
-                        logger.debug("Got exception in requests(), tries=%d: %s", tries, e)
-                        exc = e
-                        continue
-                    break
-                if exc is not None:
-                    raise exc
-                if r.status_code != 200:
-                    logger.warning("Could not fetch reference information for key '%s' (HTTP %d):\n\t%s",
-                                   doi, r.status_code, r.text)
-                    continue
+        if exc is not None:
+            raise exc
+        if r.status_code != 200:
+            logger.warning("Could not fetch reference information for key '%s' (HTTP %d):\n\t%s",
+                           doi, r.status_code, r.text)
+            return (None, num_requests)
 
-                bibtex = r.text.strip()
-                if not bibtex:
-                    logger.warning("Could not fetch reference for DOI '%s': no content returned", doi)
-                    continue
+        bibtex = r.text.strip()
+        if not bibtex:
+            logger.warning("Could not fetch reference for DOI '%s': no content returned", doi)
+            return (None, num_requests)
 
-                cache_entrydic[doi]['bibtex'] = bibtex
+        return (bibtex, num_requests)
 
-        logger.longdebug("citedoi info: Got all references. cacheDic() is now:  %r", self.cacheDic())
-        logger.longdebug("... and cacheObject().cachedic is now:  %r", self.cacheObject().cachedic)
 
-        return True
+    def prefetch(self, items):
+        self.fetchDoiInfo(items)
 
 
     def getDoiInfo(self, doi):
@@ -253,6 +427,8 @@ class CiteDoiFilter(BibFilter):
         if not self.search_dirs:
             self.search_dirs = ['.', '_cleanlatexfiles'] # also for my cleanlatex utility :)
 
+        self._cited_dois = None
+
         logger.debug('citearxiv: jobname=%r', jobname)
 
 
@@ -265,54 +441,21 @@ class CiteDoiFilter(BibFilter):
 
     def requested_cache_accessors(self):
         return [
-            DoiOrgFetchedInfoCacheAccessor
+            DoiOrgFetchedInfoCacheAccessor,
+            auxfile.AuxCitationIndexCacheAccessor,
             ]
 
+    def prefetch_requests(self):
+        return {
+            DoiOrgFetchedInfoCacheAccessor: [ doi for citekey, doi in self._get_cited_dois() ]
+            }
+
     def filter_bibolamazifile(self, bibolamazifile):
 
         doiorg_accessor = self.cacheAccessor(DoiOrgFetchedInfoCacheAccessor)
 
-        #
-        # find and analyze jobname.aux. Look for \citation{...}'s and collect them.
-        #
-
-        doi_uselist = []
-
-        def add_to_cite_list(citekey):
-
-            citekeyorig = citekey
-
-            # ignore any key that does not have the correct prefix
-            if self.prefix:
-                if not citekey.startswith(self.prefix+":"):
-                    return
-                citekey = citekey[len(self.prefix)+1:]
-
-            # strip "--comment" from the user's citekey
-            citekey = re.sub(r'--.*$', '', citekey)
+        doi_uselist = self._get_cited_dois()
 
-            if not rx_doi.match(citekey):
-                # this is not a DOI
-                if self.prefix:
-                    # but it was given with a prefix, like doi:, so raise a warning:
-                    logger.warning("Key '%s' does not look like a DOI", citekeyorig)
-                return
-
-            # citekey is a DOI
-            doi = citekey
-            if doi not in doi_uselist:
-                doi_uselist.append( (citekeyorig, doi) )
-
-            
-        jobname = auxfile.get_action_jobname(self.jobname, bibolamazifile)
-
-        auxfile.get_all_auxfile_citations(jobname, bibolamazifile,
-                                          filtername=self.name(),
-                                          search_dirs=self.search_dirs,
-                                          return_set=False,
-                                          callback=add_to_cite_list,
-                                          )
-        
         #
         # Now, fetch all bib entries that we need.
         #
@@ -361,6 +504,58 @@ class CiteDoiFilter(BibFilter):
         
         return
 
+    def _get_cited_dois(self):
+        # the aux file is parsed only once, both for prefetch_requests() and
+        # for filter_bibolamazifile()
+        if self._cited_dois is not None:
+            return self._cited_dois
+
+        bibolamazifile = self.bibolamaziFile()
+
+        #
+        # find and analyze jobname.aux. Look for \citation{...}'s and collect them.
+        #
+
+        doi_uselist = []
+
+        def add_to_cite_list(citekey):
+
+            citekeyorig = citekey
+
+            # ignore any key that does not have the correct prefix
+            if self.prefix:
+                if not citekey.startswith(self.prefix+":"):
+                    return
+                citekey = citekey[len(self.prefix)+1:]
+
+            # strip "--comment" from the user's citekey
+            citekey = re.sub(r'--.*$', '', citekey)
+
+            if not rx_doi.match(citekey):
+                # this is not a DOI
+                if self.prefix:
+                    # but it was given with a prefix, like doi:, so raise a warning:
+                    logger.warning("Key '%s' does not look like a DOI", citekeyorig)
+                return
+
+            # citekey is a DOI
+            doi = citekey
+            if doi not in doi_uselist:
+                doi_uselist.append( (citekeyorig, doi) )
+
+            
+        jobname = auxfile.get_action_jobname(self.jobname, bibolamazifile)
+
+        auxfile.get_all_auxfile_citations(jobname, bibolamazifile,
+                                          filtername=self.name(),
+                                          search_dirs=self.search_dirs,
+                                          return_set=False,
+                                          callback=add_to_cite_list,
+                                          )
+
+        self._cited_dois = doi_uselist
+        return doi_uselist
+
 
 def bibolamazi_filter_class():
     return CiteDoiFilter
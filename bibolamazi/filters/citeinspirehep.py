@@ -25,13 +25,13 @@ import re
 #import os.path
 import io
 import time
+from urllib.parse import urlsplit
 import logging
 logger = logging.getLogger(__name__)
 
 # make sure html.parser is imported (and detected by pyinstaller)
 import html.parser # lgtm [py/unused-import]
 
-import requests
 #from bs4 import BeautifulSoup
 
 #from pybtex.database import BibliographyData
@@ -41,6 +41,8 @@ import arxiv2bib # arxiv id regex'es
 from bibolamazi.core.bibfilter import BibFilter #, BibFilterError
 from bibolamazi.core.bibfilter.argtypes import CommaStrList
 from bibolamazi.core.bibusercache import BibUserCacheAccessor
+from bibolamazi.core import transport
+from bibolamazi.core import ratelimit
 #from bibolamazi.core.butils import getbool
 
 from .util import auxfile
@@ -49,6 +51,41 @@ from .util import auxfile
 
 # ---- API info ------
 
+# These reference types can be looked up in batches, because we can tell which
+# of the returned records corresponds to which key
+_batchable_ref_types = ('texkey', 'eprint', 'doi')
+
+_rx_bibtex_entry_start = re.compile(r'^\s*@', flags=re.MULTILINE)
+_rx_bibtex_entry_key = re.compile(r'^\s*@\s*\w+\s*[{(]\s*([^,\s]+)\s*,')
+_rx_bibtex_field = {
+    'eprint': re.compile(r'\beprint\s*=\s*["{]\s*([^"}\s]+)\s*["}]', flags=re.IGNORECASE),
+    'doi': re.compile(r'\bdoi\s*=\s*["{]\s*([^"}\s]+)\s*["}]', flags=re.IGNORECASE),
+}
+
+def _split_bibtex_entries(text):
+    starts = [ m.start() for m in _rx_bibtex_entry_start.finditer(text) ]
+    return [ text[s:e].strip() for (s, e) in zip(starts, starts[1:] + [len(text)]) ]
+
+def _normalize_identifier(ref_type, value):
+    if ref_type == 'eprint':
+        # ignore any version number
+        value = re.sub(r'v\d+$', '', value)
+    elif ref_type == 'doi':
+        # DOIs are case-insensitive
+        value = value.lower()
+    return (ref_type, value)
+
+def _bibtex_entry_identifiers(bibtex):
+    # yields the (ref_type, value) pairs which identify the given bibtex entry
+    m = _rx_bibtex_entry_key.match(bibtex)
+    if m is not None:
+        yield ('texkey', m.group(1))
+    for (ref_type, rx) in _rx_bibtex_field.items():
+        m = rx.search(bibtex)
+        if m is not None:
+            yield _normalize_identifier(ref_type, m.group(1))
+
+
 
 
 class InspireHEPFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
@@ -56,6 +93,25 @@ class InspireHEPFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
     A `BibUserCacheAccessor` for fetching and accessing information retrieved from the
     Inspire-HEP API.
     """
+
+    # the fetched information is the same for all bibolamazi files
+    shared_cache = True
+
+    #: The URL of the InspireHEP literature search API
+    api_url = 'https://inspirehep.net/api/literature'
+
+    #: The maximal number of keys which are looked up with a single query
+    batch_size = 50
+
+    #: The number of requests per second we allow ourselves on average, and the
+    #: number of requests which may be issued in a quick burst.  (InspireHEP
+    #: allows 15 requests in a 5-second window, see
+    #: https://github.com/inspirehep/rest-api-doc#rate-limiting.)  These limits
+    #: are shared by all bibolamazi processes (see
+    #: :py:mod:`~bibolamazi.core.ratelimit`).
+    max_request_rate = 3
+    max_request_burst = 15
+
     def __init__(self, **kwargs):
         super().__init__(
             cache_name='inspirehep_fetched_api_info',
@@ -165,6 +221,12 @@ class InspireHEPFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
         (Sanitized keys)
 
         Only those requested entries which are not already in the cache are fetched.
+
+        Keys which refer to a texkey, an arXiv ID or a DOI are looked up in
+        batches of up to :py:attr:`batch_size` keys, using a single search
+        query combining them with "or".  The other keys, as well as any key
+        which could not be matched with a search result, are then looked up
+        with individual requests.
         """
 
         cache_entrydic = self.cacheDic()['fetched']
@@ -179,69 +241,86 @@ class InspireHEPFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
             # nothing to fetch
             return True
 
-        logger.info("citeinspirehep: Fetching missing information from InspireHEP...")
-
-        # use a Session() so that we keep the connection alive and reuse it multiple times
-        # for the different requests
-        with requests.Session() as reqsession:
+        try:
+            transport.check_online(self.api_url)
+            transport.check_deadline(self.api_url)
+        except transport.OfflineError:
+            logger.warning("citeinspirehep: Offline mode, not fetching information for %d key(s) "
+                           "from InspireHEP", len(missing_keys))
+            return False
+        except transport.DeadlineExceededError:
+            logger.warning("citeinspirehep: Network deadline exceeded, not fetching information "
+                           "for key(s) %s", ", ".join(missing_keys))
+            return False
 
-            # once we get a 429 code from inspire.net (rate limiting), automatically
-            # pause a bit after each request.
-            pre_request_wait = False
-            wait_dt = 0.51
+        logger.info("citeinspirehep: Fetching missing information from InspireHEP...")
 
-            logger.longdebug('fetching missing id list %r' %(missing_keys))
-            for key in missing_keys:
+        ratelimit.set_rate_limit(urlsplit(self.api_url).netloc, self.max_request_rate,
+                                 burst=self.max_request_burst)
+
+        # once we get a 429 code from inspire.net (rate limiting), automatically
+        # pause a bit after each request.
+        rate_limit_state = { 'pre_request_wait': False }
+
+        logger.longdebug('fetching missing id list %r' %(missing_keys))
+
+        batchable_keys = [
+            key for key in missing_keys
+            if self.user_keys_parsed[key]['p_query_term'] in _batchable_ref_types
+        ]
+        single_keys = [ key for key in missing_keys if key not in batchable_keys ]
+
+        done_keys = set()
+        try:
+            for i in range(0, len(batchable_keys), self.batch_size):
+                batch = batchable_keys[i:i+self.batch_size]
+                if len(batch) == 1:
+                    single_keys += batch
+                    continue
+
+                found = self._fetch_batch(batch, rate_limit_state)
+                for key, bibtex in found.items():
+                    cache_entrydic[key]['bibtex'] = bibtex
+                    done_keys.add(key)
+
+                # fall back to individual requests for keys we couldn't match
+                not_found = [ key for key in batch if key not in found ]
+                if not_found:
+                    logger.debug("citeinspirehep: %d key(s) not resolved by batched query, "
+                                 "will query them individually: %r", len(not_found), not_found)
+                single_keys += not_found
+
+            for key in single_keys:
                 pk = self.user_keys_parsed[key]
                 qs = { 'q': pk['p_query'],
                        'format': 'bibtex'
                        }
                 # perform individual request
                 logger.longdebug("fetching for key=%s: %r", key, qs)
-                for tries in range(5):
-                    try:
-                        if pre_request_wait:
-                            time.sleep(wait_dt)
-
-                        exc = None
-                        r = reqsession.get('https://inspirehep.net/api/literature', params=qs)
-
-                        response_body = r.text
-
-                        logger.longdebug("Got response for key=%s: %s", key, response_body)
+                r = self._do_request(qs, rate_limit_state)
+                done_keys.add(key)
+                if r is None:
+                    continue
 
-                        if r.status_code == 200:
-                            # success
-                            cache_entrydic[key]['bibtex'] = response_body
-                            break
+                response_body = r.text
 
-                        if r.status_code == 429:
-                            # rate limiting, see
-                            # https://github.com/inspirehep/rest-api-doc#rate-limiting
-                            logger.debug("citeinspirehep: Got rate limiting instruction "
-                                         " from inspire.net, waiting...")
-                            pre_request_wait = True
-                            continue
+                logger.longdebug("Got response for key=%s: %s", key, response_body)
 
-                        logger.warning(
-                            "Could not fetch reference information for key `%s' (HTTP %d):\n\t%s",
-                            key, r.status_code, r.text
-                        )
-                        break
-
-                    except Exception as e:
-                        # meant to catch SSLError -- we can't rely on
-                        #    ``from requests.packages.urllib3.exceptions import SSLError``
-                        # because that doesn't always exist, depending on the `requests`
-                        # version/edition/installation
-                        logger.debug("Got exception in requests(), tries=%d: %s", tries, e)
-                        exc = e
-                        continue
-
-                if exc is not None:
-                    raise exc
+                if r.status_code == 200:
+                    # success
+                    cache_entrydic[key]['bibtex'] = response_body
+                    continue
 
+                logger.warning(
+                    "Could not fetch reference information for key `%s' (HTTP %d):\n\t%s",
+                    key, r.status_code, r.text
+                )
 
+        except transport.DeadlineExceededError:
+            logger.warning("citeinspirehep: Network deadline exceeded, information for key(s) %s "
+                           "was not fetched",
+                           ", ".join([ key for key in missing_keys if key not in done_keys ]))
+            return False
 
         logger.longdebug("inspirehep API info: Got all references. cacheDic() is now:  %r",
                          self.cacheDic())
@@ -250,6 +329,83 @@ class InspireHEPFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
 
         return True
 
+    def _fetch_batch(self, batch, rate_limit_state):
+        #
+        # Look up all the keys in `batch` with a single query.  Returns a
+        # dictionary { key: bibtex } of the keys which could be matched with one
+        # of the returned records.
+        #
+        qs = { 'q': " or ".join([ self.user_keys_parsed[key]['p_query'] for key in batch ]),
+               'format': 'bibtex',
+               'size': str(2*len(batch)),
+               }
+        logger.longdebug("fetching batch of %d keys: %r", len(batch), qs)
+        r = self._do_request(qs, rate_limit_state)
+        if r is None or r.status_code != 200:
+            logger.debug("citeinspirehep: batched query failed (%s)",
+                         "HTTP %d"%(r.status_code) if r is not None else "rate limited")
+            return {}
+
+        logger.longdebug("Got response for batch: %s", r.text)
+
+        # index the returned records by the values we can match the keys with
+        records = {}
+        for bibtex in _split_bibtex_entries(r.text):
+            for (ref_type, value) in _bibtex_entry_identifiers(bibtex):
+                records.setdefault( (ref_type, value), bibtex )
+
+        found = {}
+        for key in batch:
+            pk = self.user_keys_parsed[key]
+            ident = _normalize_identifier(pk['p_query_term'], key)
+            if ident in records:
+                found[key] = records[ident]
+        return found
+
+    def _do_request(self, qs, rate_limit_state):
+        #
+        # Perform a request to the API, dealing with rate limiting instructions.
+        # Returns the response, or None if we were rate limited on each attempt.
+        #
+        wait_dt = 0.51
+        for tries in range(5):
+            try:
+                if rate_limit_state['pre_request_wait']:
+                    time.sleep(wait_dt)
+
+                exc = None
+                self.recordNetworkFetch()
+                r = transport.get(self.api_url, params=qs)
+
+                if r.status_code == 429:
+                    # rate limiting, see
+                    # https://github.com/inspirehep/rest-api-doc#rate-limiting
+                    logger.debug("citeinspirehep: Got rate limiting instruction "
+                                 " from inspire.net, waiting...")
+                    rate_limit_state['pre_request_wait'] = True
+                    continue
+
+                return r
+
+            except (transport.OfflineError, transport.DeadlineExceededError):
+                raise
+            except Exception as e:
+                # meant to catch SSLError -- we can't rely on
+                #    ``from requests.packages.urllib3.exceptions import SSLError``
+                # because that doesn't always exist, depending on the `requests`
+                # version/edition/installation
+                logger.debug("Got exception in requests(), tries=%d: %s", tries, e)
+                exc = e
+                continue
+
+        if exc is not None:
+            raise exc
+        return None
+
+
+    def prefetch(self, items):
+        self.fetchInspireHEPApiInfo(items)
+
 
     def getInspireHEPInfo(self, key):
         """
@@ -370,6 +526,8 @@ class CiteInspireHEPFilter(BibFilter):
         if not self.search_dirs:
             self.search_dirs = ['.', '_cleanlatexfiles'] # also for my cleanlatex utility :)
 
+        self._cited_keys = None
+
         logger.debug('citeinspirehep: jobname=%r', jobname)
 
 
@@ -382,43 +540,22 @@ class CiteInspireHEPFilter(BibFilter):
 
     def requested_cache_accessors(self):
         return [
-            InspireHEPFetchedAPIInfoCacheAccessor
+            InspireHEPFetchedAPIInfoCacheAccessor,
+            auxfile.AuxCitationIndexCacheAccessor,
             ]
 
+    def prefetch_requests(self):
+        used_keys, used_keys_dic = self._get_cited_keys()
+        return {
+            InspireHEPFetchedAPIInfoCacheAccessor: list(used_keys_dic.values())
+            }
+
     def filter_bibolamazifile(self, bibolamazifile):
 
         cache_accessor = self.cacheAccessor(InspireHEPFetchedAPIInfoCacheAccessor)
 
-        # dictionary of { userkey: key }
-        used_keys_dic = {}
-        used_keys = [] # keys, in the order they were encountered in the aux file
-
-        #
-        # find and analyze jobname.aux. Look for \citation{...}'s and collect them.
-        #
-
-        def add_to_cite_list(userkey):
-            key = cache_accessor.parse_and_store_key(userkey)
-            if key is None:
-                # didn't recognize citation, skip.
-                return
-
-            if userkey in used_keys:
-                return
-            
-            used_keys_dic[userkey] = key
-            used_keys.append(userkey)
-                
-        
-        jobname = auxfile.get_action_jobname(self.jobname, bibolamazifile)
+        used_keys, used_keys_dic = self._get_cited_keys()
 
-        auxfile.get_all_auxfile_citations(jobname, bibolamazifile,
-                                          filtername=self.name(),
-                                          search_dirs=self.search_dirs,
-                                          return_set=False,
-                                          callback=add_to_cite_list,
-                                          )
-        
         #
         # Now, fetch all bib entries that we need.
         #
@@ -460,6 +597,48 @@ class CiteInspireHEPFilter(BibFilter):
         
         return
 
+    def _get_cited_keys(self):
+        # the aux file is parsed only once, both for prefetch_requests() and
+        # for filter_bibolamazifile()
+        if self._cited_keys is not None:
+            return self._cited_keys
+
+        bibolamazifile = self.bibolamaziFile()
+        cache_accessor = self.cacheAccessor(InspireHEPFetchedAPIInfoCacheAccessor)
+
+        # dictionary of { userkey: key }
+        used_keys_dic = {}
+        used_keys = [] # keys, in the order they were encountered in the aux file
+
+        #
+        # find and analyze jobname.aux. Look for \citation{...}'s and collect them.
+        #
+
+        def add_to_cite_list(userkey):
+            key = cache_accessor.parse_and_store_key(userkey)
+            if key is None:
+                # didn't recognize citation, skip.
+                return
+
+            if userkey in used_keys:
+                return
+            
+            used_keys_dic[userkey] = key
+            used_keys.append(userkey)
+                
+        
+        jobname = auxfile.get_action_jobname(self.jobname, bibolamazifile)
+
+        auxfile.get_all_auxfile_citations(jobname, bibolamazifile,
+                                          filtername=self.name(),
+                                          search_dirs=self.search_dirs,
+                                          return_set=False,
+                                          callback=add_to_cite_list,
+                                          )
+
+        self._cited_keys = (used_keys, used_keys_dic)
+        return self._cited_keys
+
 
 def bibolamazi_filter_class():
     return CiteInspireHEPFilter
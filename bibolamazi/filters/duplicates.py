@@ -27,6 +27,7 @@ import codecs
 import unicodedata
 import string
 import textwrap
+import concurrent.futures
 #import collections
 #import hashlib
 import logging
@@ -40,9 +41,13 @@ from bibolamazi.core.bibfilter.argtypes import CommaStrList
 from bibolamazi.core import butils
 from bibolamazi.core import bibusercache
 from bibolamazi.core.bibusercache import tokencheckers
+from bibolamazi.core.bibusercache.fingerprints import entry_fingerprint
 
 from .util import arxivutil
 from .util import auxfile
+from .util import strdistance
+# levenshtein() used to be defined in this module
+from .util.strdistance import levenshtein
 
 logger = logging.getLogger(__name__)
 
@@ -351,6 +356,9 @@ class DuplicatesEntryInfoCacheAccessor(bibusercache.BibUserCacheAccessor):
             cache_name='duplicates_entryinfo',
             **kwargs
             )
+        # {token_a: set of token_b}, see query_non_duplicate()
+        self._non_duplicates = {}
+        self._non_duplicates_changed = set()
 
 
     def initialize(self, cache_obj, **kwargs):
@@ -364,7 +372,9 @@ class DuplicatesEntryInfoCacheAccessor(bibusercache.BibUserCacheAccessor):
             self.bibolamaziFile().bibliographyData(),
             store_type=True,
             store_persons=['author'],
-            fields=list(set(
+            # sorted() so that the token doesn't depend on the set's iteration order,
+            # which may change from one run to another
+            fields=sorted(set(
                 # from arxivInfo
                 arxivutil.arxivinfo_from_bibtex_fields +
                 [
@@ -412,51 +422,68 @@ class DuplicatesEntryInfoCacheAccessor(bibusercache.BibUserCacheAccessor):
         cache_a['title_clean'] = cleantitle(a.fields.get('title', ''))
 
 
-    # PhF -- turns out to be slower with cached comparison !!! Probably because
-    # we gotta compute a sh*tload of hashes?
-
-
-    # def _pairkey_entries(self, entriescache, key1, key2):
-    #     # do NOT use python's built-in hash(), it can change from one process to
-    #     # another.  Use md5, which will always give the same hash
-    #     return hashlib.md5(
-    #             ('%s\n%s\n%s\n%s'%(str(key1), str(entriescache.token_for(key1)),
-    #                                str(key2), str(entriescache.token_for(key2))) ).encode('utf-8')
-    #         ).digest()
-
-    # def query_cache_comparison(self, key1, key2):
-
-    #     entriescache = self.cacheDic()['entries']
-    #     comparisonscache =  self.cacheDic()['comparisons']
-
-    #     if key1 not in entriescache or key2 not in entriescache:
-    #         raise ValueError("store_cache_comparison: entries must already be in entries cache (%s and %s)",
-    #                          key1, key2)
-
-    #     pairkey = self._pairkey_entries(entriescache, key1, key2)
-
-    #     if pairkey not in comparisonscache:
-    #         return None
-
-    #     return comparisonscache[pairkey]
-
-    # def store_cache_comparison(self, key1, key2, is_duplicate):
-
-    #     entriescache = self.cacheDic()['entries']
-    #     comparisonscache =  self.cacheDic()['comparisons']
-
-    #     if key1 not in entriescache or key2 not in entriescache:
-    #         raise ValueError("store_cache_comparison: entries must already be in entries cache (%s and %s)",
-    #                          key1, key2)
-
-    #     pairkey = self._pairkey_entries(entriescache, key1, key2)
-
-    #     comparisonscache[pairkey] = bool(is_duplicate)
+    # Remember, across runs, which pairs of entries were found NOT to be
+    # duplicates.  (Comparing entries is cheaper than computing hashes of
+    # pairs of entries, so entries are identified by a "comparison token"
+    # which is computed once per run from the entry fingerprints, see
+    # DuplicatesFilter.filter_bibolamazifile().)  Positive matches are not
+    # stored: there are few of them, and they are always recompared so that
+    # the user is warned about possible typos.  Note that the comparison is not
+    # symmetric (e.g., the tolerance for typos depends on the length of the
+    # first entry's author names), so neither is this cache.
+
+    # During a run, the results are kept in python sets; each set is stored in
+    # the cache as a single string, because there can be very many pairs.
+
+    def _non_duplicates_of(self, token_a):
+        try:
+            return self._non_duplicates[token_a]
+        except KeyError:
+            pass
+        nondupcache = self.cacheDic()['non_duplicates']
+        others = set()
+        if token_a in nondupcache and isinstance(nondupcache[token_a], str):
+            others = set(nondupcache[token_a].split())
+        self._non_duplicates[token_a] = others
+        return others
+
+    def query_non_duplicate(self, token_a, token_b):
+        """
+        Return `True` if the entry with comparison token `token_a` was found not
+        to be a duplicate of the entry with comparison token `token_b` in a
+        previous run.
+        """
+        return token_b in self._non_duplicates_of(token_a)
 
-        
+    def store_non_duplicate(self, token_a, token_b):
+        """
+        Remember that the entry with comparison token `token_a` is not a
+        duplicate of the entry with comparison token `token_b`.  Call
+        :py:meth:`save_non_duplicates()` at the end of the run to store this
+        information in the cache.
+        """
+        self._non_duplicates_of(token_a).add(token_b)
+        self._non_duplicates_changed.add(token_a)
 
-        
-        
+    def save_non_duplicates(self, tokens):
+        """
+        Store the results given to :py:meth:`store_non_duplicate()` in the cache.
+        Forget the comparison results which involve entries whose comparison
+        token is not in `tokens` (e.g., entries which were modified or removed).
+        """
+        nondupcache = self.cacheDic()['non_duplicates']
+        for token_a in list(nondupcache.keys()):
+            if token_a not in tokens:
+                del nondupcache[token_a]
+        for token_a in set(nondupcache.keys()) | self._non_duplicates_changed:
+            if token_a not in tokens:
+                continue
+            others = self._non_duplicates_of(token_a)
+            keep = others & tokens
+            if len(keep) != len(others) or token_a in self._non_duplicates_changed:
+                nondupcache[token_a] = " ".join(sorted(keep))
+        self._non_duplicates = {}
+        self._non_duplicates_changed = set()
 
 
     def get_entry_cache(self, key):
@@ -573,6 +600,168 @@ class AliasList:
 
 
 
+class DuplicateCandidatesIndex:
+    """
+    Index of the entries which a new entry should be compared with, in order to
+    find out whether it is a duplicate of one of them.
+
+    :py:meth:`DuplicatesFilter._do_compare_entries()` can only consider two
+    entries to be duplicates if they have the same number of authors, and if
+    they have the same DOI, or the same arXiv ID, or the same (cleaned up)
+    title, or if one of them doesn't have a title.  The entries are indexed by
+    these properties, so that :py:meth:`candidates()` returns exactly those
+    entries which may be duplicates of a given entry, in the order in which
+    they were added.  The results of the duplicate search are the same as if
+    we compared the new entry with all the entries.
+
+    The cache information of each entry is read from the
+    `DuplicatesEntryInfoCacheAccessor` given as `dupl_entryinfo_cache_accessor`.
+    """
+    def __init__(self, dupl_entryinfo_cache_accessor):
+        super().__init__()
+        self.dupl_entryinfo_cache_accessor = dupl_entryinfo_cache_accessor
+        self._entries = {}  # key -> (seqno, key, entry, blocks)
+        self._blocks = {}   # block -> set of keys
+        self._seqno = 0
+
+    def _entry_blocks(self, key, entry):
+        cache = self.dupl_entryinfo_cache_accessor.get_entry_cache(key)
+        npers = len(cache['pers'])
+        blocks = [ ('all', npers) ]
+        doi = sanitize_doi(entry.fields.get('doi'))
+        if doi:
+            blocks.append( ('doi', npers, doi) )
+        arxivinfo = cache['arxivinfo']
+        if arxivinfo and 'arxivid' in arxivinfo:
+            blocks.append( ('arxiv', npers, arxivinfo['arxivid']) )
+        title = cache['title_clean']
+        if title:
+            blocks.append( ('title', npers, title) )
+        else:
+            blocks.append( ('notitle', npers) )
+        return blocks
+
+    def add(self, key, entry):
+        """
+        Add the given entry to the index.
+        """
+        blocks = self._entry_blocks(key, entry)
+        self._entries[key] = (self._seqno, key, entry, blocks)
+        self._seqno += 1
+        for block in blocks:
+            self._blocks.setdefault(block, set()).add(key)
+
+    def remove(self, key):
+        """
+        Remove the entry `key` from the index.
+        """
+        (seqno, key, entry, blocks) = self._entries.pop(key)
+        for block in blocks:
+            self._blocks[block].discard(key)
+
+    def update(self, key):
+        """
+        Update the index after the fields of the entry `key` were modified (e.g.
+        when it was merged with a duplicate).  The entry keeps its position.
+        """
+        (seqno, key, entry, blocks) = self._entries[key]
+        for block in blocks:
+            self._blocks[block].discard(key)
+        blocks = self._entry_blocks(key, entry)
+        self._entries[key] = (seqno, key, entry, blocks)
+        for block in blocks:
+            self._blocks.setdefault(block, set()).add(key)
+
+    def candidates(self, key, entry):
+        """
+        Return a list of tuples `(nkey, nentry)` of the indexed entries which
+        might be duplicates of the given entry, in the order in which they were
+        added to the index.
+        """
+        blocks = self._entry_blocks(key, entry)
+        npers = blocks[0][1]
+        if ('notitle', npers) in blocks:
+            # an entry without title may be a duplicate of any entry with the
+            # same number of authors
+            keys = self._blocks.get(('all', npers), set())
+        else:
+            keys = set(self._blocks.get(('notitle', npers), ()))
+            for block in blocks[1:]:
+                keys.update(self._blocks.get(block, ()))
+        found = sorted([ self._entries[k] for k in keys ], key=lambda x: x[0])
+        return [ (nkey, nentry) for (seqno, nkey, nentry, nblocks) in found ]
+
+
+
+# ------------------------------------------------
+# Comparing entries in worker processes
+#
+# Only the information which DuplicatesFilter._do_compare_entries() looks at is
+# sent to the worker processes, as compact tuples.
+
+_compare_fields = ('keywords', 'year', 'month', 'doi', 'volume', 'number')
+
+def _pack_compare_info(key, entry, cache):
+    arxivinfo = cache['arxivinfo']
+    return (
+        key,
+        tuple([ entry.fields.get(fld) for fld in _compare_fields ]),
+        tuple([ (last, initial) for (last, initial) in cache['pers'] ]),
+        arxivinfo['arxivid'] if arxivinfo and 'arxivid' in arxivinfo else None,
+        cache['note_cleaned'],
+        cache['j_abbrev'],
+        cache['title_clean'],
+    )
+
+class _CompareEntry:
+    # stands in for a pybtex Entry
+    def __init__(self, key, fields):
+        super().__init__()
+        self.key = key
+        self.fields = fields
+
+class _CompareCache(dict):
+    # stands in for the entry's cache; as for a BibUserCacheDic, missing items
+    # are empty
+    def __missing__(self, key):
+        return None
+
+def _unpack_compare_info(info):
+    (key, fieldvalues, pers, arxivid, note_cleaned, j_abbrev, title_clean) = info
+    entry = _CompareEntry(key, dict([ (fld, val)
+                                      for (fld, val) in zip(_compare_fields, fieldvalues)
+                                      if val is not None ]))
+    cache = _CompareCache(
+        pers=list(pers),
+        arxivinfo=({'arxivid': arxivid} if arxivid is not None else None),
+        note_cleaned=note_cleaned,
+        j_abbrev=j_abbrev,
+        title_clean=title_clean,
+    )
+    return (entry, cache)
+
+_worker_filter = None
+
+def _init_compare_worker():
+    global _worker_filter
+    # the main process compares duplicates again, and warns about possible typos
+    logger.setLevel(logging.ERROR)
+    _worker_filter = DuplicatesFilter()
+
+def _compare_entries_worker(infos, pairs):
+    # return those pairs `(akey, bkey)` of entries which are not duplicates
+    entries = dict([ (info[0], _unpack_compare_info(info)) for info in infos ])
+    non_duplicates = []
+    for (akey, bkey) in pairs:
+        (a, cache_a) = entries[akey]
+        (b, cache_b) = entries[bkey]
+        same, reason = _worker_filter._do_compare_entries(a, b, cache_a, cache_b)
+        if not same:
+            non_duplicates.append( (akey, bkey) )
+    return non_duplicates
+
+
+
 class DuplicatesFilter(BibFilter):
 
     helpauthor = HELP_AUTHOR
@@ -591,6 +780,7 @@ class DuplicatesFilter(BibFilter):
                  keep_only_used_in_jobname=None,
                  jobname_search_dirs=None,
                  ignore_fields_warning=None,
+                 processes=None,
                  *args):
         r"""
         DuplicatesFilter constructor.
@@ -648,6 +838,11 @@ class DuplicatesFilter(BibFilter):
         *jobname_search_dirs(CommaStrList): (use with -sJobname) search for the
                AUX file in the given directories, as for the only_used filter.
                Paths are absolute or relative to bibolamazi file.
+
+        *processes(int): the number of worker processes used to compare
+               entries with one another in large bibliographies.  By default,
+               all entries are compared in the main process.  Set to 0 to use
+               one process per CPU.
         """
 
         super().__init__()
@@ -723,6 +918,11 @@ class DuplicatesFilter(BibFilter):
         # ### PhF: Is this used at all or is this leftover code ???
         self.cache_entries_validator = None
 
+        self.processes = int(processes) if processes is not None else None
+
+        # the same pairs of names get compared many times
+        self._name_distance = strdistance.BoundedDistanceMemo()
+
         #if (not self.dupfile and not self.warn):
         #    logger.warning(
         #        "bibolamazi duplicates filter: no action will be taken as neither -sDupfile or"+
@@ -744,11 +944,14 @@ class DuplicatesFilter(BibFilter):
 
 
     def requested_cache_accessors(self):
-        return [
+        accessors = [
             DuplicatesEntryInfoCacheAccessor,
             arxivutil.ArxivInfoCacheAccessor,
             arxivutil.ArxivFetchedAPIInfoCacheAccessor,
             ]
+        if self.keep_only_used:
+            accessors.append(auxfile.AuxCitationIndexCacheAccessor)
+        return accessors
 
 
     def compare_entries(self, akey, bkey, a, b, dupl_entryinfo_cache_accessor):
@@ -762,20 +965,11 @@ class DuplicatesFilter(BibFilter):
 
         logger.longdebug('Comparing entries %s and %s', akey, bkey)
 
-        # PhF -- turns out to be slower with cached comparison !!! Probably
-        # because we gotta compute a sh*tload of hashes?
-        #
-        # r = dupl_entryinfo_cache_accessor.query_cache_comparison(akey, bkey)
-        # if r is not None:
-        #     return r, "Cached comparison result; clear cache to re-compare"
-
         cache_a = dupl_entryinfo_cache_accessor.get_entry_cache(akey)
         cache_b = dupl_entryinfo_cache_accessor.get_entry_cache(bkey)
 
         tf, reason = self._do_compare_entries(a, b, cache_a, cache_b)
 
-        # dupl_entryinfo_cache_accessor.store_cache_comparison(akey, bkey, tf)
-
         return tf, reason
 
     def _do_compare_entries(self, a, b, cache_a, cache_b):
@@ -794,10 +988,19 @@ class DuplicatesFilter(BibFilter):
                         a.key if m1 else b.key
                     ))
 
+        # indices of author names with possible typos, warn about them only if
+        # the entries are duplicates
         pending_pos_match_warning = []
         def pos_match():
-            for w in pending_pos_match_warning:
-                logger.warning(w)
+            if not logger.isEnabledFor(logging.WARNING):
+                # e.g. in a worker process, see _init_compare_worker()
+                return
+            for k in pending_pos_match_warning:
+                logger.warning(
+                    "Duplicate entries {} and {} have possible typo in author name: \"{}\" vs \"{}\""
+                    .format(a.key, b.key, str(a.persons.get('author',[])[k]),
+                            str(b.persons.get('author',[])[k]))
+                )
 
         if (len(apers) != len(bpers)):
             return False, "Author list lengths %d and %d differ"%(len(apers), len(bpers))
@@ -807,15 +1010,12 @@ class DuplicatesFilter(BibFilter):
             (lastb, inb) = bpers[k]
             # use Levenshtein distance to detect possible typos or alternative spellings
             # (e.g. Koenig vs Konig). Allow approx. one such typo per 8 characters.
-            lev_dist = levenshtein(lasta, lastb)
-            if (lev_dist > (1+int(len(lasta)/8)) or (ina and inb and ina != inb)):
+            max_lev_dist = 1+int(len(lasta)/8)
+            lev_dist = self._name_distance(lasta, lastb, max_lev_dist)
+            if (lev_dist > max_lev_dist or (ina and inb and ina != inb)):
                 return False, "Authors %r and %r differ"%((lasta, ina), (lastb, inb))
             if lev_dist > 0:
-                pending_pos_match_warning.append(
-                    "Duplicate entries {} and {} have possible typo in author name: \"{}\" vs \"{}\""
-                    .format(a.key, b.key, str(a.persons.get('author',[])[k]),
-                            str(b.persons.get('author',[])[k]))
-                )
+                pending_pos_match_warning.append(k)
 
 
         logger.longdebug("Author list matches! %r and %r ",apers,bpers)
@@ -880,11 +1080,11 @@ class DuplicatesFilter(BibFilter):
         # don't require them to be equal, but just that they have good
         # overlap... e.g. "PNAS" and "PNASUSA" allow also one typo per approx. 4
         # chars
-        if ( j_abbrev_a and j_abbrev_b and
-             (levenshtein(j_abbrev_a[:len(j_abbrev_b)], j_abbrev_b[:len(j_abbrev_a)])
-              > (1+int(min(len(j_abbrev_a),len(j_abbrev_b))/4))
-             ) ):
-            return False, "Journal (parsed & simplified) %r and %r differ"%(j_abbrev_a, j_abbrev_b)
+        if j_abbrev_a and j_abbrev_b:
+            max_j_lev_dist = 1+int(min(len(j_abbrev_a),len(j_abbrev_b))/4)
+            if ( self._name_distance(j_abbrev_a[:len(j_abbrev_b)], j_abbrev_b[:len(j_abbrev_a)],
+                                     max_j_lev_dist) > max_j_lev_dist ):
+                return False, "Journal (parsed & simplified) %r and %r differ"%(j_abbrev_a, j_abbrev_b)
 
         if ( compare_neq_fld(a.fields, b.fields, 'volume') ):
             return False, "Volumes %r and %r differ"%(a.fields.get('volume', None),
@@ -937,6 +1137,74 @@ class DuplicatesFilter(BibFilter):
         return True, "Entries do not differ on the relevant fields"
         
 
+    #: Only use worker processes to compare entries if there are at least this
+    #: many pairs of entries to compare
+    parallel_min_pairs = 20000
+
+    def _precompute_non_duplicates(self, bibdata, dupl_entryinfo_cache_accessor,
+                                   comparison_tokens):
+        """
+        Compare all pairs of entries of `bibdata` which might be duplicates (see
+        :py:class:`DuplicateCandidatesIndex`) in a pool of worker processes.
+        The later entry of each pair is compared with the earlier one, as in
+        :py:meth:`filter_bibolamazifile()`.
+
+        Returns a set of pairs `(token_a, token_b)` of comparison tokens of
+        entries which are not duplicates.  The entries are then processed in the
+        main process in their original order, which determines which entry is
+        kept and which ones become aliases; the pairs of entries which are
+        duplicates are compared again there.
+        """
+        processes = self.processes
+        if processes is None:
+            processes = 1
+        elif processes == 0:
+            processes = os.cpu_count() or 1
+        if processes <= 1:
+            return set()
+
+        index = DuplicateCandidatesIndex(dupl_entryinfo_cache_accessor)
+        pairs = []
+        for (key, entry) in bibdata.entries.items():
+            token = comparison_tokens[key]
+            for (nkey, nentry) in index.candidates(key, entry):
+                if not dupl_entryinfo_cache_accessor.query_non_duplicate(
+                        token, comparison_tokens[nkey]):
+                    pairs.append( (key, nkey) )
+            index.add(key, entry)
+
+        if len(pairs) < self.parallel_min_pairs:
+            return set()
+
+        logger.debug("duplicates: comparing %d pairs of entries in %d processes",
+                     len(pairs), processes)
+
+        chunksize = 1 + len(pairs) // (4*processes)
+        chunks = [ pairs[i:i+chunksize] for i in range(0, len(pairs), chunksize) ]
+        chunkinfos = []
+        for chunk in chunks:
+            keys = set([ k for pair in chunk for k in pair ])
+            chunkinfos.append([
+                _pack_compare_info(k, bibdata.entries[k],
+                                   dupl_entryinfo_cache_accessor.get_entry_cache(k))
+                for k in keys
+            ])
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=processes,
+                    initializer=_init_compare_worker
+            ) as executor:
+                results = list(executor.map(_compare_entries_worker, chunkinfos, chunks))
+        except (OSError, concurrent.futures.BrokenExecutor) as e:
+            logger.warning("duplicates: Couldn't compare entries in worker processes, "
+                           "comparing them in the main process instead (%s)", e)
+            return set()
+
+        return set([ (comparison_tokens[akey], comparison_tokens[bkey])
+                     for result in results
+                     for (akey, bkey) in result ])
+
     def update_entry_with_duplicate(self, origkey, origentry, duplkey, duplentry):
         """
         Merges definitions present in the duplicate entry, which are not present in the
@@ -1054,9 +1322,49 @@ class DuplicatesFilter(BibFilter):
             #cache_entries[key] = {}
             dupl_entryinfo_cache_accessor.prepare_entry_cache(key, entry, arxivaccess)
 
+        # The "comparison token" of an entry identifies the information that
+        # comparing it with another entry relies on, so that we can remember
+        # which entries are not duplicates of one another across runs.  The
+        # entry cache was computed from the entries as they are now.  If an
+        # entry is modified (when merging duplicates), its token must also
+        # reflect its new contents.
+        fingerprint_index = bibolamazifile.entryFingerprintIndex()
+        orig_fingerprints = dict(
+            (key, fingerprint_index.fingerprint(key).hex()) for key in bibdata.entries
+        )
+        comparison_tokens = dict(orig_fingerprints)
+        all_comparison_tokens = set(orig_fingerprints.values())
+
+        def set_modified_comparison_token(key, entry):
+            token = orig_fingerprints[key] + '+' + entry_fingerprint(entry).hex()
+            comparison_tokens[key] = token
+            all_comparison_tokens.add(token)
+
+        # pairs of comparison tokens of entries which were compared in worker
+        # processes and found not to be duplicates
+        precomputed_non_duplicates = set()
+
+        def compare_with_candidate(key, entry, nkey, nentry):
+            token, ntoken = comparison_tokens[key], comparison_tokens[nkey]
+            if dupl_entryinfo_cache_accessor.query_non_duplicate(token, ntoken):
+                return False, "Entries were found to differ in a previous run"
+            if (token, ntoken) in precomputed_non_duplicates:
+                same, reason = False, "Entries were found to differ by a worker process"
+            else:
+                same, reason = self.compare_entries(
+                    key, nkey, entry, nentry,
+                    dupl_entryinfo_cache_accessor
+                )
+            if not same:
+                dupl_entryinfo_cache_accessor.store_non_duplicate(token, ntoken)
+            return same, reason
+
 
         newbibdata = BibliographyData()
         unused = BibliographyData()
+        # only compare entries with those entries that could be duplicates
+        newbibdata_index = DuplicateCandidatesIndex(dupl_entryinfo_cache_accessor)
+        unused_index = DuplicateCandidatesIndex(dupl_entryinfo_cache_accessor)
         #unused_respawned = set() # because del unused.entries[key] is not implemented ... :(
 
         # def copy_entry(entry):
@@ -1126,6 +1434,7 @@ class DuplicatesFilter(BibFilter):
                 # do merge the entries, in case they are not exact copies and
                 # one has more information than the other
                 self.update_entry_with_duplicate(origkey, origentry, key, entry)
+                set_modified_comparison_token(origkey, origentry)
 
                 # don't delete the entry here, because it will mess up the for loop iteration!
                 #del bibdata.entries[key]
@@ -1167,6 +1476,11 @@ class DuplicatesFilter(BibFilter):
                                 logger.debug("extra alias: %r -> %r", aliaskey, k)
                                 aliases.add_alias( AliasPair(aliaskey, k, is_extra=True) )
 
+            precomputed_non_duplicates.update(
+                self._precompute_non_duplicates(bibdata, dupl_entryinfo_cache_accessor,
+                                                comparison_tokens)
+            )
+
             for (key, entry) in iter_over_bibdata(bibdata):
                 #
                 # examine this entry, see if it is a duplicate of an entry that
@@ -1179,22 +1493,16 @@ class DuplicatesFilter(BibFilter):
                 #logger.longdebug('inspecting new entry %s ...', key)
                 is_duplicate_of = None
                 duplicate_original_is_unused = False
-                for (nkey, nentry) in newbibdata.entries.items():
-                    same, reason = self.compare_entries(
-                        key, nkey, entry, nentry,
-                        dupl_entryinfo_cache_accessor
-                    )
+                for (nkey, nentry) in newbibdata_index.candidates(key, entry):
+                    same, reason = compare_with_candidate(key, entry, nkey, nentry)
                     if same:
                         logger.debug("Entry %s is duplicate of existing entry %s: %s",
                                      key, nkey, reason)
                         is_duplicate_of = nkey
                         break
                     
-                for (nkey, nentry) in unused.entries.items():
-                    same, reason = self.compare_entries(
-                        key, nkey, entry, nentry,
-                        dupl_entryinfo_cache_accessor
-                    )
+                for (nkey, nentry) in unused_index.candidates(key, entry):
+                    same, reason = compare_with_candidate(key, entry, nkey, nentry)
                     if same:
                         logger.debug("Entry %s is duplicate of entry %s: %s",
                                      key, nkey, reason)
@@ -1210,12 +1518,18 @@ class DuplicatesFilter(BibFilter):
                         self.update_entry_with_duplicate(is_duplicate_of,
                                                          unused.entries[is_duplicate_of],
                                                          key, entry)
+                        unused_index.update(is_duplicate_of)
+                        set_modified_comparison_token(is_duplicate_of,
+                                                      unused.entries[is_duplicate_of])
                         aliases.add_alias( AliasPair(key, is_duplicate_of), only_virtual=True )
                     else:
                         # a duplicate of a key we have used. So update the original ...
                         self.update_entry_with_duplicate(is_duplicate_of,
                                                          newbibdata.entries[is_duplicate_of],
                                                          key, entry)
+                        newbibdata_index.update(is_duplicate_of)
+                        set_modified_comparison_token(is_duplicate_of,
+                                                      newbibdata.entries[is_duplicate_of])
                         # ... and register the alias.
                         aliases.add_alias( AliasPair(key, is_duplicate_of) )
 
@@ -1228,17 +1542,25 @@ class DuplicatesFilter(BibFilter):
                                      is_duplicate_of)
                         ue = unused.entries[is_duplicate_of]
                         del unused.entries[is_duplicate_of]
+                        unused_index.remove(is_duplicate_of)
                         ue.key = key
                         newbibdata.add_entry(key, ue)
+                        newbibdata_index.add(key, ue)
+                        # entry `ue` is now compared using the cache info for `key`
+                        set_modified_comparison_token(key, ue)
                         #unused_respawned.add(is_duplicate_of)
                 else:
                     if used_citations is not None and key not in used_citations:
                         # new entry, but we don't want it. So add it to the unused list.
                         unused.add_entry(key, entry)
+                        unused_index.add(key, entry)
                     else:
                         # new entry and we want it. So add it to the main newbibdata list.
                         newbibdata.add_entry(key, entry)
+                        newbibdata_index.add(key, entry)
+
 
+            dupl_entryinfo_cache_accessor.save_non_duplicates(all_comparison_tokens)
 
             #
             # now, make sure that all originals corresponding to "extra" aliases
@@ -1246,6 +1568,9 @@ class DuplicatesFilter(BibFilter):
             # and not in the unused list.
             #
             logger.debug("all aliases = %r", aliases.aliases)
+            logger.debug("name distances: %d requested, %d computed (%s backend)",
+                         self._name_distance.num_calls, self._name_distance.num_computed,
+                         strdistance.backend())
             for alias in aliases.extra_aliases:
                 if alias.origkey in unused.entries:
                     # the seemingly unused entry is actually used! put it back.
@@ -1368,33 +1693,6 @@ def bibolamazi_filter_class():
 
 
 
-# utility: taken from http://hetland.org/coding/python/levenshtein.py
-#
-# used to detect small differences in names which can result from either typos, or
-# alternative spellings (e.g. 'Konig' vs 'Koenig')
-def levenshtein(a, b):
-    "Calculates the Levenshtein distance between a and b."
-    n, m = len(a), len(b)
-    if n > m:
-        # Make sure n <= m, to use O(min(n,m)) space
-        a,b = b,a
-        n,m = m,n
-        
-    current = range(n+1)
-    for i in range(1,m+1):
-        previous, current = current, [i]+[0]*n
-        for j in range(1,n+1):
-            add, delete = previous[j]+1, current[j-1]+1
-            change = previous[j-1]
-            if a[j-1] != b[i-1]:
-                change = change + 1
-            current[j] = min(add, delete, change)
-            
-    return current[n]
-
-
-
-
 def check_overwrite_dupfile(dupfilepath):
     if (not os.path.exists(dupfilepath)):
         return
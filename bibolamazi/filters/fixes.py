@@ -33,6 +33,7 @@ from pylatexenc import latexencode, latexwalker, latex2text
 from bibolamazi.core.bibfilter import BibFilter, BibFilterError
 from bibolamazi.core.bibfilter.argtypes import CommaStrList, ColonCommaStrDict, multi_type_class
 from bibolamazi.core import butils
+from .util.persons import PersonConversion
 
 
 
@@ -148,6 +149,47 @@ _rx_pages_ranges = re.compile(r'^\s*(?P<a>[0-9A-Za-z./]+)\s*\{?\s*'
                               r']|\\(?:textendash|textemdash)\b)+)'
                               r'\s*\}?\s*(?P<b>[0-9A-Za-z./]+)\s*$')
 
+# building the default latex context is expensive, do it only once for all our
+# LatexWalker instances
+_latex_context = latexwalker.get_default_latex_context_db()
+
+_rx_swedish_a = [
+    (re.compile(r'\\AA\s+'), r'\\AA{}'),
+    (re.compile(r'\\o\s+'), r'\\o{}'),
+]
+
+_rx_phd_type = re.compile(r'\bph\W*d\b', flags=re.IGNORECASE)
+
+_rx_doi_prefix = re.compile(r'^\s*doi[ :]\s*', flags=re.IGNORECASE)
+
+# include stuff like:
+#
+# title = "{\textquotedblleft}Relative State{\textquotedblright} Formulation of Quantum Mechanics"
+#
+_rx_prcap_lead = r'([^\w\{]|\\[A-Za-z]+|\{\\[A-Za-z]+\})*'
+_rx_prcap_after_dot = re.compile(r'(?P<dotlead>[.:]'+_rx_prcap_lead+r')(?P<ucletter>[A-Z])')
+_rx_prcap_at_begin = re.compile(r'^(?P<lead>'+_rx_prcap_lead+r')(?P<ucletter>[A-Z])')
+
+_rx_dbl_quotes = [
+    re.compile(r"``(?P<contents>.*?)''"),
+    # this pattern must be tested first, because otherwise we leave stray braces
+    re.compile(r'\{\\(textquotedblleft|ldq)\}(?P<contents>.*?)\{\\(textquotedblright|rdq)\}'),
+    re.compile(r'\\(textquotedblleft|ldq)(?P<contents>.*?)\\(textquotedblright|rdq)'),
+    # unicode quotes
+    re.compile('\N{LEFT DOUBLE QUOTATION MARK}'+r"(?P<contents>.*?)"+
+               '\N{RIGHT DOUBLE QUOTATION MARK}'),
+]
+_rx_sgl_quotes = [
+    # try to match correct quote in " `My dad's dog' is a nice book ".
+    re.compile(r"`(?P<contents>.*?)'(?=\W|$)"),
+    # this pattern must be tested first, because otherwise we leave stray braces
+    re.compile(r'\{\\(textquoteleft|lq)\}(?P<contents>.*?)\{\\(textquoteright|rq)\}'),
+    re.compile(r'\\(textquoteleft|lq)(?P<contents>.*?)\\(textquoteright|rq)'),
+    # unicode quotes
+    re.compile('\N{LEFT SINGLE QUOTATION MARK}'+r"(?P<contents>.*?)"+
+               '\N{RIGHT SINGLE QUOTATION MARK}'),
+]
+
 
 
 
@@ -430,6 +472,21 @@ class FixesFilter(BibFilter):
         else:
             self.protect_names = None
 
+        self._protect_names_rx = None
+        self._protect_names_any_rx = None
+        if self.protect_names:
+            # for each name, a regex which also stops at opening braces (so we
+            # can skip over braced groups)
+            self._protect_names_rx = [
+                (n, r, re.compile(r'((?P<openbrace>\{)|'+r.pattern+r')', re.IGNORECASE))
+                for (n, r) in self.protect_names
+            ]
+            # fields in which none of the names occur are left alone
+            self._protect_names_any_rx = re.compile(
+                "|".join([ '(?:' + r.pattern + ')' for (n, r) in self.protect_names ]),
+                re.IGNORECASE
+            )
+
         self.remove_file_field = butils.getbool(remove_file_field)
         self.remove_fields = CommaStrList(remove_fields)
         self.remove_doi_prefix = butils.getbool(remove_doi_prefix)
@@ -508,6 +565,10 @@ class FixesFilter(BibFilter):
                 "use instead the corresponding option in the zotero_bbt_fixes filter."
             )
 
+        # persons are converted with the same basic fixes as all fields
+        self._person_conversion = PersonConversion('fixes: person names',
+                                                   self._convert_person_name)
+
         logger.debug(('fixes filter: '
                       'fix_space_after_escape=%r; encode_utf8_to_latex=%r; encode_latex_to_utf8=%r; '
                       'remove_type_from_phd=%r; '
@@ -546,6 +607,32 @@ class FixesFilter(BibFilter):
     def action(self):
         return BibFilter.BIB_FILTER_SINGLE_ENTRY
 
+    def _basic_fixes(self, x):
+        # the fixes which are applied to all fields and person names
+        if self.fix_swedish_a:
+            # OBSOLETE, but still accepted for backwards compatibility
+            for (rx, repl) in _rx_swedish_a:
+                x = rx.sub(repl, x)
+        if self.encode_utf8_to_latex:
+            # use custom encoder
+            x = custom_uni_to_latex(x)
+        if self.fix_space_after_escape: # after converting to LaTeX
+            x = do_fix_space_after_escape(x)
+        if self.encode_latex_to_utf8:
+            x = butils.latex_to_text(x)
+        return x
+
+    def _convert_person_name(self, pstr):
+        newpstr = self._basic_fixes(pstr)
+        if newpstr == pstr:
+            return None
+        return Person(string=newpstr)
+        # does not work this way because of the way Person() splits at spaces:
+        #parts = {}
+        #for typ in ['first', 'middle', 'prelast', 'last', 'lineage']:
+        #    parts[typ] = thefilter(u" ".join(p.get_part(typ)))
+        #return Person(**parts)
+
     def filter_bibentry(self, entry):
         #
         # entry is a pybtex.database.Entry object
@@ -553,39 +640,12 @@ class FixesFilter(BibFilter):
 
         # first apply filters that are applied to all fields of the entry
 
-        def thefilter(x):
-            if self.fix_swedish_a:
-                # OBSOLETE, but still accepted for backwards compatibility
-                x = re.sub(r'\\AA\s+', r'\\AA{}', x)
-                x = re.sub(r'\\o\s+', r'\\o{}', x)
-            if self.encode_utf8_to_latex:
-                # use custom encoder
-                x = custom_uni_to_latex(x)
-            if self.fix_space_after_escape: # after converting to LaTeX
-                x = do_fix_space_after_escape(x)
-            if self.encode_latex_to_utf8:
-                x = butils.latex_to_text(x)
-            return x
-
-        def filter_person(p):
-            oldpstr = str(p)
-            #print(oldpstr)
-            newpstr = thefilter(oldpstr)
-            #print(newpstr)
-            return Person(string=newpstr)
-            # does not work this way because of the way Person() splits at spaces:
-            #parts = {}
-            #for typ in ['first', 'middle', 'prelast', 'last', 'lineage']:
-            #    parts[typ] = thefilter(u" ".join(p.get_part(typ)))
-            #return Person(**parts)
-
-
         for (role,perslist) in entry.persons.items():
             for k in range(len(perslist)):
-                entry.persons[role][k] = filter_person(perslist[k])
+                entry.persons[role][k] = self._person_conversion(perslist[k])
         
         for (k,v) in entry.fields.items():
-            entry.fields[k] = thefilter(v)
+            entry.fields[k] = self._basic_fixes(v)
 
         logger.longdebug("fixes filter: entry %s after first basic fixes: %r", entry.key, entry)
 
@@ -609,7 +669,7 @@ class FixesFilter(BibFilter):
         def filter_entry_remove_type_from_phd(entry):
             if (entry.type != 'phdthesis' or 'type' not in entry.fields):
                 return
-            if re.search(r'\bph\W*d\b', entry.fields['type'], flags=re.IGNORECASE):
+            if _rx_phd_type.search(entry.fields['type']):
             #if ('phd' in re.sub(r'[^a-z]', '', entry.fields['type'].lower())):
                 # entry is phd type, so remove explicit type={}
                 del entry.fields['type']
@@ -661,12 +721,11 @@ class FixesFilter(BibFilter):
                     entry.fields[fld] = do_auto_urlify(entry.fields[fld])
 
         def filter_protect_names(entry):
-            def repl_ltx_str(n, r, x):
+            def repl_ltx_str(n, therx, x):
                 # scan string until next '{', read latex expression and skip it, etc.
-                lw = latexwalker.LatexWalker(x, tolerant_parsing=True)
+                lw = None
                 pos = 0
                 newx = u''
-                therx = re.compile(r'((?P<openbrace>\{)|'+r.pattern+r')', re.IGNORECASE)
                 while True:
                     m = therx.search(x, pos)
                     if m is None:
@@ -676,6 +735,8 @@ class FixesFilter(BibFilter):
                     newx += x[pos:newpos]
                     if m.group('openbrace'):
                         # we encountered an opening brace, so we need to copy in everything verbatim
+                        if lw is None:
+                            lw = latexwalker.LatexWalker(x, latex_context=_latex_context, tolerant_parsing=True)
                         (junknode, np, nl) = lw.get_latex_expression(newpos)
                         # just copy the contents as is and move on
                         newx += x[newpos:np+nl]
@@ -693,63 +754,44 @@ class FixesFilter(BibFilter):
             for key, val in entry.fields.items():
                 if key in ('doi', 'url', 'file'):
                     continue
+                if self._protect_names_any_rx.search(val) is None:
+                    continue
                 newval = val
-                for n,r in self.protect_names:
-                    newval = repl_ltx_str(n, r, newval)
+                for n,r,therx in self._protect_names_rx:
+                    if r.search(newval) is None:
+                        continue
+                    newval = repl_ltx_str(n, therx, newval)
                 if (newval != val):
                     entry.fields[key] = newval
 
         if self.protect_names:
             filter_protect_names(entry)
 
-        # include stuff like:
-        #
-        # title = "{\textquotedblleft}Relative State{\textquotedblright} Formulation of Quantum Mechanics"
-        #
-        _rx_prcap_lead = r'([^\w\{]|\\[A-Za-z]+|\{\\[A-Za-z]+\})*'
         if self.protect_capital_letter_after_dot:
             for fld in self.protect_capital_letter_after_dot:
                 if fld in entry.fields:
-                    entry.fields[fld] = re.sub(r'(?P<dotlead>[.:]'+_rx_prcap_lead+r')(?P<ucletter>[A-Z])',
-                                               lambda m: m.group('dotlead')+u'{'+m.group('ucletter')+u'}',
-                                               entry.fields[fld])
+                    entry.fields[fld] = _rx_prcap_after_dot.sub(
+                        lambda m: m.group('dotlead')+u'{'+m.group('ucletter')+u'}',
+                        entry.fields[fld]
+                    )
         if self.protect_capital_letter_at_begin:
             for fld in self.protect_capital_letter_at_begin:
                 if fld in entry.fields:
-                    entry.fields[fld] = re.sub(r'^(?P<lead>'+_rx_prcap_lead+r')(?P<ucletter>[A-Z])',
-                                               lambda m: m.group('lead')+u'{'+m.group('ucletter')+u'}',
-                                               entry.fields[fld])
+                    entry.fields[fld] = _rx_prcap_at_begin.sub(
+                        lambda m: m.group('lead')+u'{'+m.group('ucletter')+u'}',
+                        entry.fields[fld]
+                    )
 
         if self.fix_mendeley_bug_urls:
             for fld in self.fix_mendeley_bug_urls:
                 if fld in entry.fields:
                     entry.fields[fld] = do_fix_mendeley_bug_urls(entry.fields[fld])
 
-        _rx_dbl_quotes = [
-            re.compile(r"``(?P<contents>.*?)''"),
-            # this pattern must be tested first, because otherwise we leave stray braces
-            re.compile(r'\{\\(textquotedblleft|ldq)\}(?P<contents>.*?)\{\\(textquotedblright|rdq)\}'),
-            re.compile(r'\\(textquotedblleft|ldq)(?P<contents>.*?)\\(textquotedblright|rdq)'),
-            # unicode quotes
-            re.compile('\N{LEFT DOUBLE QUOTATION MARK}'+r"(?P<contents>.*?)"+
-                       '\N{RIGHT DOUBLE QUOTATION MARK}'),
-        ]
-        _rx_sgl_quotes = [
-            # try to match correct quote in " `My dad's dog' is a nice book ".
-            re.compile(r"`(?P<contents>.*?)'(?=\W|$)"),
-            # this pattern must be tested first, because otherwise we leave stray braces
-            re.compile(r'\{\\(textquoteleft|lq)\}(?P<contents>.*?)\{\\(textquoteright|rq)\}'),
-            re.compile(r'\\(textquoteleft|lq)(?P<contents>.*?)\\(textquoteright|rq)'),
-            # unicode quotes
-            re.compile('\N{LEFT SINGLE QUOTATION MARK}'+r"(?P<contents>.*?)"+
-                       '\N{RIGHT SINGLE QUOTATION MARK}'),
-        ]
         if self.convert_dbl_quotes:
             for fld in self.convert_dbl_quotes:
                 if fld in entry.fields:
                     for rx in _rx_dbl_quotes:
-                        entry.fields[fld] = re.sub(
-                            rx,
+                        entry.fields[fld] = rx.sub(
                             lambda m: self.dbl_quote_macro+u"{"+m.group('contents')+u"}",
                             entry.fields[fld]
                         )
@@ -757,8 +799,7 @@ class FixesFilter(BibFilter):
             for fld in self.convert_sgl_quotes:
                 if fld in entry.fields:
                     for rx in _rx_sgl_quotes:
-                        entry.fields[fld] = re.sub(
-                            rx,
+                        entry.fields[fld] = rx.sub(
                             lambda m: self.sgl_quote_macro+u"{"+m.group('contents')+u"}",
                             entry.fields[fld]
                         )
@@ -773,8 +814,7 @@ class FixesFilter(BibFilter):
 
         if self.remove_doi_prefix:
             if 'doi' in entry.fields:
-                entry.fields['doi'] =  \
-                    re.sub(r'^\s*doi[ :]\s*', '', entry.fields['doi'], flags=re.IGNORECASE)
+                entry.fields['doi'] = _rx_doi_prefix.sub('', entry.fields['doi'])
 
         if self.fix_pages_range:
             if 'pages' in entry.fields:
@@ -806,7 +846,8 @@ def remove_full_braces(val):
         # {Szilard"
         try:
             (nodes,pos,length) =  \
-                latexwalker.LatexWalker(val, tolerant_parsing=True).get_latex_braced_group(0)
+                latexwalker.LatexWalker(val, latex_context=_latex_context,
+                                         tolerant_parsing=True).get_latex_braced_group(0)
             if pos + length == len(val):
                 # yes, all fine: the braces are one block for the field
                 return val[1:-1]
@@ -877,13 +918,24 @@ _our_unicode_to_latex = latexencode.PartialLatexToLatexEncoder(
     replacement_latex_protection=_apply_protection,
 )
 
-def custom_uni_to_latex(s):
+def _custom_uni_to_latex(s):
     # recompose combining unicode characters whenever possible so that
     # unicode_to_latex can translate them correctly
     s = unicodedata.normalize('NFC', s)
 
     return _our_unicode_to_latex.unicode_to_latex(s)
 
+# printable ASCII characters which _our_unicode_to_latex leaves as they are
+# (everything except '\\', '#', '%' and '&')
+_memoized_custom_uni_to_latex = butils.MemoizedConversion(
+    'custom_uni_to_latex',
+    _custom_uni_to_latex,
+    passthrough_rx=r"[\t\n\r !\"$'-\[\]-~]*",
+)
+
+def custom_uni_to_latex(s):
+    return _memoized_custom_uni_to_latex(s)
+
 
 
 # helper function
@@ -896,6 +948,9 @@ def _zotero_title_protection_cleanup(title):
 
 
 
+# we are looking for a named macro (not \' or \&, but e.g. \c), followed by some space.
+_rx_named_macro_space = re.compile(r'\\(?P<macroname>[A-Za-z]+)\s+')
+
 # helper function
 def do_fix_space_after_escape(x):
 
@@ -907,7 +962,7 @@ def do_fix_space_after_escape(x):
 
         # make sure we create a new lw instance each time, because the string
         # changes between calls to deal_with_escape()!
-        lw = latexwalker.LatexWalker(x, tolerant_parsing=True)
+        lw = latexwalker.LatexWalker(x, latex_context=_latex_context, tolerant_parsing=True)
 
         # read and parse macro invocation, including all known macro arguments
         (nodelist, pos, len_) = lw.get_latex_nodes(pos=m.start(), read_max_nodes=1)
@@ -945,8 +1000,7 @@ def do_fix_space_after_escape(x):
     #
 
     # iterate all matches & replace them appropriately
-    # we are looking for a named macro (not \' or \&, but e.g. \c), followed by some space.
-    rxesc = re.compile(r'\\(?P<macroname>[A-Za-z]+)\s+')
+    rxesc = _rx_named_macro_space
     m = rxesc.search(x)
     newx = x
     while m:
@@ -34,6 +34,8 @@ from pylatexenc.latex2text import LatexNodes2Text
 from bibolamazi.core.butils import getbool
 from bibolamazi.core.bibfilter import BibFilter #, BibFilterError
 
+from .util.persons import PersonConversion
+
 
 HELP_AUTHOR = r"""
 Philippe Faist, (C) 2013, GPL 3+
@@ -63,6 +65,14 @@ roles to consider, one or more among ['author', 'editor']. E.g.:
 
 
 
+# delatex everything to UTF-8, but honor names protected by braces and keep those
+_rx_macro_space = re.compile(r'(\\[a-zA-Z]+)\s+')
+_l2t = LatexNodes2Text(keep_braced_groups=True, strict_latex_spaces=True)
+
+def _protected_detex(x):
+    return _l2t.latex_to_text(_rx_macro_space.sub(r'\1{}', x)).strip()
+
+
 class NameInitialsFilter(BibFilter):
 
     helpauthor = HELP_AUTHOR
@@ -100,12 +110,64 @@ class NameInitialsFilter(BibFilter):
         self._only_one_initial = getbool(only_one_initial)
         self._strip_first_names = getbool(strip_first_names)
 
+        self._person_conversion = PersonConversion('nameinitials: person names',
+                                                   self._convert_person_name)
+
         logger.debug('NameInitialsFilter constructor')
         
 
     def action(self):
         return BibFilter.BIB_FILTER_SINGLE_ENTRY
 
+    def _convert_person_name(self, pstr):
+
+        ### NO: this kills any protection, e.g., with braces, etc.
+        #
+        # # de-latex the person first
+        # pstr = str(p)
+        # # BUG: FIXME: remove space after any macros
+        # # replace "blah\macro blah" by "blah\macro{}blah"
+        # pstr = re.sub(r'(\\[a-zA-Z]+)\s+', r'\1{}', pstr)
+        #if (self._names_to_utf8):
+        #    pstr = latex2text.latex2text(pstr)
+        #
+        #p = Person(pstr)
+
+        if self._names_to_utf8:
+            # join name again to correctly treat accents like
+            # "Fran\c cois" or "\AA berg"
+            p = Person(_protected_detex(pstr))
+
+            # do_detex = lambda lst: [ protected_detex(x) for x in lst ]
+            # p.first_names = do_detex(p.first_names)
+            # p.middle_names = do_detex(p.middle_names)
+            # p.prelast_names = do_detex(p.prelast_names)
+            # p.last_names = do_detex(p.last_names)
+            # p.lineage = do_detex(p.lineage_names)
+        else:
+            p = Person(pstr)
+
+        if self._only_single_letter_firsts:
+            do_abbrev = lambda x: abbreviate(x) if len(x) == 1 else x
+        else:
+            do_abbrev = abbreviate
+
+        first_names = p.first_names
+        middle_names = p.middle_names
+        if self._only_one_initial:
+            first_names = first_names[0:1]
+            middle_names = []
+        if self._strip_first_names:
+            first_names = []
+            middle_names = []
+
+        return Person(string='',
+                      first=" ".join([do_abbrev(x)  for x in first_names]),
+                      middle=" ".join([do_abbrev(x)  for x in middle_names]),
+                      prelast=" ".join(p.prelast_names),
+                      last=" ".join(p.last_names),
+                      lineage=" ".join(p.lineage_names))
+
     def filter_bibentry(self, entry):
         #
         # entry is a pybtex.database.Entry object
@@ -116,64 +178,7 @@ class NameInitialsFilter(BibFilter):
                 continue
 
             for k in range(len(entry.persons[role])):
-
-                p = entry.persons[role][k]
-
-                ### NO: this kills any protection, e.g., with braces, etc.
-                #
-                # # de-latex the person first
-                # pstr = str(p)
-                # # BUG: FIXME: remove space after any macros
-                # # replace "blah\macro blah" by "blah\macro{}blah"
-                # pstr = re.sub(r'(\\[a-zA-Z]+)\s+', r'\1{}', pstr)
-                #if (self._names_to_utf8):
-                #    pstr = latex2text.latex2text(pstr)
-                #
-                #p = Person(pstr)
-
-                if self._names_to_utf8:
-                    # delatex everything to UTF-8, but honor names protected by
-                    # braces and keep those
-                    rxmacrospace = re.compile(r'(\\[a-zA-Z]+)\s+')
-                    l2t = LatexNodes2Text(keep_braced_groups=True, strict_latex_spaces=True)
-                    protected_detex_fn = \
-                        lambda x: l2t.latex_to_text(rxmacrospace.sub(r'\1{}', x)).strip()
-
-                    # join name again to correctly treat accents like
-                    # "Fran\c cois" or "\AA berg"
-                    p = Person(protected_detex_fn(str(p)))
-
-                    # do_detex = lambda lst: [ protected_detex(x) for x in lst ]
-                    # p.first_names = do_detex(p.first_names)
-                    # p.middle_names = do_detex(p.middle_names)
-                    # p.prelast_names = do_detex(p.prelast_names)
-                    # p.last_names = do_detex(p.last_names)
-                    # p.lineage = do_detex(p.lineage_names)
-
-
-                if self._only_single_letter_firsts:
-                    do_abbrev = lambda x: abbreviate(x) if len(x) == 1 else x
-                else:
-                    do_abbrev = abbreviate
-
-                first_names = p.first_names
-                middle_names = p.middle_names
-                if self._only_one_initial:
-                    first_names = first_names[0:1]
-                    middle_names = []
-                if self._strip_first_names:
-                    first_names = []
-                    middle_names = []
-
-                pnew = Person(string='',
-                              first=" ".join([do_abbrev(x)  for x in first_names]),
-                              middle=" ".join([do_abbrev(x)  for x in middle_names]),
-                              prelast=" ".join(p.prelast_names),
-                              last=" ".join(p.last_names),
-                              lineage=" ".join(p.lineage_names))
-
-                entry.persons[role][k] = pnew
-                #logger.debug("nameinitials: %r became %r" % (p, pnew))
+                entry.persons[role][k] = self._person_conversion(entry.persons[role][k])
 
         return
 
@@ -110,6 +110,11 @@ class OnlyUsedFilter(BibFilter):
     def action(self):
         return BibFilter.BIB_FILTER_BIBOLAMAZIFILE
 
+    def requested_cache_accessors(self):
+        return [
+            auxfile.AuxCitationIndexCacheAccessor,
+            ]
+
 
     def filter_bibolamazifile(self, bibolamazifile):
 
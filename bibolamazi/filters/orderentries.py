@@ -35,6 +35,7 @@ logger = logging.getLogger(__name__)
 from bibolamazi.core import butils
 from bibolamazi.core.bibfilter import BibFilter, BibFilterError
 from bibolamazi.core.bibfilter.argtypes import enum_class
+from bibolamazi.core.entrydict import EntryDict
 
 from .util import arxivutil
 
@@ -254,6 +255,10 @@ _month_regexps = (
 
 
 def sort_entries(bibdata_entries, key=lambda x: x, reverse=False):
+     if isinstance(bibdata_entries, EntryDict):
+          # can be reordered in place
+          bibdata_entries.sort(key=key, reverse=reverse)
+          return
      new_dic = sorted(bibdata_entries.items(), key=lambda x: key(x[0]), reverse=reverse)
      bibdata_entries.clear()
      bibdata_entries.update(new_dic)
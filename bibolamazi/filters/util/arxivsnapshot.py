@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+A local snapshot of arXiv metadata, which can be used instead of querying the
+arXiv API (e.g., on machines which can't access arxiv.org).
+
+A bulk metadata dump in the JSON-lines format of arXiv's metadata snapshot (as
+distributed, e.g., as the "arXiv Dataset" on Kaggle: one JSON object per line,
+with fields `id`, `title`, `authors_parsed`, `abstract`, `versions`, etc.) is
+imported into a SQLite database indexed by arXiv ID, with::
+
+    > bibolamazi cache arxiv-snapshot arxiv-metadata-oai-snapshot.json
+
+:py:class:`~arxivutil.ArxivFetchedAPIInfoCacheAccessor` then looks up arXiv IDs
+in this database before querying arxiv.org.  The database is located in
+bibolamazi's user cache directory (see :py:func:`default_snapshot_file()`).
+"""
+
+import os
+import os.path
+import re
+import io
+import gzip
+import json
+import sqlite3
+import datetime
+import contextlib
+import email.utils
+from xml.etree import ElementTree
+import logging
+logger = logging.getLogger(__name__)
+
+import arxiv2bib
+
+from bibolamazi.core.butils import BibolamaziError
+from bibolamazi.core.bibolamazifile import BibolamaziFile
+
+
+class ArxivSnapshotError(BibolamaziError):
+    pass
+
+
+def default_snapshot_file():
+    """
+    Return the file name of the arXiv snapshot database which is used by
+    default.  This is the file given in the environment variable
+    `BIBOLAMAZI_ARXIV_SNAPSHOT`, or else the file ``arxiv_snapshot.sqlite`` in
+    the same directory as the shared cache (see
+    :py:meth:`~core.bibolamazifile.BibolamaziFile.sharedCacheFileName()`).
+    """
+    fname = os.environ.get('BIBOLAMAZI_ARXIV_SNAPSHOT', None)
+    if fname:
+        return fname
+    return os.path.join(os.path.dirname(BibolamaziFile.sharedCacheFileName()),
+                        'arxiv_snapshot.sqlite')
+
+
+_rx_version = re.compile(r'^(?P<bare_id>.*?)(?P<version>v\d+)?$')
+
+# sqlite limits the number of parameters in a single query
+_lookup_chunk_size = 500
+
+
+class ArxivSnapshot:
+    """
+    A SQLite database of arXiv metadata, stored in the file `fname`.
+
+    A new connection to the database is opened for each operation, so that a
+    single `ArxivSnapshot` object can be used from several threads.
+    """
+
+    #: Version of the database schema
+    format_version = 1
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    @contextlib.contextmanager
+    def _connect(self, create=False):
+        if not create and not os.path.exists(self.fname):
+            raise ArxivSnapshotError("No arXiv snapshot database: {}".format(self.fname))
+        try:
+            conn = sqlite3.connect(self.fname)
+        except sqlite3.Error as e:
+            raise ArxivSnapshotError("Can't open arXiv snapshot database {}: {}"
+                                     .format(self.fname, e))
+        try:
+            if create:
+                conn.execute("CREATE TABLE IF NOT EXISTS snapshot_info "
+                             "(key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute("CREATE TABLE IF NOT EXISTS papers "
+                             "(arxivid TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID")
+                conn.execute("INSERT OR REPLACE INTO snapshot_info VALUES ('format_version', ?)",
+                             (str(self.format_version),))
+            else:
+                row = conn.execute("SELECT value FROM snapshot_info "
+                                   "WHERE key='format_version'").fetchone()
+                if row is None or row[0] != str(self.format_version):
+                    raise ArxivSnapshotError("Unsupported arXiv snapshot database format in {}"
+                                             .format(self.fname))
+            yield conn
+        except sqlite3.Error as e:
+            raise ArxivSnapshotError("Error accessing arXiv snapshot database {}: {}"
+                                     .format(self.fname, e))
+        finally:
+            conn.close()
+
+    def import_jsonl(self, f):
+        """
+        Import the arXiv metadata in the JSON-lines dump `f` into the database.
+        `f` is either an open text file, or a file name (the file may be
+        compressed with gzip, if its name ends with ``.gz``).  Existing records
+        for the same arXiv IDs are replaced.
+
+        Returns the number of imported records.
+        """
+        if isinstance(f, str):
+            opener = gzip.open if f.endswith('.gz') else io.open
+            with opener(f, 'rt', encoding='utf-8') as fobj:
+                return self.import_jsonl(fobj)
+
+        dirname = os.path.dirname(self.fname)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        num_records = 0
+        with self._connect(create=True) as conn:
+            with conn:
+                rows = []
+                for lineno, line in enumerate(f):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                        rows.append( (record['id'], json.dumps(_reduce_record(record))) )
+                    except (ValueError, KeyError, TypeError, IndexError) as e:
+                        logger.warning("Ignoring invalid record on line %d: %s", lineno+1, e)
+                        continue
+                    if len(rows) >= 10000:
+                        conn.executemany("INSERT OR REPLACE INTO papers VALUES (?, ?)", rows)
+                        num_records += len(rows)
+                        rows = []
+                        logger.info("Imported %d records ...", num_records)
+                conn.executemany("INSERT OR REPLACE INTO papers VALUES (?, ?)", rows)
+                num_records += len(rows)
+                conn.execute("INSERT OR REPLACE INTO snapshot_info VALUES ('imported', ?)",
+                             (datetime.datetime.now().isoformat(),))
+
+        return num_records
+
+    def num_papers(self):
+        """
+        Return the number of arXiv records in the database.
+        """
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+    def lookup(self, arxivids):
+        """
+        Look up the given arXiv IDs in the database.  The IDs may include a
+        version number (e.g. ``1305.0042v2``), and may be old-style IDs
+        (e.g. ``quant-ph/0101001``).
+
+        Returns a dictionary `{arxivid: entry}` where `entry` is an
+        `ElementTree.Element` which mimics the ``<entry>`` element the arXiv API
+        would return for this ID (so that it can be given to
+        `arxiv2bib.Reference`).  IDs which are not in the database are not
+        included in the returned dictionary.
+        """
+        wanted = {}
+        for aid in arxivids:
+            m = _rx_version.match(aid)
+            wanted.setdefault(m.group('bare_id'), []).append( (aid, m.group('version')) )
+
+        entries = {}
+        with self._connect() as conn:
+            bare_ids = list(wanted.keys())
+            for i in range(0, len(bare_ids), _lookup_chunk_size):
+                chunk = bare_ids[i:i+_lookup_chunk_size]
+                cursor = conn.execute(
+                    "SELECT arxivid, data FROM papers WHERE arxivid IN ({})"
+                    .format(",".join("?"*len(chunk))),
+                    chunk
+                )
+                for (bare_id, data) in cursor:
+                    data = json.loads(data)
+                    for (aid, version) in wanted[bare_id]:
+                        entry = _mk_atom_entry(bare_id, data, version)
+                        if entry is not None:
+                            entries[aid] = entry
+
+        return entries
+
+
+
+def _fmt_date(value):
+    # convert "Mon, 2 Apr 2007 19:18:42 GMT" to the API's "2007-04-02T19:18:42Z"
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc)
+    return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _reduce_record(record):
+    # keep only what we need from a record of the metadata dump
+    authors = [
+        " ".join([ n for n in (a[1], a[0]) + tuple(a[2:3]) if n ])
+        for a in (record.get('authors_parsed') or [])
+    ]
+    versions = [
+        (v['version'], _fmt_date(v.get('created')))
+        for v in (record.get('versions') or [])
+    ]
+    if not versions and record.get('update_date'):
+        versions = [ ('v1', record['update_date'] + 'T00:00:00Z') ]
+    return {
+        'title': " ".join((record.get('title') or '').split()),
+        'abstract': (record.get('abstract') or '').strip(),
+        'authors': authors,
+        'categories': (record.get('categories') or '').split(),
+        'journal_ref': record.get('journal-ref') or '',
+        'doi': record.get('doi') or '',
+        'comments': record.get('comments') or '',
+        'versions': versions,
+    }
+
+def _mk_atom_entry(bare_id, data, version):
+    versions = dict(data['versions'])
+    if not versions:
+        return None
+    if version is None:
+        version = data['versions'][-1][0]
+    elif version not in versions:
+        return None
+    published = data['versions'][0][1]
+    updated = versions[version]
+
+    ATOM = arxiv2bib.ATOM
+    ARXIV = arxiv2bib.ARXIV
+
+    entry = ElementTree.Element(ATOM + 'entry')
+    def add(tag, text):
+        e = ElementTree.SubElement(entry, tag)
+        e.text = text
+        return e
+    add(ATOM + 'id', 'http://arxiv.org/abs/' + bare_id + version)
+    add(ATOM + 'updated', updated or '')
+    add(ATOM + 'published', published or '')
+    add(ATOM + 'title', data['title'])
+    add(ATOM + 'summary', data['abstract'])
+    for name in data['authors']:
+        author = ElementTree.SubElement(entry, ATOM + 'author')
+        name_elem = ElementTree.SubElement(author, ATOM + 'name')
+        name_elem.text = name
+    if data['doi']:
+        add(ARXIV + 'doi', data['doi'])
+    if data['comments']:
+        add(ARXIV + 'comment', data['comments'])
+    if data['journal_ref']:
+        add(ARXIV + 'journal_ref', data['journal_ref'])
+    if data['categories']:
+        ElementTree.SubElement(entry, ARXIV + 'primary_category',
+                               {'term': data['categories'][0]})
+        for cat in data['categories']:
+            ElementTree.SubElement(entry, ATOM + 'category', {'term': cat})
+    return entry
@@ -21,18 +21,27 @@
 ################################################################################
 
 
+import os.path
 import re
-from urllib.error import URLError, HTTPError
 import textwrap
-import time
+from urllib.parse import urlsplit
+import datetime
+import threading
+import queue
+from xml.etree import ElementTree
 import logging
 logger = logging.getLogger(__name__)
 
 import arxiv2bib
 
 from bibolamazi.core.bibusercache import BibUserCacheAccessor, BibUserCacheError
-from bibolamazi.core.bibusercache.tokencheckers import EntryFieldsTokenChecker 
+from bibolamazi.core.bibusercache import cacheformat
+from bibolamazi.core.bibusercache.tokencheckers import EntryFieldsTokenChecker, TokenCheckerDate
 from bibolamazi.core import butils
+from bibolamazi.core import transport
+from bibolamazi.core import ratelimit
+
+from . import arxivsnapshot
 
 
 class BibArxivApiFetchError(BibUserCacheError):
@@ -40,6 +49,78 @@ class BibArxivApiFetchError(BibUserCacheError):
         super().__init__('arxiv_fetched_api_info', msg)
 
 
+class ArxivApiHTTPError(Exception):
+    def __init__(self, status_code, reason):
+        super().__init__("HTTP {}: {}".format(status_code, reason))
+        self.status_code = status_code
+        self.reason = reason
+
+
+arxiv_api_url = 'https://export.arxiv.org/api/query'
+
+def arxiv_api_request(ids):
+    """
+    Query the arXiv API for the given list of IDs, and return the parsed XML
+    response (an `ElementTree.Element`).
+
+    Raises :py:exc:`ArxivApiHTTPError` if the server returns an error, or
+    :py:exc:`~core.transport.TransportError` if the server couldn't be reached.
+    """
+    r = transport.get(arxiv_api_url, params=[
+        ("id_list", ",".join(ids)),
+        ("max_results", len(ids)),
+    ])
+    if r.status_code != 200:
+        raise ArxivApiHTTPError(r.status_code, r.reason)
+    return ElementTree.fromstring(r.content)
+
+
+#
+# --- store arxiv2bib's objects in the cache ---
+#
+
+class _CachedArxivReference(arxiv2bib.Reference):
+    """
+    An `arxiv2bib.Reference` object loaded from the cache.  The attributes computed
+    by `arxiv2bib` are restored directly, and the XML of the reference is only
+    parsed if it is needed.
+    """
+    def __init__(self, attrs, xmlstr):
+        # don't call the superclass constructor, which would parse the XML
+        self.__dict__.update(attrs)
+        self._xmlstr = xmlstr
+        self._xml = None
+
+    @property
+    def xml(self):
+        if self._xml is None:
+            self._xml = ElementTree.fromstring(self._xmlstr)
+        return self._xml
+
+def _encode_arxiv_reference(ref):
+    if isinstance(ref, _CachedArxivReference) and ref._xml is None:
+        xmlstr = ref._xmlstr
+    else:
+        xmlstr = ElementTree.tostring(ref.xml, encoding='unicode')
+    attrs = dict([ (k, v) for (k, v) in ref.__dict__.items()
+                   if k not in ('xml', '_xml', '_xmlstr') ])
+    return {'attrs': attrs, 'xml': xmlstr}
+
+def _decode_arxiv_reference(data):
+    return _CachedArxivReference(data['attrs'], data['xml'])
+
+# references are stored by the XML of their entry in the arXiv API's answer,
+# along with the attributes computed from it
+for _cls in (arxiv2bib.Reference, _CachedArxivReference):
+    cacheformat.register_object_codec(_cls, 'arxiv2bib.Reference',
+                                      _encode_arxiv_reference, _decode_arxiv_reference)
+cacheformat.register_object_codec(
+    arxiv2bib.ReferenceErrorInfo, 'arxiv2bib.ReferenceErrorInfo',
+    lambda err: (err.message, err.id),
+    lambda data: arxiv2bib.ReferenceErrorInfo(*data)
+)
+
+
 #
 # --- code to detect arXiv info ---
 #
@@ -94,6 +175,11 @@ _rxarxiv = _rxarxiv_in_url + \
         + r'(?:\s*\[(?P<primaryclass2>' + _RX_PRIMARY_CLASS_PAT + r')\])?'
     )
 
+# All the regexes above require a numerical arXiv ID.  Most entries of a
+# bibliography don't contain anything which looks like an arXiv ID, so we check
+# for one with this single regex first.
+_rx_arxiv_prefilter = re.compile(_RX_ARXIVID_NUM_PAT)
+
 # getting "pure" arxiv ID means the arxiv ID (with primary class for old IDs
 # only), without version information.
 _rx_purearxivid = re.compile(r'(?P<purearxivid>((\d{4}\.\d{4,})|'+
@@ -238,6 +324,10 @@ def detectEntryArXivInfo(entry):
 
     def processNoteField(notefield, d, isurl=False):
 
+        if _rx_arxiv_prefilter.search(notefield) is None:
+            # none of the regexes can match
+            return
+
         if isurl:
             rxlist = _rxarxiv_in_url
         else:
@@ -331,6 +421,9 @@ def stripArXivInfoInNote(notestr):
     'arxiv:XXXX.YYYY' (or similar).
     """
 
+    if _rx_arxiv_prefilter.search(notestr) is None:
+        return notestr
+
     newnotestr = notestr
     for rx in _rxarxiv:
         # replace all occurences of rx's in _rxarxiv with nothing.
@@ -354,6 +447,26 @@ class ArxivFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
     A `BibUserCacheAccessor` for fetching and accessing information retrieved
     from the arXiv API.
     """
+
+    # the fetched information is the same for all bibolamazi files
+    shared_cache = True
+
+    #: For how long we remember that we couldn't fetch information about an
+    #: arXiv ID (e.g. because the ID doesn't exist), and don't query it again
+    failed_retry_time = datetime.timedelta(days=1)
+
+    #: Minimal time (in seconds) between two requests to the arXiv API: 1
+    #: req/second, see https://groups.google.com/d/msg/arxiv-api/wcPh0w38XN0/p7vKsxjb6ykJ
+    #: This is enforced across all bibolamazi processes (see
+    #: :py:mod:`~bibolamazi.core.ratelimit`).
+    api_request_interval = 1
+
+    #: The local arXiv metadata snapshot in which arXiv IDs are looked up before
+    #: querying arxiv.org (see :py:mod:`~bibolamazi.filters.util.arxivsnapshot`).
+    #: If `None`, :py:func:`arxivsnapshot.default_snapshot_file()` is used.  The
+    #: snapshot is only used if this file exists.
+    arxiv_snapshot_file = None
+
     def __init__(self, **kwargs):
         super().__init__(
             cache_name='arxiv_fetched_api_info',
@@ -381,8 +494,16 @@ class ArxivFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
         # validate each entry with an expiration checker. Do this per entry, rather than
         # globally on the full cache. (So don't use installCacheExpirationChecker())
         dic['fetched'].set_validation(cache_obj.cacheExpirationTokenChecker())
+
+        # arXiv IDs for which the arXiv API didn't return any valid information;
+        # we only retry them after a shorter time
+        dic.setdefault('failed', {})
+        dic['failed'].set_validation(TokenCheckerDate(time_valid=self.failed_retry_time))
         
 
+    def prefetch(self, items):
+        self.fetchArxivApiInfo(items)
+
 
     def fetchArxivApiInfo(self, idlist):
         """
@@ -400,7 +521,9 @@ class ArxivFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
         error text.
 
         Only those entries in `idlist` which are not already in the cache are
-        fetched.
+        fetched.  If a local arXiv metadata snapshot is available (see
+        :py:meth:`arxivSnapshot()`), the entries are first looked up there and
+        only those which are not found are fetched from arxiv.org.
 
         `idlist` can be any iterable.
         """
@@ -420,77 +543,218 @@ class ArxivFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
         logger.longdebug("fetchArxivApiInfo(): in the cache, we have keys %r",
                          cache_entrydic.keys())
 
+        failed_dic = self.cacheDic()['failed']
+
         still_to_fetch = []
         for aid in idlist:
             if aid in self.error_arxivids:
                 logger.debug("Not re-trying to fetch info for %s, query failed moments ago", aid)
                 # we already tried to fetch this ID moments ago but failed---don't insist
                 continue
+            if aid in failed_dic:
+                logger.debug("Not re-trying to fetch info for %s, query failed recently (%s)",
+                             aid, failed_dic.get(aid))
+                continue
             if (aid not in cache_entrydic  or  cache_entrydic.get(aid) is None  or
                 cache_entrydic.get(aid).get('error', False)):
                 still_to_fetch.append(aid)
 
         logger.longdebug("fetchArxivApiInfo(): still_to_fetch=%r", still_to_fetch)
-        
+
+        if still_to_fetch:
+            still_to_fetch = self._fetch_from_arxiv_snapshot(still_to_fetch)
 
         # make sure we're not requesting more than batch_len arxiv ids at a time
         # (or URLs can get too long and we'll get a HTTP 414 "URL too long"
         # response)
         batch_len = 64
-        sleep_interval = 1 # 1 req/second: see https://groups.google.com/d/msg/arxiv-api/wcPh0w38XN0/p7vKsxjb6ykJ
-
-        num_batches, rest = divmod(len(still_to_fetch), batch_len)
-        if rest:
-            num_batches += 1
-        k = 0
+        batches = [ still_to_fetch[i:i+batch_len]
+                    for i in range(0, len(still_to_fetch), batch_len) ]
+        num_batches = len(batches)
 
         logger.longdebug("fetchArxivApiInfo(): We need to fetch keys: %r", still_to_fetch)
 
-        while still_to_fetch:
-            thisbatch = still_to_fetch[:batch_len]
-            logger.info("Fetching information from arXiv.org (%d/%d)", k+1, num_batches)
-            
-            # At the second time, wait a little while.  Don't make rapid fire
-            # requests to the arxiv because they don't like that:
-            # https://arxiv.org/help/robots
-            if k > 0:
-                time.sleep(sleep_interval)
-            
-            ok = self._do_fetch_arxiv_api_info(thisbatch)
-            if not ok:
-                # logs
-                logger.info("Fetching information from arXiv.org failed :(")
-                return False
-
-            k += 1
-            still_to_fetch = still_to_fetch[len(thisbatch):]
-
-        if k > 0:
-            # message only if we actually fetched anything
-            logger.info("Fetching information from arXiv.org done.")
-            
-        return True
-
-    def _do_fetch_arxiv_api_info(self, idlist):
+        if not batches:
+            return True
 
         if ArxivFetchedAPIInfoCacheAccessor.arxiv_403_received:
             logger.warning("Not fetching any more arXiv data because we've been "
                            "previously sent a \"HTTP 403 Forbidden\" response. "
                            "See https://arxiv.org/help/robots")
+            logger.info("Fetching information from arXiv.org failed :(")
+            return False
+
+        try:
+            transport.check_online(arxiv_api_url)
+            transport.check_deadline(arxiv_api_url)
+        except transport.OfflineError:
+            logger.warning("Offline mode: not fetching information for %d arXiv ID(s) from arXiv.org",
+                           len(still_to_fetch))
+            return False
+        except transport.DeadlineExceededError:
+            logger.warning("Network deadline exceeded, not fetching information for arXiv ID(s) %s",
+                           ", ".join(still_to_fetch))
+            return False
+
+        # Don't make rapid fire requests to the arxiv because they don't like
+        # that: https://arxiv.org/help/robots
+        ratelimit.set_rate_limit(
+            urlsplit(arxiv_api_url).netloc,
+            1.0/self.api_request_interval if self.api_request_interval else None
+        )
+
+        # The requests are issued by a separate thread, while this thread parses
+        # and stores the results of the previous batch.  We get (batch,
+        # response, num_requests, exception) tuples, and finally None.
+        results = queue.Queue()
+        stop_fetching = threading.Event()
+        fetch_thread = threading.Thread(
+            target=self._arxiv_api_request_thread,
+            args=(batches, results, stop_fetching),
+            daemon=True
+        )
+
+        logger.info("Fetching information from arXiv.org (%d/%d)", 1, num_batches)
+        fetch_thread.start()
+
+        try:
+            k = 0
+            while True:
+                result = results.get()
+                if result is None:
+                    break
+                (batch, response, num_requests, exc) = result
+
+                self.recordNetworkFetch(num_requests)
+                if isinstance(exc, transport.DeadlineExceededError):
+                    logger.warning("Network deadline exceeded, information for arXiv ID(s) %s "
+                                   "was not fetched",
+                                   ", ".join([ aid for b in batches[k:] for aid in b ]))
+                    return False
+                if exc is not None:
+                    self._handle_arxiv_api_error(exc)
+                    # logs
+                    logger.info("Fetching information from arXiv.org failed :(")
+                    return False
+
+                k += 1
+                if k < num_batches:
+                    logger.info("Fetching information from arXiv.org (%d/%d)", k+1, num_batches)
+
+                self._store_arxiv_api_info(batch, response)
+        finally:
+            stop_fetching.set()
+
+        # message only if we actually fetched anything
+        logger.info("Fetching information from arXiv.org done.")
+            
+        return True
+
+    def arxivSnapshot(self):
+        """
+        Return the :py:class:`~arxivsnapshot.ArxivSnapshot` in which arXiv IDs
+        are looked up before querying arxiv.org, or `None` if there is no local
+        snapshot.  See :py:attr:`arxiv_snapshot_file`.
+        """
+        fname = self.arxiv_snapshot_file
+        if fname is None:
+            fname = arxivsnapshot.default_snapshot_file()
+        if not os.path.exists(fname):
             return None
+        return arxivsnapshot.ArxivSnapshot(fname)
 
-        cache_entrydic = self.cacheDic()['fetched']
+    def _fetch_from_arxiv_snapshot(self, idlist):
+        #
+        # Look up the given IDs in the local arXiv snapshot, if there is one, and
+        # store the information we find.  Returns the list of IDs which still
+        # need to be fetched from arxiv.org.
+        #
+        snapshot = self.arxivSnapshot()
+        if snapshot is None:
+            return idlist
+        try:
+            found = snapshot.lookup(idlist)
+        except arxivsnapshot.ArxivSnapshotError as e:
+            logger.warning("Can't use local arXiv snapshot: %s", e)
+            return idlist
 
-        logger.debug('fetching missing id list %r', idlist)
+        logger.debug("Found %d of %d arXiv IDs in local arXiv snapshot %s",
+                     len(found), len(idlist), snapshot.fname)
+        if found:
+            self._store_arxiv_api_info(list(found.keys()), ({}, list(found.values())))
+
+        return [ aid for aid in idlist if aid not in found ]
+
+    def _arxiv_api_request_thread(self, batches, results, stop_fetching):
+        #
+        # Runs in a separate thread: issue the requests for each batch of IDs
+        # and put the raw results in the `results` queue.
+        #
         try:
+            for batch in batches:
+                if stop_fetching.is_set():
+                    break
+                num_requests = [0]
+                try:
+                    response = self._do_arxiv_api_request(batch, num_requests)
+                except Exception as e:
+                    results.put( (batch, None, num_requests[0], e) )
+                    break
+                results.put( (batch, response, num_requests[0], None) )
+        finally:
+            results.put(None)
+
+    def _do_arxiv_api_request(self, idlist, num_requests):
+        #
+        # Query the arXiv API for the given IDs.  Returns a tuple (invalid_ids,
+        # entries) where `invalid_ids` is a dictionary {id: error message} of
+        # IDs which we didn't query, and `entries` is the list of XML <entry>
+        # elements returned by the API.  (This is the network part of
+        # arxiv2bib.arxiv2bib_dict().)
+        #
+        logger.debug('fetching missing id list %r', idlist)
+
+        invalid_ids = {}
+        ids = []
+        for aid in idlist:
+            if arxiv2bib.is_valid(aid):
+                ids.append(aid)
+            else:
+                invalid_ids[aid] = "Invalid arXiv identifier"
 
-            arxivdict = arxiv2bib.arxiv2bib_dict(idlist)
-            # USE FOR DEBUGGING:
-            #arxivdict = {}
-            #logger.critical("DEACTIVATED ARXIV QUERY FOR DEBUGGING")
+        entries = []
+        while ids:
+            num_requests[0] += 1
+            xml = arxiv_api_request(ids)
+
+            # check for error
+            entries = xml.findall(arxiv2bib.ATOM + "entry")
+            try:
+                first_title = entries[0].find(arxiv2bib.ATOM + "title")
+            except Exception:
+                raise arxiv2bib.FatalError("Unable to connect to arXiv.org API.")
+
+            if first_title is None or first_title.text.strip() != "Error":
+                break
+
+            # the API complained about one of the IDs -- query again without it
+            try:
+                aid = entries[0].find(arxiv2bib.ATOM + "summary").text.split()[-1]
+                del ids[ids.index(aid)]
+            except Exception:
+                raise arxiv2bib.FatalError("Unable to parse an error returned by arXiv.org.")
+            invalid_ids[aid] = "Error returned by the arXiv API"
+            entries = []
 
-        except HTTPError as error:
-            if error.getcode() == 403:
+        return (invalid_ids, entries)
+
+    def _handle_arxiv_api_error(self, error):
+        #
+        # Report an error that occurred while querying the arXiv API.  Raises
+        # an exception for fatal errors.
+        #
+        if isinstance(error, ArxivApiHTTPError):
+            if error.status_code == 403:
                 ArxivFetchedAPIInfoCacheAccessor.arxiv_403_received = True
                 raise BibArxivApiFetchError(
                     textwrap.dedent("""\
@@ -502,15 +766,42 @@ class ArxivFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
 
                     For more information, see https://arxiv.org/help/robots.
                     """))
-            logger.warning("HTTP connection error %d: %s.", error.code, error.reason)
+            logger.warning("HTTP connection error %d: %s.", error.status_code, error.reason)
             logger.warning("ArXiv API information will not be retrieved, and your bibliography "
                            "might be incomplete.")
-            return False
-        except URLError as error:
-            logger.warning("Error fetching info from arXiv.org: %s.", error.reason)
+            return
+        if isinstance(error, transport.TransportError):
+            logger.warning("Error fetching info from arXiv.org: %s.", error)
             logger.warning("ArXiv API information will not be retrieved, and your bibliography "
                            "might be incomplete.")
-            return False
+            return
+        raise error
+
+    def _store_arxiv_api_info(self, idlist, response):
+        #
+        # Parse the API's response for the given IDs and store the results in
+        # the cache.  (This is the parsing part of arxiv2bib.arxiv2bib_dict().)
+        #
+        cache_entrydic = self.cacheDic()['fetched']
+        failed_dic = self.cacheDic()['failed']
+
+        (invalid_ids, entries) = response
+
+        arxivdict = {}
+        for (aid, message) in invalid_ids.items():
+            arxivdict[aid] = arxiv2bib.ReferenceErrorInfo(message, aid)
+
+        for entry in entries:
+            try:
+                ref = arxiv2bib.Reference(entry)
+            except arxiv2bib.NotFoundError as error:
+                message, aid = error.args
+                ref = arxiv2bib.ReferenceErrorInfo(message, aid)
+            if ref.id:
+                arxivdict[ref.id] = ref
+            if ref.bare_id:
+                if not (ref.bare_id in arxivdict) or arxivdict[ref.bare_id].updated < ref.updated:
+                    arxivdict[ref.bare_id] = ref
 
         logger.longdebug('got entries %r: %r' %(arxivdict.keys(), arxivdict))
 
@@ -523,16 +814,24 @@ class ArxivFetchedAPIInfoCacheAccessor(BibUserCacheAccessor):
                 self.error_arxivids[k] = errorstr
                 cache_entrydic[k]['error'] = errorstr
                 cache_entrydic[k]['bibtex'] = ''
+                failed_dic[k] = errorstr
             else:
                 cache_entrydic[k]['error'] = None
                 bibtex = ref.bibtex()
                 cache_entrydic[k]['bibtex'] = bibtex
 
+        # The API didn't give us anything at all for these IDs.  This can be
+        # caused by an incomplete response, so we don't remember the failure in
+        # the cache (only the IDs which the API reports as invalid or missing
+        # are stored in failed_dic), but we don't insist in this run.
+        for aid in idlist:
+            if aid not in arxivdict:
+                logger.debug("No information returned by the arXiv API for %s", aid)
+                self.error_arxivids[aid] = "Not found"
+
         logger.longdebug("arxiv api info: Got all references. cacheDic() is now:  %r", self.cacheDic())
         logger.longdebug("... and cacheObject().cachedic is now:  %r", self.cacheObject().cachedic)
 
-        return True
-
 
     def getArxivApiInfo(self, arxivid):
         """
@@ -589,6 +888,21 @@ class ArxivInfoCacheAccessor(BibUserCacheAccessor):
         cache_dic.setdefault('cache_built', False)
 
 
+    def prefetchRequests(self):
+        # the arXiv IDs which complete_cache() will need to query, as far as we
+        # can tell before running the filters
+        entrydic = self.cacheDic()['entries']
+        arxivids = []
+        for k,v in self.bibolamaziFile().bibliographyData().entries.items():
+            if (k in entrydic and entrydic[k] is not None  and
+                entrydic[k].get('updated_with_api_info', False)):
+                continue
+            arinfo = detectEntryArXivInfo(v)
+            if arinfo is not None:
+                arxivids.append(arinfo['arxivid'])
+        return { ArxivFetchedAPIInfoCacheAccessor: arxivids }
+
+
     def rebuild_cache(self, bibdata, arxiv_api_accessor):
         """
         Clear and rebuild the entry cache completely.
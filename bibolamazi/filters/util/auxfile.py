@@ -32,6 +32,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 from bibolamazi.core.bibfilter import BibFilterError #, BibFilter
+from bibolamazi.core import bibusercache
 
 
 rx_bibolamazibib_suffix = re.compile(r'(\.bibolamazi)?\.bib$', flags=re.IGNORECASE)
@@ -69,6 +70,12 @@ def get_all_auxfile_citations(jobname, bibolamazifile, filtername, search_dirs=N
     commands. These commands are generated by calls to the ``\cite{}`` command
     in the LaTeX document.
 
+    Citations in the .aux files which are included by the .aux file with
+    ``\@input{}`` (as generated by ``\include{}``) are collected, too.  If the
+    filter requested the :py:class:`AuxCitationIndexCacheAccessor` cache
+    accessor, then the .aux files are only read once for all filters and are not
+    read again in the next runs unless they change.
+
     Return a python set (unless `return_set=False`) with the list of all bibtex
     keys that the latex document cites.
 
@@ -107,17 +114,24 @@ def get_all_auxfile_citations(jobname, bibolamazifile, filtername, search_dirs=N
     if (search_dirs is None):
         search_dirs = ['.', '_cleanlatexfiles']
 
-    allaux = None
+    # use the last aux file found
+    auxfname = None
     for maybeauxfile in (os.path.join(bibolamazifile.fdir(), searchdir, jobname+'.aux')
                          for searchdir in search_dirs):
-        try:
-            with open(maybeauxfile, 'r') as auxf:
-                logger.debug("%s: Reading auxfile %r", filtername, maybeauxfile)
-                allaux = auxf.read()
-        except IOError:
-            pass
+        if os.path.isfile(maybeauxfile):
+            auxfname = maybeauxfile
 
-    if not allaux:
+    citations = None
+    if auxfname is not None:
+        index = bibolamazifile.cacheAccessor(AuxCitationIndexCacheAccessor)
+        if index is None:
+            # the filter didn't request the cache accessor, read the file(s)
+            # without remembering anything
+            index = AuxCitationIndex()
+        logger.debug("%s: Reading auxfile %r", filtername, auxfname)
+        citations = index.auxFileCitations(auxfname)
+
+    if citations is None:
         raise BibFilterError(
             filtername,
             ("Can't analyze citations [filter {filtername}]: can't find file \"{jobname}.aux\". "
@@ -127,19 +141,155 @@ def get_all_auxfile_citations(jobname, bibolamazifile, filtername, search_dirs=N
              )
         )
 
-    #
-    # parse allaux for \citation{...}
-    #
-    
-    for citation in re.finditer(rx_citation_aux_macro_pat + r'\s*\{(?P<citekey>[^\}]+)\}', allaux):
-        for citekey in (x.strip() for x in citation.group('citekey').split(',')):
-            if return_set:
-                citations_list.add(citekey)
-            if callback is not None:
-                callback(citekey)
+    for citekey in citations:
+        if return_set:
+            citations_list.add(citekey)
+        if callback is not None:
+            callback(citekey)
 
     if return_set:
         return citations_list
 
     return
 
+
+
+rx_aux_citation_or_input = re.compile(
+    rx_citation_aux_macro_pat + r'\s*\{(?P<citekey>[^\}]+)\}'
+    + r'|\\@input\s*\{(?P<input>[^\}]+)\}'
+)
+
+def parse_auxfile(allaux):
+    r"""
+    Parse the contents `allaux` of an .aux file.  Returns a tuple
+    `(citations, inputs)`, where `citations` is the list of all the citation
+    keys which appear in ``\citation{...}`` commands and `inputs` is a list of
+    `(position, auxfilename)` tuples for each ``\@input{auxfilename}`` command
+    (as generated by ``\include{}``), `position` being the number of citations
+    which appear before this command.
+    """
+    citations = []
+    inputs = []
+    for m in rx_aux_citation_or_input.finditer(allaux):
+        if m.group('citekey') is not None:
+            citations += [ x.strip() for x in m.group('citekey').split(',') ]
+        else:
+            inputs.append( (len(citations), m.group('input').strip()) )
+    return (citations, inputs)
+
+
+class AuxCitationIndex:
+    r"""
+    Collects the citations in .aux files, including the .aux files which they
+    ``\@input``.  Each .aux file is only read once.
+
+    See also :py:class:`AuxCitationIndexCacheAccessor`, which in addition
+    remembers the contents of the .aux files between runs.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._parsed = {}
+
+    def auxFileCitations(self, auxfname):
+        r"""
+        Return a list of all the citation keys in the given .aux file, and
+        recursively in the .aux files which it includes with ``\@input{}``.
+        Citation keys are given in the order they appear, and are repeated each
+        time they are cited.
+
+        Returns `None` if the .aux file can't be read or is empty.  Included
+        .aux files which can't be read are ignored.
+        """
+        return self._collect(os.path.realpath(auxfname), set())
+
+    def _collect(self, auxfname, seen):
+        if auxfname in seen:
+            logger.warning("Ignoring recursive \\@input of aux file %s", auxfname)
+            return []
+        parsed = self._parsed.get(auxfname, None)
+        if parsed is None:
+            parsed = self.parseAuxFile(auxfname)
+            self._parsed[auxfname] = parsed
+        if parsed is False:
+            return None
+        (citations, inputs) = parsed
+        if not inputs:
+            return citations
+
+        seen = seen | {auxfname}
+        auxdir = os.path.dirname(auxfname)
+        allcitations = []
+        pos = 0
+        for (ipos, inputfname) in inputs:
+            allcitations += citations[pos:ipos]
+            pos = ipos
+            subcitations = self._collect(os.path.realpath(os.path.join(auxdir, inputfname)), seen)
+            if subcitations is None:
+                logger.debug("Can't read aux file %s included from %s", inputfname, auxfname)
+                continue
+            allcitations += subcitations
+        allcitations += citations[pos:]
+        return allcitations
+
+    def parseAuxFile(self, auxfname):
+        """
+        Read and parse the given .aux file (see :py:func:`parse_auxfile()`).
+        Return `False` if the file can't be read or is empty.
+        """
+        try:
+            with open(auxfname, 'r') as auxf:
+                allaux = auxf.read()
+        except IOError:
+            return False
+        if not allaux:
+            return False
+        return parse_auxfile(allaux)
+
+
+class AuxCitationIndexCacheAccessor(AuxCitationIndex, bibusercache.BibUserCacheAccessor):
+    """
+    An :py:class:`AuxCitationIndex` which remembers the contents of the .aux
+    files in the bibolamazi cache.  An .aux file is read again only if its
+    modification time or size changed.
+
+    Filters which analyze the citations of a LaTeX document with
+    :py:func:`get_all_auxfile_citations()` should request this cache accessor,
+    so that the .aux file(s) are read only once per run and not at all if they
+    didn't change.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(
+            cache_name='aux_citations',
+            **kwargs
+        )
+
+    def initialize(self, cache_obj, **kwargs):
+        dic = self.cacheDic()
+        dic.setdefault('auxfiles', {})
+        # forget about aux files which we haven't seen in a while
+        dic['auxfiles'].set_validation(cache_obj.cacheExpirationTokenChecker())
+
+    def parseAuxFile(self, auxfname):
+        try:
+            st = os.stat(auxfname)
+        except OSError:
+            return False
+        auxfiles = self.cacheDic()['auxfiles']
+        if auxfname in auxfiles:
+            info = auxfiles[auxfname]
+            if info.get('mtime') == st.st_mtime and info.get('size') == st.st_size:
+                logger.longdebug("Aux file %s didn't change", auxfname)
+                return (list(info['citations']),
+                        list(zip(info['input_positions'], info['inputs'])))
+        parsed = super().parseAuxFile(auxfname)
+        if parsed is False:
+            return False
+        (citations, inputs) = parsed
+        auxfiles[auxfname] = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'citations': citations,
+            'input_positions': [ ipos for (ipos, inputfname) in inputs ],
+            'inputs': [ inputfname for (ipos, inputfname) in inputs ],
+        }
+        return parsed
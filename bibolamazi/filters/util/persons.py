@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+Helpers for filters which convert the names of the persons (authors, editors)
+of entries.
+
+Author names repeat a lot in bibliographies, so :py:class:`PersonConversion`
+remembers the result of converting a given name and only parses the resulting
+name once.  Persons which are not changed by a conversion are kept as they are.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from pybtex.database import Person
+
+from bibolamazi.core import butils
+
+
+def person_parts(p):
+    """
+    Return the name parts of the :py:class:`pybtex.database.Person` `p` as a
+    tuple `(first_names, middle_names, prelast_names, last_names,
+    lineage_names)` of tuples of strings.
+    """
+    return (tuple(p.first_names), tuple(p.middle_names), tuple(p.prelast_names),
+            tuple(p.last_names), tuple(p.lineage_names))
+
+
+def person_from_parts(parts):
+    """
+    Create a new :py:class:`pybtex.database.Person` object from the name parts
+    returned by :py:func:`person_parts()`.  No parsing is involved.
+    """
+    p = Person()
+    (first, middle, prelast, last, lineage) = parts
+    p.first_names = list(first)
+    p.middle_names = list(middle)
+    p.prelast_names = list(prelast)
+    p.last_names = list(last)
+    p.lineage_names = list(lineage)
+    return p
+
+
+class PersonConversion:
+    """
+    Convert :py:class:`pybtex.database.Person` objects with the function `fn`,
+    remembering the result for each person name.
+
+    The function `fn` is called with the full name of the person, as given by
+    `str(person)`.  It should return the converted person as a
+    :py:class:`~pybtex.database.Person` object, or `None` if the person should
+    be left unchanged.  It must always return the same result for the same
+    name.
+
+    Calling this object with a person returns the original person object if it
+    was not changed, or a new :py:class:`~pybtex.database.Person` object
+    otherwise.  (A new object is returned each time, so that callers may safely
+    modify it.)
+
+    The `name` and `maxsize` arguments are passed on to
+    :py:class:`bibolamazi.core.butils.MemoizedConversion`.
+    """
+    def __init__(self, name, fn, maxsize=4096, **kwargs):
+        super().__init__(**kwargs)
+        self.fn = fn
+        self._conversion = butils.MemoizedConversion(name, self._convert_name, maxsize=maxsize)
+
+    def _convert_name(self, pstr):
+        newp = self.fn(pstr)
+        if newp is None or str(newp) == pstr:
+            return None
+        return person_parts(newp)
+
+    def __call__(self, p):
+        parts = self._conversion(str(p))
+        if parts is None:
+            return p
+        return person_from_parts(parts)
+
+    def statistics(self):
+        """
+        Return the :py:class:`bibolamazi.core.butils.ConversionStatistics` of the
+        underlying memoized conversion.
+        """
+        return self._conversion.statistics()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#                                                                              #
+#   This file is part of the Bibolamazi Project.                               #
+#   Copyright (C) 2013 by Philippe Faist                                       #
+#   philippe.faist@bluewin.ch                                                  #
+#                                                                              #
+#   Bibolamazi is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#   Bibolamazi is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#   GNU General Public License for more details.                               #
+#                                                                              #
+#   You should have received a copy of the GNU General Public License          #
+#   along with Bibolamazi.  If not, see <http://www.gnu.org/licenses/>.        #
+#                                                                              #
+################################################################################
+
+"""
+Edit distances between short strings, such as author last names or journal
+abbreviations, as used to detect duplicate entries.
+
+Callers usually only need to know whether two strings are within a given edit
+distance of one another.  :py:func:`bounded_levenshtein()` computes the
+Levenshtein distance only within a band around the diagonal and gives up as
+soon as the distance is known to exceed the given bound.  If the `rapidfuzz`
+package is installed, it is used instead of the pure-python implementation.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    from rapidfuzz.distance import Levenshtein as _rapidfuzz_levenshtein
+except ImportError:
+    _rapidfuzz_levenshtein = None
+
+
+
+def levenshtein(a, b):
+    """
+    Calculates the (full) Levenshtein distance between `a` and `b`.
+
+    This is the classic algorithm which computes the full distance matrix.  If
+    you only need to know whether the distance is at most some value, use
+    :py:func:`bounded_levenshtein()` instead.
+    """
+    # taken from http://hetland.org/coding/python/levenshtein.py
+    n, m = len(a), len(b)
+    if n > m:
+        # Make sure n <= m, to use O(min(n,m)) space
+        a,b = b,a
+        n,m = m,n
+
+    current = range(n+1)
+    for i in range(1,m+1):
+        previous, current = current, [i]+[0]*n
+        for j in range(1,n+1):
+            add, delete = previous[j]+1, current[j-1]+1
+            change = previous[j-1]
+            if a[j-1] != b[i-1]:
+                change = change + 1
+            current[j] = min(add, delete, change)
+
+    return current[n]
+
+
+def _bounded_levenshtein_python(a, b, max_dist):
+    if a == b:
+        return 0
+    n, m = len(a), len(b)
+    if n > m:
+        a,b = b,a
+        n,m = m,n
+    toofar = max_dist + 1
+    if m - n > max_dist:
+        return toofar
+    if n == 0:
+        return m
+
+    # Only the cells (i,j) with |i-j| <= max_dist can lie on a path of cost at
+    # most max_dist; all other cells are considered to have cost `toofar`.
+    previous = [ j if j <= max_dist else toofar for j in range(n+1) ]
+    for i in range(1, m+1):
+        current = [toofar]*(n+1)
+        if i <= max_dist:
+            current[0] = i
+        rowmin = current[0]
+        bi = b[i-1]
+        for j in range(max(1, i-max_dist), min(n, i+max_dist)+1):
+            d = previous[j-1]
+            if a[j-1] != bi:
+                d += 1
+            if previous[j] + 1 < d:
+                d = previous[j] + 1
+            if current[j-1] + 1 < d:
+                d = current[j-1] + 1
+            if d > toofar:
+                d = toofar
+            current[j] = d
+            if d < rowmin:
+                rowmin = d
+        if rowmin > max_dist:
+            # all further cells can only be more expensive
+            return toofar
+        previous = current
+
+    return previous[n]
+
+
+def _bounded_levenshtein_rapidfuzz(a, b, max_dist):
+    return _rapidfuzz_levenshtein.distance(a, b, score_cutoff=max_dist)
+
+
+_backends = {
+    'python': _bounded_levenshtein_python,
+}
+if _rapidfuzz_levenshtein is not None:
+    _backends['rapidfuzz'] = _bounded_levenshtein_rapidfuzz
+
+_backend_name = 'rapidfuzz' if 'rapidfuzz' in _backends else 'python'
+_bounded_levenshtein = _backends[_backend_name]
+
+
+def available_backends():
+    """
+    Return a list of the names of the available implementations of
+    :py:func:`bounded_levenshtein()`.  The pure-python implementation
+    ``'python'`` is always available; ``'rapidfuzz'`` is available if the
+    `rapidfuzz` package is installed.
+    """
+    return list(_backends.keys())
+
+def backend():
+    """
+    Return the name of the implementation currently used by
+    :py:func:`bounded_levenshtein()`.
+    """
+    return _backend_name
+
+def set_backend(name):
+    """
+    Use the implementation `name` (one of :py:func:`available_backends()`) for
+    :py:func:`bounded_levenshtein()`.
+    """
+    global _backend_name, _bounded_levenshtein
+    if name not in _backends:
+        raise ValueError("Unknown or unavailable string distance backend: {!r} (available: {})"
+                         .format(name, ", ".join(_backends.keys())))
+    _backend_name = name
+    _bounded_levenshtein = _backends[name]
+
+
+def bounded_levenshtein(a, b, max_dist):
+    """
+    Return the Levenshtein distance between `a` and `b` if it is at most
+    `max_dist`, or `max_dist+1` otherwise.
+
+    The result is exact whenever it is at most `max_dist`, so that e.g.
+    ``bounded_levenshtein(a, b, k) > k`` is equivalent to ``levenshtein(a, b) >
+    k``.  The computation takes time O(k*min(len(a),len(b))) instead of
+    O(len(a)*len(b)), and stops early when the strings are too different.
+    """
+    return _bounded_levenshtein(a, b, max_dist)
+
+
+
+class BoundedDistanceMemo:
+    """
+    Remembers the results of :py:func:`bounded_levenshtein()`.
+
+    The same pairs of strings (e.g., the last names of authors) are compared
+    over and over again when looking for duplicates.  An instance of this class
+    is meant to live for the duration of a single bibolamazi run.  Call the
+    instance as you would call :py:func:`bounded_levenshtein()`.
+
+    The attributes `num_calls` and `num_computed` count how many distances were
+    requested, and how many of them actually had to be computed.
+    """
+    def __init__(self):
+        super().__init__()
+        self._memo = {}
+        self.num_calls = 0
+        self.num_computed = 0
+
+    def __call__(self, a, b, max_dist):
+        self.num_calls += 1
+        if a == b:
+            return 0
+        memokey = (a, b, max_dist) if a < b else (b, a, max_dist)
+        try:
+            return self._memo[memokey]
+        except KeyError:
+            pass
+        self.num_computed += 1
+        d = bounded_levenshtein(a, b, max_dist)
+        self._memo[memokey] = d
+        return d
+
+    def clear(self):
+        """
+        Forget all remembered distances.
+        """
+        self._memo = {}
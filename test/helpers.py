@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import os
+import os.path
 import logging
 import unittest
+import unittest.mock
 logger = logging.getLogger(__name__)
 
 from bibolamazi.core import butils
+from bibolamazi.core import ratelimit
 
 from pybtex.database import Entry, Person, BibliographyData
 
@@ -19,6 +22,23 @@ def test_requires_github_access():
     )
 
 
+class IsolatedUserCache:
+    """
+    Mixin for test cases which must not touch the user's real cache directory.
+
+    Call :py:meth:`isolate_user_cache` in `setUp()`.  The shared cache and the
+    rate limit state are then stored in the given directory for the duration of
+    the test.
+    """
+
+    def isolate_user_cache(self, cachedir):
+        patcher = unittest.mock.patch.dict(os.environ, {'BIBOLAMAZI_SHARED_CACHE_DIR': cachedir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ratelimit.set_state_file(os.path.join(cachedir, 'ratelimit.json'))
+        self.addCleanup(ratelimit.set_state_file, None)
+
+
 
 
 # see https://stackoverflow.com/a/15868615/1694896
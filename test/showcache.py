@@ -14,6 +14,7 @@ sys.path += [os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))]
 import bibolamazi.init
 
 from bibolamazi.core.bibusercache import BibUserCacheDic, BibUserCacheList
+from bibolamazi.core.bibusercache import cacheformat
 
 
 parser = argparse.ArgumentParser('showcache')
@@ -26,7 +27,12 @@ args = parser.parse_args()
 
 cache = None
 with open(args.cachefile, 'rb') as f:
-    cache = pickle.load(f)
+    rawdata = f.read()
+if rawdata.startswith(cacheformat.MAGIC):
+    cache = {'cachepickleversion': 'data-only format',
+             'cachedic': cacheformat.read_cache(rawdata)}
+else:
+    cache = pickle.loads(rawdata)
 
 
 def dump_bibcacheobj(cacheobj, name=None, f=sys.stdout, indent=0, **kwargs):
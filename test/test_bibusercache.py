@@ -0,0 +1,754 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import os.path
+import pickle
+import random
+import datetime
+import tempfile
+import multiprocessing
+import threading
+import unittest
+import logging
+
+from pybtex.database import Entry, Person
+
+from bibolamazi.core import blogger, butils, cachetool
+from helpers import CustomAssertions, IsolatedUserCache
+from bibolamazi.core.bibfilter import BibFilter
+from bibolamazi.core.bibolamazifile import BibolamaziFile
+from bibolamazi.core.bibusercache import (tokencheckers, cachefile, BibUserCache,
+                                          BibUserCacheAccessor, BibUserCacheList,
+                                          parse_cache_size_limits, cacheformat)
+from bibolamazi.core.bibusercache.fingerprints import entry_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class _SetNoteFilter(BibFilter):
+    def __init__(self):
+        super().__init__()
+    def action(self):
+        return BibFilter.BIB_FILTER_SINGLE_ENTRY
+    def filter_bibentry(self, entry):
+        entry.fields['note'] = 'Filtered.'
+
+
+class _SharedTestCacheAccessor(BibUserCacheAccessor):
+    shared_cache = True
+    def __init__(self, **kwargs):
+        super().__init__(cache_name='test_shared_info', **kwargs)
+    def initialize(self, cache_obj, **kwargs):
+        self.cacheDic()['fetched'].set_validation(cache_obj.cacheExpirationTokenChecker())
+
+class _OwnTestCacheAccessor(BibUserCacheAccessor):
+    def __init__(self, **kwargs):
+        super().__init__(cache_name='test_own_info', **kwargs)
+    def initialize(self, cache_obj, **kwargs):
+        pass
+
+class _UseCachesFilter(BibFilter):
+    def __init__(self):
+        super().__init__()
+    def action(self):
+        return BibFilter.BIB_FILTER_BIBOLAMAZIFILE
+    def requested_cache_accessors(self):
+        return [_SharedTestCacheAccessor, _OwnTestCacheAccessor]
+    def filter_bibolamazifile(self, bibolamazifile):
+        pass
+
+class _UseSharedCacheFilter(_UseCachesFilter):
+    def requested_cache_accessors(self):
+        return [_SharedTestCacheAccessor]
+
+
+def _mk_entries():
+    return [
+        ('Bell1964', Entry('article', persons={'author': [Person('Bell, J. S.')]}, fields={
+            'title': 'On the {Einstein} {Podolsky} {Rosen} paradox',
+            'journal': 'Physics',
+            'year': '1964',
+        })),
+        ('Jacobson1995', Entry('article', persons={'author': [Person('Jacobson, Ted')]}, fields={
+            'title': 'Thermodynamics of Spacetime: The Einstein Equation of State',
+            'journal': 'Physical Review Letters',
+            'year': '1995',
+        })),
+    ]
+
+
+class TestEntryFingerprints(unittest.TestCase, CustomAssertions):
+
+    def test_fingerprint_field_order(self):
+        a = Entry('article', persons={'author': [Person('Bell, J. S.')]},
+                  fields=[('title', 'X'), ('year', '1964')])
+        b = Entry('article', persons={'author': [Person('Bell, J. S.')]},
+                  fields=[('year', '1964'), ('title', 'X')])
+        c = Entry('article', persons={'author': [Person('Bell, J. S.')]},
+                  fields=[('year', '1965'), ('title', 'X')])
+        d = Entry('book', persons={'author': [Person('Bell, J. S.')]},
+                  fields=[('title', 'X'), ('year', '1964')])
+        self.assertEqual(entry_fingerprint(a), entry_fingerprint(b))
+        self.assertNotEqual(entry_fingerprint(a), entry_fingerprint(c))
+        self.assertNotEqual(entry_fingerprint(a), entry_fingerprint(d))
+
+    def test_index_updated_by_filters(self):
+        bf = BibolamaziFile(create=True)
+        bf.setEntries(_mk_entries())
+
+        fp = bf.entryFingerprint('Bell1964')
+        self.assertEqual(fp, entry_fingerprint(bf.bibliographyData().entries['Bell1964']))
+        self.assertIs(bf.entryFingerprint('bell1964'), fp)
+        self.assertIsNone(bf.entryFingerprint('DoesNotExist'))
+
+        filt = _SetNoteFilter()
+        bf.registerFilterInstance(filt)
+        bf.runFilter(filt)
+
+        newfp = bf.entryFingerprint('Bell1964')
+        self.assertNotEqual(newfp, fp)
+        self.assertEqual(newfp, entry_fingerprint(bf.bibliographyData().entries['Bell1964']))
+
+    def test_token_checker_memoized(self):
+        bf = BibolamaziFile(create=True)
+        bf.setEntries(_mk_entries())
+
+        chk = tokencheckers.EntryFieldsTokenChecker(
+            bf.bibliographyData(),
+            fields=['title', 'year'],
+            store_persons=['author'],
+        )
+        chk_nomemo = tokencheckers.EntryFieldsTokenChecker(
+            bf.bibliographyData(),
+            fields=['title', 'year'],
+            store_persons=['author'],
+        )
+
+        tok = chk.new_token(key='Jacobson1995', value=None)
+        self.assertEqual(tok, chk_nomemo.new_token(key='Jacobson1995', value=None))
+        self.assertTrue(chk.cmp_tokens(key='Jacobson1995', value=None, oldtoken=tok))
+
+        # changes are seen even if the entry is modified in place, e.g. by a filter
+        # in the middle of its run
+        entry = bf.bibliographyData().entries['Jacobson1995']
+        entry.fields['year'] = '1996'
+        newtok = chk.new_token(key='Jacobson1995', value=None)
+        self.assertNotEqual(newtok, tok)
+        self.assertEqual(newtok, chk_nomemo.new_token(key='Jacobson1995', value=None))
+
+        entry.persons['author'][0].first_names.append('A.')
+        newtok2 = chk.new_token(key='Jacobson1995', value=None)
+        self.assertNotEqual(newtok2, newtok)
+        self.assertEqual(newtok2, chk_nomemo.new_token(key='Jacobson1995', value=None))
+
+        # a modified field which isn't checked doesn't change the token
+        entry.fields['note'] = 'Modified.'
+        self.assertEqual(chk.new_token(key='Jacobson1995', value=None), newtok2)
+
+
+
+_BIBOLAMAZIFILE_CONTENTS = r"""
+%%%-BIB-OLA-MAZI-BEGIN-%%%
+%
+%%%-BIB-OLA-MAZI-END-%%%
+"""
+
+
+class TestSharedCache(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(os.path.join(self.tmpdir.name, 'shared'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _open_with_filter(self, fname, **kwargs):
+        if not os.path.exists(fname):
+            with open(fname, 'w') as f:
+                f.write(_BIBOLAMAZIFILE_CONTENTS)
+        bf = BibolamaziFile(fname, **kwargs)
+        filt = _UseCachesFilter()
+        bf.registerFilterInstance(filt)
+        return bf, filt
+
+    def test_shared_between_files(self):
+        fname1 = os.path.join(self.tmpdir.name, 'one.bibolamazi.bib')
+        fname2 = os.path.join(self.tmpdir.name, 'two.bibolamazi.bib')
+
+        bf1, filt1 = self._open_with_filter(fname1)
+        filt1.cacheAccessor(_SharedTestCacheAccessor).cacheDic()['fetched']['X'] = 'fetched-X'
+        filt1.cacheAccessor(_OwnTestCacheAccessor).cacheDic()['data'] = 'own-one'
+        bf1.saveCache()
+
+        self.assertTrue(os.path.exists(BibolamaziFile.sharedCacheFileName()))
+
+        bf2, filt2 = self._open_with_filter(fname2)
+        self.assertEqual(
+            filt2.cacheAccessor(_SharedTestCacheAccessor).cacheDic()['fetched'].get('X'),
+            'fetched-X'
+        )
+        self.assertNotIn('data', filt2.cacheAccessor(_OwnTestCacheAccessor).cacheDic())
+
+    def test_no_shared_cache(self):
+        fname1 = os.path.join(self.tmpdir.name, 'one.bibolamazi.bib')
+
+        bf1, filt1 = self._open_with_filter(fname1, use_shared_cache=False)
+        filt1.cacheAccessor(_SharedTestCacheAccessor).cacheDic()['fetched']['X'] = 'fetched-X'
+        bf1.saveCache()
+
+        self.assertFalse(os.path.exists(BibolamaziFile.sharedCacheFileName()))
+
+        # data was kept in the file's own cache -- it gets moved to the shared
+        # cache when the file is opened with the shared cache enabled
+        bf1b, filt1b = self._open_with_filter(fname1)
+        self.assertEqual(
+            filt1b.cacheAccessor(_SharedTestCacheAccessor).cacheDic()['fetched'].get('X'),
+            'fetched-X'
+        )
+        self.assertIs(filt1b.cacheAccessor(_SharedTestCacheAccessor).cacheObject(),
+                      bf1b._shared_cache)
+
+    def test_no_pickle_in_shared_cache(self):
+        fname1 = os.path.join(self.tmpdir.name, 'one.bibolamazi.bib')
+
+        def _pickled_cache(value):
+            cache = BibUserCache(cache_version=butils.get_version())
+            cache.cacheFor('test_shared_info')['X'] = value
+            return pickle.dumps({'cachepickleversion': 2, 'cachedic': cache.cachedic})
+
+        sharedfname = BibolamaziFile.sharedCacheFileName()
+        os.makedirs(os.path.dirname(sharedfname))
+        with open(sharedfname, 'wb') as f:
+            f.write(_pickled_cache('from-shared'))
+
+        # a shared cache is never unpickled
+        bf1, filt1 = self._open_with_filter(fname1)
+        self.assertNotIn('X', filt1.cacheAccessor(_SharedTestCacheAccessor).cacheDic())
+
+        # but a file's own legacy cache is, and its data is moved to the shared cache
+        with open(BibolamaziFile.cacheFileNameFor(fname1), 'wb') as f:
+            f.write(_pickled_cache('from-own'))
+        bf1b, filt1b = self._open_with_filter(fname1)
+        self.assertEqual(filt1b.cacheAccessor(_SharedTestCacheAccessor).cacheDic().get('X'),
+                         'from-own')
+
+    def test_no_own_cache_written(self):
+        fname1 = os.path.join(self.tmpdir.name, 'one.bibolamazi.bib')
+        with open(fname1, 'w') as f:
+            f.write(_BIBOLAMAZIFILE_CONTENTS)
+
+        # only shared data -- the file's own cache has nothing to store
+        bf1 = BibolamaziFile(fname1)
+        filt1 = _UseSharedCacheFilter()
+        bf1.registerFilterInstance(filt1)
+        filt1.cacheAccessor(_SharedTestCacheAccessor).cacheDic()['fetched']['X'] = 'fetched-X'
+        bf1.saveCache()
+
+        self.assertEqual(bf1._user_cache.removed_cache_names, set())
+        self.assertTrue(os.path.exists(BibolamaziFile.sharedCacheFileName()))
+        self.assertFalse(os.path.exists(bf1.cacheFileName()))
+
+
+
+class _PrefetchTestAccessorBase(BibUserCacheAccessor):
+    shared_cache = True
+    # both accessors must be fetching at the same time to get past the barrier
+    barrier = None
+    def initialize(self, cache_obj, **kwargs):
+        pass
+    def prefetch(self, items):
+        self.barrier.wait()
+        for item in items:
+            self.cacheDic()['fetched'][item] = 'fetched-' + item
+
+class _PrefetchTestAccessorA(_PrefetchTestAccessorBase):
+    def __init__(self, **kwargs):
+        super().__init__(cache_name='test_prefetch_a', **kwargs)
+    def prefetchRequests(self):
+        return { _PrefetchTestAccessorB: ['b2', 'b1'] }
+
+class _PrefetchTestAccessorB(_PrefetchTestAccessorBase):
+    def __init__(self, **kwargs):
+        super().__init__(cache_name='test_prefetch_b', **kwargs)
+
+class _PrefetchFilter(BibFilter):
+    def __init__(self, fail=False):
+        super().__init__()
+        self.fail = fail
+    def action(self):
+        return BibFilter.BIB_FILTER_BIBOLAMAZIFILE
+    def requested_cache_accessors(self):
+        return [_PrefetchTestAccessorA, _PrefetchTestAccessorB]
+    def prefetch_requests(self):
+        if self.fail:
+            raise ValueError("can't tell")
+        return { _PrefetchTestAccessorA: ['a1'], _PrefetchTestAccessorB: ['b1'] }
+    def filter_bibolamazifile(self, bibolamazifile):
+        pass
+
+
+class TestPrefetch(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(os.path.join(self.tmpdir.name, 'shared'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_prefetch_concurrently(self):
+        fname = os.path.join(self.tmpdir.name, 'test.bibolamazi.bib')
+        with open(fname, 'w') as f:
+            f.write(_BIBOLAMAZIFILE_CONTENTS)
+        bf = BibolamaziFile(fname)
+        filters = [ _PrefetchFilter(), _PrefetchFilter(fail=True) ]
+        for filt in filters:
+            bf.registerFilterInstance(filt)
+
+        _PrefetchTestAccessorBase.barrier = threading.Barrier(2, timeout=10)
+        bf.prefetchCacheData(filters)
+
+        self.assertFalse(_PrefetchTestAccessorBase.barrier.broken)
+        fetched_a = bf.cacheAccessor(_PrefetchTestAccessorA).cacheDic()['fetched']
+        fetched_b = bf.cacheAccessor(_PrefetchTestAccessorB).cacheDic()['fetched']
+        self.assertEqual(list(fetched_a.keys()), ['a1'])
+        self.assertEqual(list(fetched_b.keys()), ['b1', 'b2'])
+        self.assertEqual(fetched_b['b2'], 'fetched-b2')
+
+
+
+def _concurrent_cache_writer(cachefname, worker_id, num_rounds):
+    for n in range(num_rounds):
+        cache = BibUserCache(cache_version='test')
+        cachefile.load_cache_file(cache, cachefname)
+        dic = cache.cacheFor('test_concurrent')
+        dic['w{}_{}'.format(worker_id, n)] = {'worker': worker_id, 'round': n}
+        cachefile.save_cache_file(cache, cachefname)
+
+
+class TestConcurrentCacheAccess(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.shareddir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.shareddir.name)
+
+    def tearDown(self):
+        self.shareddir.cleanup()
+
+    def test_many_processes(self):
+
+        num_workers = 8
+        num_rounds = 5
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cachefname = os.path.join(tmpdir, 'test.bibolamazicache')
+
+            procs = [
+                multiprocessing.Process(target=_concurrent_cache_writer,
+                                        args=(cachefname, w, num_rounds))
+                for w in range(num_workers)
+            ]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+
+            cache = BibUserCache(cache_version='test')
+            self.assertTrue(cachefile.load_cache_file(cache, cachefname))
+            dic = cache.cacheFor('test_concurrent')
+            self.assertEqual(
+                set(dic.keys()),
+                set([ 'w{}_{}'.format(w, n)
+                      for w in range(num_workers) for n in range(num_rounds) ])
+            )
+            self.assertEqual(dic['w3_4']['round'], 4)
+
+            # no leftover temporary files, and the lock file is in the cache directory
+            self.assertEqual(os.listdir(tmpdir), ['test.bibolamazicache'])
+            lockfname = cachefile.lock_file_name(cachefname)
+            self.assertEqual(os.path.dirname(lockfname), os.path.join(self.shareddir.name, 'locks'))
+            self.assertTrue(os.path.exists(lockfname))
+
+    def test_lock_file_names(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname1 = os.path.join(tmpdir, 'one', 'test.bibolamazicache')
+            fname2 = os.path.join(tmpdir, 'two', 'test.bibolamazicache')
+            self.assertNotEqual(cachefile.lock_file_name(fname1), cachefile.lock_file_name(fname2))
+            self.assertEqual(cachefile.lock_file_name(fname1),
+                             cachefile.lock_file_name(os.path.join(tmpdir, 'two', '..', 'one',
+                                                                   'test.bibolamazicache')))
+
+    @unittest.skipIf(os.name != 'posix', "file permissions are only checked on POSIX systems")
+    def test_file_permissions(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cachefname = os.path.join(tmpdir, 'test.bibolamazicache')
+            cache = BibUserCache(cache_version='test')
+            cache.cacheFor('sub')['a'] = 'a'
+
+            old_umask = os.umask(0o022)
+            try:
+                cachefile.save_cache_file(cache, cachefname)
+            finally:
+                os.umask(old_umask)
+            self.assertEqual(os.stat(cachefname).st_mode & 0o777, 0o644)
+
+            # the permissions of an existing cache file are kept
+            os.chmod(cachefname, 0o600)
+            cachefile.save_cache_file(cache, cachefname)
+            self.assertEqual(os.stat(cachefname).st_mode & 0o777, 0o600)
+
+    def test_merge_drops_invalid(self):
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cachefname = os.path.join(tmpdir, 'test.bibolamazicache')
+
+            cache = BibUserCache(cache_version='test')
+            cache.cacheFor('sub')['a'] = 'old-a'
+            cache.cacheFor('sub')['b'] = 'b'
+            cache.cacheFor('gone')['x'] = 1
+            cachefile.save_cache_file(cache, cachefname)
+
+            # a different version should not pick up anything
+            cache2 = BibUserCache(cache_version='other')
+            cache2.cacheFor('sub')['c'] = 'c'
+            cache2.cacheFor('gone2')['y'] = 2
+            cachefile.save_cache_file(cache2, cachefname)
+            cache2b = BibUserCache(cache_version='other')
+            cachefile.load_cache_file(cache2b, cachefname)
+            self.assertEqual(set(cache2b.cacheFor('sub').keys()), set(['c']))
+
+            # our own values win, removed caches don't come back even if a
+            # concurrent process wrote to them in the meantime
+            cache3 = BibUserCache(cache_version='other')
+            cachefile.load_cache_file(cache3, cachefname)
+            cache3.cacheFor('sub')['a'] = 'new-a'
+            self.assertIsNotNone(cache3.removeCache('gone2'))
+            self.assertIsNone(cache3.removeCache('never-there'))
+            self.assertEqual(cache3.removed_cache_names, set(['gone2']))
+            cache4 = BibUserCache(cache_version='other')
+            cache4.cacheFor('sub')['a'] = 'concurrent-a'
+            cache4.cacheFor('gone2')['z'] = 3
+            cachefile.save_cache_file(cache4, cachefname)
+            cachefile.save_cache_file(cache3, cachefname)
+            cache3b = BibUserCache(cache_version='other')
+            cachefile.load_cache_file(cache3b, cachefname)
+            self.assertEqual(dict(cache3b.cacheFor('sub').items()), {'a': 'new-a', 'c': 'c'})
+            self.assertNotIn('gone2', cache3b.cachedic)
+
+
+
+class TestCacheSizeLimits(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.shareddir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.shareddir.name)
+
+    def tearDown(self):
+        self.shareddir.cleanup()
+
+    def test_parse_limits(self):
+        self.assertEqual(parse_cache_size_limits('5000'), (5000, None))
+        self.assertEqual(parse_cache_size_limits('20M'), (None, 20*1024*1024))
+        self.assertEqual(parse_cache_size_limits('5000, 500kB'), (5000, 500*1024))
+        self.assertEqual(parse_cache_size_limits('1000b,10'), (10, 1000))
+        self.assertEqual(parse_cache_size_limits('none'), (None, None))
+        with self.assertRaises(ValueError):
+            parse_cache_size_limits('10,20')
+        with self.assertRaises(ValueError):
+            parse_cache_size_limits('20 parsecs')
+
+    def _mk_cache(self):
+        cache = BibUserCache(cache_version='test')
+        fetched = cache.cacheFor('fetched_info')['fetched']
+        rnd = random.Random(1234)
+        for j in range(10):
+            # (random data, which doesn't compress too well)
+            fetched['item{}'.format(j)] = {'data': ''.join([ rnd.choice('abcdefgh')
+                                                             for n in range(1000) ])}
+            fetched.access_times['item{}'.format(j)] = 1000+j
+        return cache
+
+    def test_evict_lru_items(self):
+        cache = self._mk_cache()
+        fetched = cache.cacheFor('fetched_info')['fetched']
+        # touch item2 and item5, they should be kept
+        self.assertEqual(len(fetched['item2']['data']), 1000)
+        self.assertEqual(len(fetched['item5']['data']), 1000)
+
+        cache.setSizeLimits(max_items=4)
+        self.assertEqual(cache.enforceSizeLimits(), 6)
+        self.assertEqual(set(fetched.keys()), set(['item2', 'item5', 'item8', 'item9']))
+
+        # sizes are those of the sub-cache in the cache file
+        num_bytes = cache.cacheSize('fetched_info')[1]
+        cache.setSizeLimits(max_bytes=int(num_bytes*0.6))
+        self.assertEqual(cache.enforceSizeLimits(), 2)
+        self.assertEqual(set(fetched.keys()), set(['item2', 'item5']))
+        self.assertLessEqual(cache.cacheSize('fetched_info')[1], int(num_bytes*0.6))
+
+    def test_size_in_file(self):
+        cache = self._mk_cache()
+        (num_items, num_bytes) = cache.cacheSize('fetched_info')
+        self.assertEqual(num_items, 10)
+        cache.saveCache(io.BytesIO())
+        self.assertEqual(num_bytes, cache.cacheStatistics('fetched_info').bytes_saved)
+
+    def test_limits_from_config(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.bibolamazi.bib')
+            with open(fname, 'w') as f:
+                f.write(_BIBOLAMAZIFILE_CONTENTS.replace('%\n', '%\n% cache: max-size=3,1M\n'))
+
+            bf = BibolamaziFile(fname)
+            self.assertEqual(bf.cacheSizeLimits(), (3, 1024*1024))
+            bf2 = BibolamaziFile(fname, cache_size_limits=(5, None))
+            self.assertEqual(bf2.cacheSizeLimits(), (5, None))
+
+            # limits are applied when saving the cache, and access times persist
+            cache = self._mk_cache()
+            bf._user_cache = cache
+            bf.saveCache()
+            reloaded = BibUserCache(cache_version='test')
+            cachefile.load_cache_file(reloaded, bf.cacheFileName())
+            fetched = reloaded.cacheFor('fetched_info')['fetched']
+            self.assertEqual(set(fetched.keys()), set(['item7', 'item8', 'item9']))
+            self.assertEqual(fetched.access_time('item8'), 1008)
+
+
+
+class TestCacheStatistics(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.shareddir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.shareddir.name)
+
+    def tearDown(self):
+        self.shareddir.cleanup()
+
+    def test_hits_misses_bytes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cachefname = os.path.join(tmpdir, 'test.bibolamazicache')
+
+            cache = BibUserCache(cache_version='test')
+            fetched = cache.cacheFor('fetched_info')['fetched']
+            fetched['A'] = {'data': 'a'}
+            fetched['B'] = {'data': 'b'}
+            cachefile.save_cache_file(cache, cachefname)
+            self.assertGreater(cache.cacheStatistics('fetched_info').bytes_saved, 0)
+
+            cache2 = BibUserCache(cache_version='test')
+            cachefile.load_cache_file(cache2, cachefname)
+            fetched2 = cache2.cacheFor('fetched_info')['fetched']
+            self.assertEqual(fetched2['A']['data'], 'a')
+            self.assertFalse('C' in fetched2)
+            self.assertEqual(fetched2.get('B')['data'], 'b')
+
+            stats = cache2.cacheStatistics()['fetched_info']
+            self.assertEqual((stats.hits, stats.misses), (2, 1))
+            self.assertEqual(stats.bytes_loaded,
+                             cache.cacheStatistics('fetched_info').bytes_saved)
+
+    def test_invalidations(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cachefname = os.path.join(tmpdir, 'test.bibolamazicache')
+
+            cache = BibUserCache(cache_version='test')
+            cache.cacheFor('one')['x'] = 1
+            cache.cacheFor('two')['y'] = 2
+            cachefile.save_cache_file(cache, cachefname)
+
+            # a different cache version invalidates everything
+            cache2 = BibUserCache(cache_version='other')
+            cachefile.load_cache_file(cache2, cachefname)
+            self.assertEqual(cache2.cacheStatistics('one').invalidations,
+                             {'VersionTokenChecker': 1})
+
+            # expired items are reported as such
+            cache3 = BibUserCache(cache_version='test')
+            cachefile.load_cache_file(cache3, cachefname)
+            cache3.setDefaultInvalidationTime(datetime.timedelta(0))
+            cache3.installCacheExpirationChecker('two')
+            self.assertEqual(cache3.cacheStatistics('two').invalidations,
+                             {'TokenCheckerDate': 1})
+            self.assertEqual(cache3.cacheStatistics('one').num_invalidations(), 0)
+
+
+
+class _NotSupportedValue(object):
+    def __init__(self, x):
+        self.x = x
+
+
+class TestCacheFormat(unittest.TestCase, CustomAssertions):
+
+    def _roundtrip(self, cache, allow_pickle=True):
+        f = io.BytesIO()
+        cache.saveCache(f)
+        self.assertTrue(f.getvalue().startswith(cacheformat.MAGIC))
+        cache2 = BibUserCache(cache_version='test')
+        cache2.loadCache(io.BytesIO(f.getvalue()), allow_pickle=allow_pickle)
+        return cache2
+
+    def test_roundtrip(self):
+        when = datetime.datetime(2020, 5, 17, 13, 45, 2, 123)
+        cache = BibUserCache(cache_version='test')
+        fetched = cache.cacheFor('fetched_info')['fetched']
+        fetched.set_validation(cache.cacheExpirationTokenChecker())
+        fetched['A'] = {'title': 'A title', 'when': when, 'pages': (1, 5),
+                        'raw': b'\x00\xff', 'tags': set(['x']), 7: None}
+        fetched.tokens['A'] = when
+        cache.cacheFor('lists')['lst'] = [1, 'two', 3.5]
+        cache.cacheFor('lists')['dt'] = datetime.timedelta(days=2)
+
+        cache2 = self._roundtrip(cache)
+        fetched2 = cache2.cacheFor('fetched_info')['fetched']
+        self.assertEqual(fetched2['A'], fetched['A'])
+        self.assertEqual(fetched2.tokens['A'], when)
+        self.assertIsInstance(cache2.cacheFor('lists')['lst'], BibUserCacheList)
+        self.assertEqual(list(cache2.cacheFor('lists')['lst']), [1, 'two', 3.5])
+        self.assertEqual(cache2.cacheFor('lists')['dt'], datetime.timedelta(days=2))
+
+    def test_roundtrip_plain_dicts(self):
+        utc_plus_2 = datetime.timezone(datetime.timedelta(hours=2))
+        values = [
+            {'title': 'A title', 'nested': {'$': 'not a tag', 'v': [1, 2]}},
+            {'$': 'D', 'v': {}},
+            {'M': 1, 'x': 2, (1, 2): 'tuple key'},
+            datetime.datetime(2020, 5, 17, 13, 45, 2, tzinfo=utc_plus_2),
+        ]
+        for value in values:
+            self.assertEqual(cacheformat._load_block(cacheformat._dump_block(
+                cacheformat.encode_value(value))), value)
+        self.assertEqual(cacheformat.encode_value({'a': [1, {'b': 'c'}]}),
+                         {'a': [1, {'b': 'c'}]})
+
+    def test_pickle_fallback(self):
+        cache = BibUserCache(cache_version='test')
+        cache.cacheFor('plain')['x'] = 1
+        cache.cacheFor('objects')['y'] = _NotSupportedValue(42)
+
+        cache2 = self._roundtrip(cache)
+        self.assertEqual(cache2.cacheFor('objects')['y'].x, 42)
+
+        cache3 = self._roundtrip(cache, allow_pickle=False)
+        self.assertEqual(cache3.cacheFor('plain')['x'], 1)
+        self.assertEqual(cache3.cacheNames(), ['plain'])
+
+    def test_load_old_pickle(self):
+        cache = BibUserCache(cache_version='test')
+        cache.cacheFor('fetched_info')['x'] = 'y'
+        data = pickle.dumps({'cachepickleversion': 2,
+                             'cachedic': cache.cachedic})
+
+        cache2 = BibUserCache(cache_version='test')
+        cache2.loadCache(io.BytesIO(data))
+        self.assertEqual(cache2.cacheFor('fetched_info')['x'], 'y')
+
+        cache3 = BibUserCache(cache_version='test')
+        cache3.loadCache(io.BytesIO(data), allow_pickle=False)
+        self.assertFalse(cache3.hasCache())
+
+
+
+class TestCacheTool(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(os.path.join(self.tmpdir.name, 'shared'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _mk_shared_cache(self):
+        cache = BibUserCache(cache_version=butils.get_version())
+        fetched = cache.cacheFor('test_shared_info')['fetched']
+        fetched.set_validation(cache.cacheExpirationTokenChecker())
+        fetched['new'] = {'data': 'new'}
+        fetched['old'] = {'data': 'old'}
+        fetched.tokens['old'] = datetime.datetime(2000, 1, 1)
+        cachefile.save_cache_file(cache, BibolamaziFile.sharedCacheFileName())
+
+    def _load(self, cachefname):
+        cache = BibUserCache(cache_version=butils.get_version())
+        cachefile.load_cache_file(cache, cachefname)
+        return cache
+
+    def test_prune_shared(self):
+        self._mk_shared_cache()
+        cachetool.cache_main(['prune', '--shared'])
+        fetched = self._load(BibolamaziFile.sharedCacheFileName()).cacheFor('test_shared_info')['fetched']
+        self.assertEqual(set(fetched.keys()), set(['new']))
+
+    def test_prune_file(self):
+        fname = os.path.join(self.tmpdir.name, 'test.bibolamazi.bib')
+        with open(fname, 'w') as f:
+            f.write(_BIBOLAMAZIFILE_CONTENTS)
+        cache = BibUserCache(cache_version=butils.get_version())
+        cache.cacheFor('not_used_anymore')['x'] = 1
+        cachefile.save_cache_file(cache, BibolamaziFile.cacheFileNameFor(fname))
+
+        cachetool.cache_main(['prune', fname])
+        self.assertEqual(self._load(BibolamaziFile.cacheFileNameFor(fname)).cacheNames(), [])
+
+    def test_export_import(self):
+        self._mk_shared_cache()
+        exportfname = os.path.join(self.tmpdir.name, 'export.bibolamazicache')
+        otherfname = os.path.join(self.tmpdir.name, 'other.bibolamazicache')
+
+        cache = BibUserCache(cache_version=butils.get_version())
+        cache.cacheFor('test_shared_info')['fetched']['mine'] = {'data': 'mine'}
+        cache.cacheFor('test_shared_info')['fetched']['new'] = {'data': 'keep this'}
+        cachefile.save_cache_file(cache, otherfname)
+
+        cachetool.cache_main(['export', '--shared', exportfname])
+        cachetool.cache_main(['import', otherfname, exportfname])
+
+        fetched = self._load(otherfname).cacheFor('test_shared_info')['fetched']
+        self.assertEqual(set(fetched.keys()), set(['mine', 'new', 'old']))
+        self.assertEqual(fetched['new']['data'], 'keep this')
+
+        cachetool.cache_main(['compact', otherfname])
+        self.assertEqual(self._load(otherfname).cacheFor('test_shared_info')['fetched']['old'],
+                         {'data': 'old'})
+
+    def test_import_shared_skips_file_caches(self):
+        exportfname = os.path.join(self.tmpdir.name, 'export.bibolamazicache')
+        cache = BibUserCache(cache_version=butils.get_version())
+        cache.cacheFor('test_shared_info')['fetched']['mine'] = {'data': 'mine'}
+        cache.cacheFor('test_own_info')['x'] = 1
+        cachefile.save_cache_file(cache, exportfname)
+
+        with self.assertLogs('bibolamazi.core.cachetool', level='WARNING') as cm:
+            cachetool.cache_main(['import', '--shared', exportfname])
+        self.assertIn('test_own_info', "\n".join(cm.output))
+
+        shared = self._load(BibolamaziFile.sharedCacheFileName())
+        self.assertEqual(shared.cacheNames(), ['test_shared_info'])
+        self.assertEqual(shared.cacheFor('test_shared_info')['fetched']['mine'],
+                         {'data': 'mine'})
+
+    def test_cache_command_line(self):
+        from bibolamazi.core import main
+        rootlogger = logging.getLogger()
+        self.addCleanup(rootlogger.setLevel, rootlogger.level)
+
+        self.assertEqual(main._get_cache_command_args(['cache', 'stats', '--shared']),
+                         ['stats', '--shared'])
+        self.assertEqual(main._get_cache_command_args(['-v', 'cache', 'stats', '--shared']),
+                         ['stats', '--shared'])
+        self.assertEqual(rootlogger.level, main.verbosity_logger_level(2))
+        self.assertEqual(main._get_cache_command_args(['cache', 'prune', '-q', '--shared']),
+                         ['prune', '--shared'])
+        self.assertEqual(rootlogger.level, main.verbosity_logger_level(0))
+        # not a cache command
+        self.assertIsNone(main._get_cache_command_args(['-v', 'test.bibolamazi.bib']))
+        self.assertIsNone(main._get_cache_command_args(['-o', 'cache', 'test.bibolamazi.bib']))
+
+
+
+if __name__ == '__main__':
+    blogger.setup_simple_console_logging(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+import logging
+
+import pybtex.database
+import pybtex.database.output.bibtex
+from pybtex.database import Entry
+from pybtex.utils import OrderedCaseInsensitiveDict
+
+from bibolamazi.core import blogger
+from helpers import CustomAssertions
+from bibolamazi.core.entrydict import EntryDict
+from bibolamazi.core.bibolamazifile import BibolamaziFile
+from bibolamazi.filters.orderentries import sort_entries
+
+logger = logging.getLogger(__name__)
+
+
+class TestEntryDict(unittest.TestCase, CustomAssertions):
+
+    def test_dict(self):
+        d = EntryDict([ ("Uno", 1), ("Dos", 2), ("Tres", 3) ])
+        self.assertIsInstance(d, OrderedCaseInsensitiveDict)
+        self.assertEqual(len(d), 3)
+        self.assertEqual((d["uno"], d["UNO"], d.get("dOs"), d.get("cuatro", 4)), (1, 1, 2, 4))
+        self.assertTrue("TRES" in d)
+        self.assertFalse("cuatro" in d)
+
+        # setting an existing key updates the key's case but not its position
+        d["UNO"] = "one"
+        d["Cuatro"] = 4
+        del d["dos"]
+        self.assertEqual(list(d), ["UNO", "Tres", "Cuatro"])
+        self.assertEqual(list(d.items()), [("UNO", "one"), ("Tres", 3), ("Cuatro", 4)])
+        self.assertEqual(list(d.values()), ["one", 3, 4])
+        self.assertIn(("Tres", 3), d.items())
+        self.assertEqual(list(d.lower().items()), [("uno", "one"), ("tres", 3), ("cuatro", 4)])
+        with self.assertRaises(KeyError):
+            del d["dos"]
+
+    def test_reorder(self):
+        d = EntryDict([ ("b", 1), ("C", 2), ("a", 3), ("B2", 4) ])
+        d.sort(key=lambda k: k.lower())
+        self.assertEqual(list(d), ["a", "b", "B2", "C"])
+        d.sort(reverse=True)
+        self.assertEqual(list(d), ["b", "a", "C", "B2"])
+        d.reorder(["c", "A", "b2", "B"])
+        self.assertEqual(list(d.items()), [("C", 2), ("a", 3), ("B2", 4), ("b", 1)])
+        with self.assertRaises(ValueError):
+            d.reorder(["c", "a", "b2"])
+        with self.assertRaises(ValueError):
+            d.reorder(["c", "a", "b2", "c"])
+        self.assertEqual(list(d), ["C", "a", "B2", "b"])
+
+    def test_bibliographydata(self):
+        bf = BibolamaziFile(create=True, use_shared_cache=False)
+        keys = [ "Key%03d"%(n) for n in range(100, 0, -1) ]
+        bf.setEntries( (k, Entry('article', fields={'title': 'Title of %s'%(k)})) for k in keys )
+        entries = bf.bibliographyData().entries
+        self.assertIsInstance(entries, EntryDict)
+        self.assertEqual(list(entries), keys)
+
+        for k in keys[::2]:
+            del entries[k.lower()]
+        sort_entries(entries)
+        self.assertEqual(list(entries), sorted(keys[1::2]))
+
+        with io.StringIO() as f:
+            pybtex.database.output.bibtex.Writer().write_stream(bf.bibliographyData(), f)
+            output = f.getvalue()
+        self.assertIn('@article{Key001,', output)
+        self.assertNotIn('Key100', output)
+
+
+
+if __name__ == '__main__':
+    blogger.setup_simple_console_logging(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import io
+import re
+import glob
+import random
+import json
+import datetime
+import tempfile
+import threading
+import unittest
+import unittest.mock
+from xml.etree import ElementTree
+import logging
+
+import arxiv2bib
+from pybtex.database import Entry, parse_file
+
+from bibolamazi.core import blogger
+from helpers import CustomAssertions, IsolatedUserCache
+from bibolamazi.core.bibfilter import BibFilter
+from bibolamazi.core.bibolamazifile import BibolamaziFile
+from bibolamazi.filters.util import arxivutil
+from bibolamazi.filters.util import arxivsnapshot
+
+logger = logging.getLogger(__name__)
+
+
+_ATOM_FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:arxiv="http://arxiv.org/schemas/atom">
+{}
+</feed>
+"""
+
+_ATOM_ENTRY = """
+<entry>
+  <id>http://arxiv.org/abs/{arxivid}v1</id>
+  <updated>2013-05-06T12:00:00Z</updated>
+  <published>2013-05-06T12:00:00Z</published>
+  <title>Paper {arxivid}</title>
+  <summary>Abstract of {arxivid}</summary>
+  <author><name>A. Author</name></author>
+  <arxiv:primary_category term="quant-ph"/>
+</entry>
+"""
+
+
+_ATOM_MISSING_ENTRY = """
+<entry>
+  <id>http://arxiv.org/abs/{arxivid}</id>
+</entry>
+"""
+
+
+class _FakeArxivApi:
+    # stands in for arxivutil.arxiv_api_request(); reports the IDs in `unknown`
+    # as missing, and leaves out the IDs in `omitted` from its response
+
+    def __init__(self, unknown=(), omitted=()):
+        self.unknown = set(unknown)
+        self.omitted = set(omitted)
+        self.requests = []
+        self.threads = set()
+
+    def __call__(self, ids):
+        self.requests.append(list(ids))
+        self.threads.add(threading.current_thread())
+        entries = [ (_ATOM_MISSING_ENTRY if aid in self.unknown else _ATOM_ENTRY).format(arxivid=aid)
+                    for aid in ids if aid not in self.omitted ]
+        return ElementTree.fromstring(_ATOM_FEED.format("".join(entries)))
+
+
+class _UseArxivApiFilter(BibFilter):
+    def __init__(self):
+        super().__init__()
+    def action(self):
+        return BibFilter.BIB_FILTER_BIBOLAMAZIFILE
+    def requested_cache_accessors(self):
+        return [arxivutil.ArxivFetchedAPIInfoCacheAccessor]
+    def filter_bibolamazifile(self, bibolamazifile):
+        pass
+
+
+_BIBOLAMAZIFILE_CONTENTS = r"""
+%%%-BIB-OLA-MAZI-BEGIN-%%%
+%
+%%%-BIB-OLA-MAZI-END-%%%
+"""
+
+
+class TestArxivApiFetch(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(os.path.join(self.tmpdir.name, 'shared'))
+        self.fname = os.path.join(self.tmpdir.name, 'test.bibolamazi.bib')
+        with open(self.fname, 'w') as f:
+            f.write(_BIBOLAMAZIFILE_CONTENTS)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _mk_accessor(self):
+        bf = BibolamaziFile(self.fname)
+        bf.registerFilterInstance(_UseArxivApiFilter())
+        accessor = bf.cacheAccessor(arxivutil.ArxivFetchedAPIInfoCacheAccessor)
+        accessor.api_request_interval = 0
+        return bf, accessor
+
+    def test_fetch_batches(self):
+        bf, accessor = self._mk_accessor()
+        arxivids = [ '1305.%04d'%(n) for n in range(150) ]
+        fakeapi = _FakeArxivApi(unknown=['1305.0007'])
+        with unittest.mock.patch.object(arxivutil, 'arxiv_api_request', fakeapi):
+            self.assertTrue(accessor.fetchArxivApiInfo(arxivids + ['not-an-id']))
+
+        # three batches, queried from a separate thread
+        self.assertEqual([ len(ids) for ids in fakeapi.requests ], [64, 64, 22])
+        self.assertNotIn(threading.current_thread(), fakeapi.threads)
+        self.assertEqual(accessor.cacheStatistics().network_fetches, 3)
+
+        info = accessor.getArxivApiInfo('1305.0042')
+        self.assertIsNone(info['error'])
+        self.assertEqual(info['reference'].title, 'Paper 1305.0042')
+        self.assertIn('Eprint        = {1305.0042v1}', info['bibtex'])
+        self.assertTrue(accessor.getArxivApiInfo('not-an-id')['error'])
+
+    def test_failed_ids_remembered(self):
+        bf, accessor = self._mk_accessor()
+        fakeapi = _FakeArxivApi(unknown=['1305.0007'], omitted=['1305.0009'])
+        with unittest.mock.patch.object(arxivutil, 'arxiv_api_request', fakeapi):
+            accessor.fetchArxivApiInfo(['1305.0001', '1305.0007', '1305.0009'])
+        self.assertTrue(accessor.getArxivApiInfo('1305.0007')['error'])
+        bf.saveCache()
+
+        # known-bad IDs are not retried in the next run, but IDs which were
+        # missing from the response are ...
+        bf2, accessor2 = self._mk_accessor()
+        fakeapi2 = _FakeArxivApi()
+        with unittest.mock.patch.object(arxivutil, 'arxiv_api_request', fakeapi2):
+            accessor2.fetchArxivApiInfo(['1305.0001', '1305.0007', '1305.0008', '1305.0009'])
+        self.assertEqual(fakeapi2.requests, [['1305.0008', '1305.0009']])
+
+        # ... unless the information about the failure has expired
+        old_failed_retry_time = arxivutil.ArxivFetchedAPIInfoCacheAccessor.failed_retry_time
+        arxivutil.ArxivFetchedAPIInfoCacheAccessor.failed_retry_time = datetime.timedelta(0)
+        try:
+            bf3, accessor3 = self._mk_accessor()
+            fakeapi3 = _FakeArxivApi()
+            with unittest.mock.patch.object(arxivutil, 'arxiv_api_request', fakeapi3):
+                accessor3.fetchArxivApiInfo(['1305.0001', '1305.0007'])
+            self.assertEqual(fakeapi3.requests, [['1305.0007']])
+            self.assertIsNone(accessor3.getArxivApiInfo('1305.0007')['error'])
+        finally:
+            arxivutil.ArxivFetchedAPIInfoCacheAccessor.failed_retry_time = old_failed_retry_time
+
+
+
+
+def _mk_snapshot_dump(arxivids):
+    # a synthetic dump in the format of arXiv's JSON-lines metadata snapshot
+    lines = []
+    for aid in arxivids:
+        lines.append(json.dumps({
+            'id': aid,
+            'submitter': 'A. Author',
+            'authors': 'A. Author and B. Ecrivain',
+            'title': 'Paper\n  %s'%(aid),
+            'comments': '10 pages',
+            'journal-ref': 'J. Fake Phys. 1, 1 (2013)' if aid == 'quant-ph/0101001' else None,
+            'doi': None,
+            'categories': 'quant-ph cond-mat.stat-mech',
+            'abstract': '  Abstract of %s\n'%(aid),
+            'versions': [ {'version': 'v1', 'created': 'Mon, 6 May 2013 12:00:00 GMT'},
+                          {'version': 'v2', 'created': 'Tue, 14 May 2013 09:30:00 GMT'} ],
+            'update_date': '2013-05-14',
+            'authors_parsed': [ ['Author', 'A.', ''], ['Ecrivain', 'B.', 'Jr'] ],
+        }))
+    lines.insert(1, '{ not valid json')
+    return io.StringIO("\n".join(lines) + "\n")
+
+
+class TestArxivSnapshot(unittest.TestCase, CustomAssertions):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.snapshot_file = os.path.join(self.tmpdir.name, 'arxiv_snapshot.sqlite')
+        self.arxivids = [ '1305.%04d'%(n) for n in range(3000) ] + ['quant-ph/0101001']
+        snapshot = arxivsnapshot.ArxivSnapshot(self.snapshot_file)
+        self.assertEqual(snapshot.import_jsonl(_mk_snapshot_dump(self.arxivids)), 3001)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookup(self):
+        snapshot = arxivsnapshot.ArxivSnapshot(self.snapshot_file)
+        self.assertEqual(snapshot.num_papers(), 3001)
+
+        found = snapshot.lookup(['1305.0042', '1305.0043v1', '1305.0044v7',
+                                 'quant-ph/0101001v2', '9999.9999'])
+        self.assertEqual(set(found.keys()), {'1305.0042', '1305.0043v1', 'quant-ph/0101001v2'})
+
+        ref = arxiv2bib.Reference(found['1305.0042'])
+        self.assertEqual(ref.id, '1305.0042v2')
+        self.assertEqual(ref.title, 'Paper 1305.0042')
+        self.assertEqual(ref.authors, ['A. Author', 'B. Ecrivain Jr'])
+        self.assertEqual(ref.category, 'quant-ph')
+        self.assertEqual((ref.year, ref.month), ('2013', 'May'))
+        self.assertEqual(ref.updated, '2013-05-14T09:30:00Z')
+        self.assertEqual(arxiv2bib.Reference(found['1305.0043v1']).updated,
+                         '2013-05-06T12:00:00Z')
+        ref = arxiv2bib.Reference(found['quant-ph/0101001v2'])
+        self.assertEqual(ref.bare_id, 'quant-ph/0101001')
+        self.assertEqual(ref.note, 'J. Fake Phys. 1, 1 (2013)')
+
+    def test_fetch_uses_snapshot(self):
+        bf = BibolamaziFile(create=True, use_shared_cache=False)
+        bf.setEntries([])
+        bf.registerFilterInstance(_UseArxivApiFilter())
+        accessor = bf.cacheAccessor(arxivutil.ArxivFetchedAPIInfoCacheAccessor)
+        accessor.arxiv_snapshot_file = self.snapshot_file
+        accessor.api_request_interval = 0
+
+        fakeapi = _FakeArxivApi()
+        with unittest.mock.patch.object(arxivutil, 'arxiv_api_request', fakeapi):
+            self.assertTrue(accessor.fetchArxivApiInfo(self.arxivids + ['1401.0001']))
+
+        # only the ID which isn't in the snapshot was queried on arxiv.org
+        self.assertEqual(fakeapi.requests, [['1401.0001']])
+        self.assertEqual(accessor.cacheStatistics().network_fetches, 1)
+        info = accessor.getArxivApiInfo('1305.2999')
+        self.assertIsNone(info['error'])
+        self.assertIn('Eprint        = {1305.2999v2}', info['bibtex'])
+        self.assertEqual(accessor.getArxivApiInfo('quant-ph/0101001')['reference'].title,
+                         'Paper quant-ph/0101001')
+
+
+_ARXIV_ID_PIECES = [
+    '1305.0042', '1305.00421v2', '0905.1234v11', 'quant-ph/0101001', 'quant-ph/0101001v3',
+    'hep-th/9901001', '0101001', 'math.OA/0512345',
+]
+_ARXIV_PREFIX_PIECES = [
+    '', 'arXiv:', 'arxiv ', 'ArXiv e-print ', 'http://arxiv.org/abs/', 'https://arxiv.org/pdf/',
+    'arxiv.org/abs/', r'\url{https://arxiv.org/abs/', r'\href{http://arxiv.org/abs/', '{arXiv:',
+]
+_ARXIV_SUFFIX_PIECES = [
+    '', '}', ' [quant-ph]', '}{link}', '}{arXiv}', ' ', ';', '.pdf',
+]
+_OTHER_PIECES = [
+    'Phys. Rev. A 84, 012345 (2011)', '10.1103/PhysRevLett.75.1260', 'ISBN 978-3-16-148410-0',
+    'pp. 1234--1256', '1234.567', '12345678', 'Published in Nature', 'see also', ';', ', ',
+    'http://example.com/paper/2011.04', 'arXiv', 'quant-ph', '',
+]
+
+def _mk_arxiv_detect_fields(rnd):
+    def mkvalue():
+        pieces = []
+        for k in range(rnd.randint(1, 3)):
+            if rnd.random() < 0.4:
+                pieces.append(rnd.choice(_ARXIV_PREFIX_PIECES) + rnd.choice(_ARXIV_ID_PIECES) +
+                              rnd.choice(_ARXIV_SUFFIX_PIECES))
+            else:
+                pieces.append(rnd.choice(_OTHER_PIECES))
+        return rnd.choice(['', ' ', ', ']).join(pieces)
+    fields = {}
+    for fld in ('note', 'annote', 'url', 'eprint', 'primaryclass', 'journal'):
+        if rnd.random() < 0.4:
+            fields[fld] = mkvalue() if fld != 'primaryclass' else rnd.choice(['quant-ph', 'cs.IT'])
+    return fields
+
+
+class TestArxivDetect(unittest.TestCase, CustomAssertions):
+
+    def _all_entries(self):
+        rnd = random.Random(1234)
+        entries = [
+            Entry(rnd.choice(['article', 'unpublished', 'misc', 'book']),
+                  fields=_mk_arxiv_detect_fields(rnd))
+            for n in range(3000)
+        ]
+        srcbibdir = os.path.join(os.path.dirname(__file__), 'full_cases', 'srcbib')
+        for fname in sorted(glob.glob(os.path.join(srcbibdir, '*.bib'))):
+            try:
+                entries += list(parse_file(fname).entries.values())
+            except Exception as e:
+                logger.debug("Skipping %s: %s", fname, e)
+        return entries
+
+    def _detect_all(self, entries):
+        return [
+            (arxivutil.detectEntryArXivInfo(e),
+             [ arxivutil.stripArXivInfoInNote(e.fields[fld])
+               for fld in ('note', 'annote', 'url') if fld in e.fields ])
+            for e in entries
+        ]
+
+    def test_prefilter_same_results(self):
+        entries = self._all_entries()
+
+        results = self._detect_all(entries)
+        # check against the full regex cascade, with a prefilter which lets
+        # everything through
+        with unittest.mock.patch.object(arxivutil, '_rx_arxiv_prefilter', re.compile('')):
+            results_noprefilter = self._detect_all(entries)
+
+        self.assertEqual(results, results_noprefilter)
+        # make sure the corpus is meaningful
+        num_detected = len([ 1 for (d, stripped) in results if d is not None ])
+        self.assertGreater(num_detected, 500)
+        self.assertLess(num_detected, len(entries) - 500)
+
+
+if __name__ == '__main__':
+    blogger.setup_simple_console_logging(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import tempfile
+import unittest
+import unittest.mock
+import logging
+
+from bibolamazi.core import blogger
+from helpers import CustomAssertions, IsolatedUserCache
+from bibolamazi.core.bibfilter import BibFilter, BibFilterError
+from bibolamazi.core.bibolamazifile import BibolamaziFile
+from bibolamazi.filters.util import auxfile
+
+logger = logging.getLogger(__name__)
+
+
+class _UseAuxFilter(BibFilter):
+    def __init__(self):
+        super().__init__()
+    def action(self):
+        return BibFilter.BIB_FILTER_BIBOLAMAZIFILE
+    def requested_cache_accessors(self):
+        return [auxfile.AuxCitationIndexCacheAccessor]
+    def filter_bibolamazifile(self, bibolamazifile):
+        pass
+
+
+_BIBOLAMAZIFILE_CONTENTS = r"""
+%%%-BIB-OLA-MAZI-BEGIN-%%%
+%
+%%%-BIB-OLA-MAZI-END-%%%
+"""
+
+_MAIN_AUX = r"""\relax
+\citation{Einstein1935,Bell1964}
+\@input{chap1.aux}
+\abx@aux@cite{Aspect1982}
+\@input{missing.aux}
+"""
+
+_CHAP1_AUX = r"""\relax
+\citation{Bennett1993}
+\citation{Einstein1935}
+"""
+
+
+class TestAuxCitationIndex(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(os.path.join(self.tmpdir.name, 'shared'))
+        self.fname = os.path.join(self.tmpdir.name, 'test.bibolamazi.bib')
+        with open(self.fname, 'w') as f:
+            f.write(_BIBOLAMAZIFILE_CONTENTS)
+        self._write('test.aux', _MAIN_AUX)
+        self._write('chap1.aux', _CHAP1_AUX)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, name, contents):
+        with open(os.path.join(self.tmpdir.name, name), 'w') as f:
+            f.write(contents)
+
+    def _mk_bibolamazifile(self, with_accessor=True):
+        bf = BibolamaziFile(self.fname)
+        if with_accessor:
+            bf.registerFilterInstance(_UseAuxFilter())
+        return bf
+
+    def _get_citations(self, bf):
+        cited = []
+        citations = auxfile.get_all_auxfile_citations('test', bf, 'test', callback=cited.append)
+        return (citations, cited)
+
+    def test_citations(self):
+        for with_accessor in (False, True):
+            bf = self._mk_bibolamazifile(with_accessor=with_accessor)
+            (citations, cited) = self._get_citations(bf)
+            self.assertEqual(cited, ['Einstein1935', 'Bell1964', 'Bennett1993', 'Einstein1935',
+                                     'Aspect1982'])
+            self.assertEqual(citations, {'Einstein1935', 'Bell1964', 'Bennett1993', 'Aspect1982'})
+
+        with self.assertRaises(BibFilterError):
+            auxfile.get_all_auxfile_citations('doesnotexist', bf, 'test')
+
+    def test_read_once(self):
+        with unittest.mock.patch.object(auxfile, 'parse_auxfile',
+                                        wraps=auxfile.parse_auxfile) as parse_mock:
+            bf = self._mk_bibolamazifile()
+            self._get_citations(bf)
+            self._get_citations(bf)
+            self.assertEqual(parse_mock.call_count, 2)
+            bf.saveCache()
+
+            # the aux files didn't change, they are not read again in the next run
+            bf2 = self._mk_bibolamazifile()
+            (citations, cited) = self._get_citations(bf2)
+            self.assertEqual(parse_mock.call_count, 2)
+            self.assertEqual(citations, {'Einstein1935', 'Bell1964', 'Bennett1993', 'Aspect1982'})
+            bf2.saveCache()
+
+            # only the aux file which changed is read again
+            self._write('chap1.aux', _CHAP1_AUX + "\\citation{Wootters1982}\n")
+            bf3 = self._mk_bibolamazifile()
+            (citations, cited) = self._get_citations(bf3)
+            self.assertEqual(parse_mock.call_count, 3)
+            self.assertEqual(cited[-2:], ['Wootters1982', 'Aspect1982'])
+
+    def test_recursive_input(self):
+        self._write('chap1.aux', _CHAP1_AUX + "\\@input{test.aux}\n")
+        bf = self._mk_bibolamazifile()
+        (citations, cited) = self._get_citations(bf)
+        self.assertEqual(citations, {'Einstein1935', 'Bell1964', 'Bennett1993', 'Aspect1982'})
+
+
+if __name__ == '__main__':
+    blogger.setup_simple_console_logging(level=logging.DEBUG)
+    unittest.main()
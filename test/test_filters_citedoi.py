@@ -6,24 +6,36 @@ import tempfile
 import os.path
 import re
 import shutil
+import time
+import threading
+import http.server
 
 from pybtex.database import Entry, Person, BibliographyData
 
 from bibolamazi.core import blogger
-from helpers import CustomAssertions
+from helpers import CustomAssertions, IsolatedUserCache
 from bibolamazi.filters.citedoi import (CiteDoiFilter, DoiOrgFetchedInfoCacheAccessor)
 from bibolamazi.core.bibolamazifile import BibolamaziFile
+from bibolamazi.core import transport
+from bibolamazi.core import ratelimit
 
 logger = logging.getLogger(__name__)
 
 
-class TestWorks(unittest.TestCase, CustomAssertions):
+class TestWorks(unittest.TestCase, CustomAssertions, IsolatedUserCache):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.maxDiff = None
 
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
     def test_fetch_basic_noprefix(self):
 
         bf = BibolamaziFile(create=True)
@@ -106,6 +118,113 @@ class TestWorks(unittest.TestCase, CustomAssertions):
 
 
 
+class _FakeDoiOrgHandler(http.server.BaseHTTPRequestHandler):
+    # mimics doi.org's content negotiation for a few fake DOIs
+
+    def do_GET(self):
+        server = self.server
+        doi = self.path.lstrip('/')
+        with server.lock:
+            server.num_active += 1
+            server.max_active = max(server.max_active, server.num_active)
+            server.requests.append(doi)
+            num_requests_for_doi = server.requests.count(doi)
+        try:
+            time.sleep(0.05)
+            if doi == '10.9999/busy' and num_requests_for_doi == 1:
+                self._respond(429, 'slow down', headers={'Retry-After': '1'})
+            elif not doi.startswith('10.9999/test'):
+                self._respond(404, 'DOI not found')
+            elif 'application/x-bibtex' not in self.headers.get('Accept', ''):
+                self._respond(200, '<html>landing page</html>')
+            else:
+                self._respond(200, " @article{%s, title={Paper %s}, year={2020}}"%(doi, doi))
+        finally:
+            with server.lock:
+                server.num_active -= 1
+
+    def _respond(self, code, body, headers={}):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConcurrentFetch(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.tmpdir.name)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FakeDoiOrgHandler)
+        self.server.lock = threading.Lock()
+        self.server.num_active = 0
+        self.server.max_active = 0
+        self.server.requests = []
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self):
+        ratelimit.set_rate_limit('127.0.0.1:%d'%(self.server.server_address[1]), None)
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def _mk_accessor(self):
+        bf = BibolamaziFile(create=True, use_shared_cache=False)
+        bf.setEntries([])
+        filt = CiteDoiFilter(jobname='testjobname')
+        bf.registerFilterInstance(filt)
+        accessor = bf.cacheAccessor(DoiOrgFetchedInfoCacheAccessor)
+        accessor.doi_base_url = 'http://127.0.0.1:%d/'%(self.server.server_address[1])
+        accessor.min_request_interval = 0
+        accessor.retry_delay = 0.01
+        return accessor
+
+    def test_fetch_concurrently(self):
+        accessor = self._mk_accessor()
+
+        dois = [ '10.9999/test.%d'%(n) for n in range(20) ]
+        accessor.fetchDoiInfo(dois + ['10.9999/test.3', '10.9999/busy', '10.9999/unknown'])
+
+        for doi in dois:
+            self.assertIn('title={Paper %s}'%(doi), accessor.getDoiInfo(doi)['bibtex'])
+        self.assertGreater(self.server.max_active, 1)
+        self.assertLessEqual(self.server.max_active, accessor.max_concurrent_requests)
+        # each DOI was requested once
+        self.assertEqual(self.server.requests.count('10.9999/test.3'), 1)
+        # the server asked us to come back later
+        self.assertEqual(self.server.requests.count('10.9999/busy'), 2)
+        self.assertEqual(accessor.cacheStatistics().network_fetches, 23)
+
+        # nothing is fetched again
+        accessor.fetchDoiInfo(dois)
+        self.assertEqual(len(self.server.requests), 23)
+
+    def test_deadline(self):
+        accessor = self._mk_accessor()
+
+        dois = [ '10.9999/test.%d'%(n) for n in range(80) ]
+        transport.set_deadline(0.2)
+        try:
+            with self.assertLogs('bibolamazi.filters.citedoi', level='WARNING') as cm:
+                self.assertFalse(accessor.fetchDoiInfo(dois))
+        finally:
+            transport.set_deadline(None)
+
+        # we stopped fetching, and reported the DOIs we didn't get
+        not_fetched = [ doi for doi in dois if 'bibtex' not in accessor.getDoiInfo(doi) ]
+        self.assertTrue(not_fetched)
+        self.assertLess(len(self.server.requests), len(dois))
+        self.assertIn("Network deadline exceeded", cm.output[0])
+        self.assertIn(not_fetched[-1], cm.output[0])
+
+
 
 if __name__ == '__main__':
     blogger.setup_simple_console_logging(level=logging.DEBUG)
@@ -6,13 +6,18 @@ import tempfile
 import os.path
 import re
 import shutil
+import threading
+import http.server
+from urllib.parse import urlsplit, parse_qs
 
 from pybtex.database import Entry, Person, BibliographyData
 
 from bibolamazi.core import blogger
-from helpers import CustomAssertions
-from bibolamazi.filters.citeinspirehep import CiteInspireHEPFilter
+from helpers import CustomAssertions, IsolatedUserCache
+from bibolamazi.filters.citeinspirehep import (CiteInspireHEPFilter,
+                                               InspireHEPFetchedAPIInfoCacheAccessor)
 from bibolamazi.core.bibolamazifile import BibolamaziFile
+from bibolamazi.core import ratelimit
 
 logger = logging.getLogger(__name__)
 
@@ -83,6 +88,94 @@ class TestWorks(unittest.TestCase, CustomAssertions):
 
 
 
+_FAKE_INSPIRE_RECORDS = [
+    ('Einstein:1935rr', '10.1103/PhysRev.47.777', None, 'Phys.Rev.,47,777'),
+    ('Faist:2013ija', '10.1103/PhysRevD.88.012005', '1305.1258', None),
+    ('Maldacena:1997re', '10.1023/A:1026654312961', 'hep-th/9711200', None),
+    ('Hagiwara:2002fs', None, None, None),
+]
+
+class _FakeInspireHandler(http.server.BaseHTTPRequestHandler):
+    # mimics the InspireHEP literature search API, for a few records
+
+    def do_GET(self):
+        q = parse_qs(urlsplit(self.path).query)['q'][0]
+        self.server.queries.append(q)
+        results = []
+        for term in q.split(' or '):
+            ref_type, value = term.split(':', 1)
+            value = value.strip('"')
+            for (texkey, doi, eprint, journal) in _FAKE_INSPIRE_RECORDS:
+                if { 'texkey': texkey, 'doi': doi, 'eprint': eprint, 'j': journal }[ref_type] == value:
+                    fields = [ 'title = "Paper {}"'.format(texkey) ]
+                    if doi:
+                        fields.append('doi = "{}"'.format(doi))
+                    if eprint:
+                        fields.append('eprint = "{}"'.format(eprint))
+                    results.append("@article{%s,\n    %s\n}\n"%(texkey, ",\n    ".join(fields)))
+        body = "\n".join(results).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBatchedFetch(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.tmpdir.name)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FakeInspireHandler)
+        self.server.queries = []
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self):
+        ratelimit.set_rate_limit('127.0.0.1:%d'%(self.server.server_address[1]), None)
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def test_batched_queries(self):
+        bf = BibolamaziFile(create=True, use_shared_cache=False)
+        bf.setEntries([])
+        filt = CiteInspireHEPFilter(jobname='testjobname')
+        bf.registerFilterInstance(filt)
+        accessor = bf.cacheAccessor(InspireHEPFetchedAPIInfoCacheAccessor)
+        accessor.api_url = 'http://127.0.0.1:%d/api/literature'%(self.server.server_address[1])
+
+        userkeys = [
+            'inspire:Einstein:1935rr',
+            'inspire:1305.1258--WWgg',
+            'inspire:10.1023/a:1026654312961',
+            'inspire:hep-th/9711200',
+            'inspire:Phys.Rev.+47+777',
+            'inspire:Hagiwara:2002fs',
+            'inspire:Unknown:2020xyz',
+        ]
+        keys = [ accessor.parse_and_store_key(k) for k in userkeys ]
+        accessor.fetchInspireHEPApiInfo(keys)
+
+        # one batched query for the first 4 keys and the last two; individual
+        # queries for the journal reference and for the unknown texkey
+        self.assertEqual(len(self.server.queries), 3)
+        self.assertEqual(self.server.queries[1:], ['j:Phys.Rev.,47,777', 'texkey:"Unknown:2020xyz"'])
+
+        for (key, texkey) in [ ('Einstein:1935rr', 'Einstein:1935rr'),
+                               ('1305.1258', 'Faist:2013ija'),
+                               ('10.1023/a:1026654312961', 'Maldacena:1997re'),
+                               ('hep-th/9711200', 'Maldacena:1997re'),
+                               ('Phys.Rev.+47+777', 'Einstein:1935rr'),
+                               ('Hagiwara:2002fs', 'Hagiwara:2002fs') ]:
+            bibtex = accessor.getInspireHEPInfo(key)['bibtex']
+            self.assertIn('Paper ' + texkey, bibtex)
+            self.assertEqual(bibtex.count('@'), 1)
+        self.assertEqual(accessor.getInspireHEPInfo('Unknown:2020xyz')['bibtex'].strip(), '')
+
+
 
 if __name__ == '__main__':
     blogger.setup_simple_console_logging(level=logging.DEBUG)
@@ -1,27 +1,40 @@
 # -*- coding: utf-8 -*-
 
+import os.path
+import random
+import tempfile
 import unittest
+import unittest.mock
 import logging
 
 from pybtex.database import Entry, Person, BibliographyData
 
 from bibolamazi.core import blogger
-from helpers import CustomAssertions
+from bibolamazi.core import transport
+from helpers import CustomAssertions, IsolatedUserCache
 from bibolamazi.filters.util import arxivutil
 from bibolamazi.filters.duplicates import (DuplicatesFilter, DuplicatesEntryInfoCacheAccessor,
+                                           DuplicateCandidatesIndex,
                                            normstr, getlast, fmtjournal)
 from bibolamazi.core.bibolamazifile import BibolamaziFile
 
 logger = logging.getLogger(__name__)
 
 
-class TestWorks(unittest.TestCase, CustomAssertions):
+class TestWorks(unittest.TestCase, CustomAssertions, IsolatedUserCache):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.maxDiff = None
 
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
     def test_dupli_basic(self):
 
         entries = self.get_entries_set()
@@ -1215,6 +1228,206 @@ class TestWorks(unittest.TestCase, CustomAssertions):
 
 
 
+_SURNAMES = ['Renner', 'Aberg', 'Dahlsten', 'Vedral', 'Faist', 'Wehner', 'Brandao',
+             'Oppenheim', 'Horodecki', 'Winter', 'Hayden', 'Preskill']
+_TITLE_WORDS = ['quantum', 'thermodynamic', 'entropy', 'work', 'resource', 'theory',
+                'single-shot', 'channels', 'coherence', 'locality', 'information']
+
+
+def _mk_synthetic_entries(seed):
+    # a bibliography with many duplicates, typos in author names, missing
+    # titles, shared DOIs and arXiv IDs and entries flagged with x-no-duplicate
+    rnd = random.Random(seed)
+    papers = []
+    for n in range(40):
+        authors = rnd.sample(_SURNAMES, rnd.randint(1, 3))
+        fields = {
+            'title': " ".join(rnd.sample(_TITLE_WORDS, 4)).capitalize(),
+            'journal': rnd.choice(['Phys. Rev. Lett.', 'Nature', 'New J. Phys.']),
+            'year': str(rnd.choice([2011, 2012, 2013])),
+        }
+        if rnd.random() < 0.5:
+            fields['doi'] = '10.1000/paper.%d'%(rnd.randint(0, 30))
+        if rnd.random() < 0.5:
+            fields['eprint'] = '1305.%04d'%(rnd.randint(0, 30))
+            fields['archiveprefix'] = 'arXiv'
+        papers.append((authors, fields))
+
+    entries = []
+    for n in range(160):
+        (authors, fields) = rnd.choice(papers)
+        authors = list(authors)
+        fields = dict(fields)
+        r = rnd.random()
+        if r < 0.15:
+            del fields['title']
+        elif r < 0.25:
+            fields['title'] = fields['title'] + ' revisited'
+        elif r < 0.35:
+            i = rnd.randrange(len(authors))
+            authors[i] = authors[i][:-1] + 'x'
+        elif r < 0.40:
+            del fields['year']
+        elif r < 0.45:
+            fields['keywords'] = 'x-no-duplicate'
+        if rnd.random() < 0.3:
+            fields.pop('doi', None)
+        entries.append(('e%03d'%(n),
+                        Entry('article', persons={'author': [ Person(a+', A.') for a in authors ]},
+                              fields=fields)))
+
+    used = set([ k for (k, e) in entries if rnd.random() < 0.3 ])
+    return entries, used
+
+
+def _all_candidates(index, key, entry):
+    # brute force: every indexed entry is a candidate, in the original order
+    return [ (k, e) for (seqno, k, e, blocks)
+             in sorted(index._entries.values(), key=lambda x: x[0]) ]
+
+
+class TestCandidatesIndex(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(os.path.join(self.tmpdir.name, 'shared'))
+        # don't query arxiv.org for the synthetic arXiv IDs
+        transport.set_offline(True)
+
+    def tearDown(self):
+        transport.set_offline(False)
+        self.tmpdir.cleanup()
+
+    def _run_filter(self, entries, used, fname=None, **kwargs):
+        if fname is None:
+            bf = BibolamaziFile(create=True)
+            bf.setEntries(entries)
+        else:
+            # run on an actual file, so that the cache is saved and reused
+            srcfname = fname[:-len('.bibolamazi.bib')] + '-src.bib'
+            BibliographyData(entries=entries).to_file(srcfname, 'bibtex')
+            with open(fname, 'w') as f:
+                f.write("%%%-BIB-OLA-MAZI-BEGIN-%%%\n% src: {}\n%%%-BIB-OLA-MAZI-END-%%%\n"
+                        .format(os.path.basename(srcfname)))
+            bf = BibolamaziFile(fname)
+
+        filt = DuplicatesFilter(merge_duplicates=True, dupfile='xxxdupfilexxx',
+                                keep_only_used=(used is not None), **kwargs)
+        class _Store: pass
+        register_ns = _Store()
+        filt._get_used_citations = lambda b, u=used: u
+        filt._write_to_dupfile = lambda b, a, ns=register_ns: setattr(ns, 'aliases', a)
+        bf.registerFilterInstance(filt)
+
+        num_compared = [0]
+        self.num_compared_different = 0
+        orig_compare_entries = filt.compare_entries
+        def compare_entries(*args, **kwargs):
+            num_compared[0] += 1
+            same, reason = orig_compare_entries(*args, **kwargs)
+            if not same:
+                self.num_compared_different += 1
+            return same, reason
+        filt.compare_entries = compare_entries
+
+        filt.filter_bibolamazifile(bf)
+
+        if fname is not None:
+            bf.saveCache()
+
+        aliases = sorted([ (a.aliaskey, a.origkey) for a in register_ns.aliases.aliases ])
+        return list(bf.bibliographyData().entries.items()), aliases, num_compared[0]
+
+    def test_same_as_brute_force(self):
+        for seed in (1, 2, 3):
+            for keep_only_used in (False, True):
+                entries, used = _mk_synthetic_entries(seed)
+                if not keep_only_used:
+                    used = None
+                result, aliases, num_compared = self._run_filter(entries, used)
+
+                entries, used2 = _mk_synthetic_entries(seed)
+                with unittest.mock.patch.object(DuplicateCandidatesIndex, 'candidates',
+                                                _all_candidates):
+                    result_bf, aliases_bf, num_compared_bf = \
+                        self._run_filter(entries, used)
+
+                self.assertGreater(len(aliases), 10)
+                self.assertEqual(aliases, aliases_bf)
+                self.assert_keyentrylists_equal(result, result_bf)
+                self.assertLess(num_compared, num_compared_bf / 2)
+
+    def test_parallel(self):
+        for keep_only_used in (False, True):
+            entries, used = _mk_synthetic_entries(5)
+            if not keep_only_used:
+                used = None
+            result, aliases, num_compared = self._run_filter(entries, used, processes=1)
+            num_compared_different = self.num_compared_different
+
+            entries, used2 = _mk_synthetic_entries(5)
+            with unittest.mock.patch.object(DuplicatesFilter, 'parallel_min_pairs', 0):
+                result_p, aliases_p, num_compared_p = self._run_filter(entries, used,
+                                                                       processes=2)
+
+            self.assertEqual(aliases_p, aliases)
+            self.assert_keyentrylists_equal(result_p, result)
+            # entries which don't change are only compared in the main process if
+            # they are duplicates
+            self.assertLess(self.num_compared_different, num_compared_different)
+            self.assertLess(num_compared_p, num_compared)
+
+    def test_cached_non_duplicates_order(self):
+        # the tolerance for typos depends on the length of the name in the
+        # entry that comes later, so whether these are duplicates depends on
+        # the order of the entries
+        def mk_entries(reverse):
+            entries = [
+                (key, Entry('article', persons={'author': [Person(name + ', A.')]}, fields={
+                    'title': 'Thermodynamic work', 'journal': 'Nature', 'year': '2013',
+                }))
+                for (key, name) in [ ('wehner', 'Wehner'), ('wehnerrr', 'Wehnerrr') ]
+            ]
+            return entries[::-1] if reverse else entries
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.bibolamazi.bib')
+            for reverse in (False, True, False):
+                result, aliases, num_compared = self._run_filter(mk_entries(reverse), None,
+                                                                 fname=fname)
+                self.assertEqual(len(aliases), 0 if reverse else 1)
+
+    def test_cached_non_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.bibolamazi.bib')
+            fname_nc = os.path.join(tmpdir, 'nocache.bibolamazi.bib')
+
+            entries, used = _mk_synthetic_entries(4)
+            result, aliases, num_compared = self._run_filter(entries, used, fname=fname)
+
+            # when running again, only the entries which are duplicates are
+            # compared again
+            entries, used = _mk_synthetic_entries(4)
+            result2, aliases2, num_compared2 = self._run_filter(entries, used, fname=fname)
+            self.assertEqual(aliases2, aliases)
+            self.assert_keyentrylists_equal(result2, result)
+            self.assertEqual(self.num_compared_different, 0)
+            self.assertLess(num_compared2, num_compared / 2)
+
+            # modified entries are compared again
+            entries, used = _mk_synthetic_entries(4)
+            entries[100][1].fields['title'] = 'A completely different title'
+            result3, aliases3, num_compared3 = self._run_filter(entries, used, fname=fname)
+            entries, used = _mk_synthetic_entries(4)
+            entries[100][1].fields['title'] = 'A completely different title'
+            result_nc, aliases_nc, num_compared_nc = self._run_filter(entries, used,
+                                                                      fname=fname_nc)
+            self.assertEqual(aliases3, aliases_nc)
+            self.assert_keyentrylists_equal(result3, result_nc)
+            self.assertGreater(num_compared3, num_compared2)
+            self.assertLess(num_compared3, num_compared_nc / 2)
+
+
 if __name__ == '__main__':
     blogger.setup_simple_console_logging(level=logging.DEBUG)
     unittest.main()
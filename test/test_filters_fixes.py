@@ -7,10 +7,12 @@ import unittest
 
 import bibolamazi.init
 from bibolamazi.core import blogger
+from bibolamazi.core import butils
 
 from helpers import CustomAssertions
 from pybtex.database import Entry, Person
 from bibolamazi.core.bibfilter.argtypes import CommaStrList
+from bibolamazi.filters import fixes
 from bibolamazi.filters.fixes import FixesFilter
 
 class TestWorks(unittest.TestCase, CustomAssertions):
@@ -1289,6 +1291,49 @@ class TestWorks(unittest.TestCase, CustomAssertions):
 
 
 
+    def test_protect_names_order(self):
+
+        # names are protected one after the other, in the order they are given
+        filt = FixesFilter(protect_names=['computer science', 'quantum computer', 'i.i.d.'])
+
+        e = Entry("article", fields={
+            "title": "Quantum computer science with {Quantum Computer} and i.i.d. states",
+            "abstract": "Nothing to protect here",
+            "url": "http://example.com/quantum-computer-science",
+        })
+        e.key = 'test'
+        filt.filter_bibentry(e)
+
+        self.assertEqual(e.fields["title"],
+                         "Quantum {computer science} with {Quantum Computer} and {i.i.d.} states")
+        self.assertEqual(e.fields["abstract"], "Nothing to protect here")
+        self.assertEqual(e.fields["url"], "http://example.com/quantum-computer-science")
+
+    def test_memoized_conversions(self):
+
+        strings = [
+            "Physical Review Letters", "Phys. Rev. A 84, 1--5 (2011)", "  a\n\n b ",
+            "Taylor & Francis", "100% sure", "C# and ``quotes''", "x~y", "Caf\u00e9",
+            r"Caf\'e", r"$\alpha$-decay", "{DNA} folding", r"\emph{x}", "#1", "a^b_c <x>",
+            "\u00c9cole Normale Sup\u00e9rieure", "Erd\u0151s", "E\u0301cole",
+        ]
+
+        conversions = [
+            (butils._memoized_latex_to_text,
+             lambda x: butils._l2t.latex_to_text(x, tolerant_parsing=True)),
+            (fixes._memoized_custom_uni_to_latex, fixes._custom_uni_to_latex),
+        ]
+        for memoized, fn in conversions:
+            memoized.clear()
+            for s in strings + strings:
+                self.assertEqual(memoized(s), fn(s))
+            stats = memoized.statistics()
+            self.assertGreater(stats.passthrough, 0)
+            self.assertEqual(stats.hits, stats.misses)
+            self.assertEqual(stats.passthrough + stats.hits + stats.misses, 2*len(strings))
+            self.assertIs(butils.conversion_statistics()[memoized.name].__class__,
+                          butils.ConversionStatistics)
+
     def test_unprotect_zotero_title_case(self):
 
         filt = FixesFilter(unprotect_zotero_title_case=True)
@@ -55,6 +55,25 @@ class TestWorks(unittest.TestCase):
         self.assertEqual(unicodestr(entry.persons['author'][7]), 'Dupuis, F.')
         self.assertEqual(unicodestr(entry.persons['author'][8]), 'Brand\N{LATIN SMALL LETTER A WITH TILDE}o, F.')
 
+    def test_repeated_names(self):
+        n = NameInitialsFilter()
+        unchanged = Person('Rosen, N.')
+        entries = [
+            Entry('article', persons={'author': [Person('Albert Einstein'), unchanged]})
+            for k in range(3)
+        ]
+        for entry in entries:
+            n.filter_bibentry(entry)
+
+        einsteins = [ entry.persons['author'][0] for entry in entries ]
+        self.assertEqual([ unicodestr(p) for p in einsteins ], ['Einstein, A.']*3)
+        # each entry gets its own person object
+        self.assertEqual(len(set(id(p) for p in einsteins)), 3)
+        self.assertIs(entries[0].persons['author'][1], unchanged)
+
+        stats = n._person_conversion.statistics()
+        self.assertEqual((stats.hits, stats.misses), (4, 2))
+
 
 if __name__ == '__main__':
     from bibolamazi.core import blogger
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+import logging
+
+from bibolamazi.core import blogger
+from helpers import CustomAssertions
+from bibolamazi.filters.util import strdistance
+
+logger = logging.getLogger(__name__)
+
+
+class TestBoundedLevenshtein(unittest.TestCase, CustomAssertions):
+
+    def tearDown(self):
+        strdistance.set_backend('rapidfuzz' if 'rapidfuzz' in strdistance.available_backends()
+                                else 'python')
+
+    def test_levenshtein(self):
+        self.assertEqual(strdistance.levenshtein('koenig', 'konig'), 1)
+        self.assertEqual(strdistance.levenshtein('kitten', 'sitting'), 3)
+        self.assertEqual(strdistance.levenshtein('', 'abc'), 3)
+
+    def test_same_as_levenshtein(self):
+        rnd = random.Random(42)
+        pairs = [ ('', ''), ('', 'ab'), ('a', ''), ('renner', 'renner'),
+                  ('koenig', 'konig'), ('aberg', 'berg'), ('pnas', 'pnasusa') ]
+        for n in range(2000):
+            a = "".join(rnd.choice('abcde') for k in range(rnd.randint(0, 12)))
+            b = list(a)
+            for k in range(rnd.randint(0, 4)):
+                op = rnd.randint(0, 2)
+                pos = rnd.randint(0, len(b))
+                if op == 0:
+                    b.insert(pos, rnd.choice('abcde'))
+                elif b and op == 1:
+                    del b[min(pos, len(b)-1)]
+                elif b:
+                    b[min(pos, len(b)-1)] = rnd.choice('abcde')
+            pairs.append( (a, "".join(b)) )
+
+        for backend in strdistance.available_backends():
+            strdistance.set_backend(backend)
+            for (a, b) in pairs:
+                d = strdistance.levenshtein(a, b)
+                for max_dist in range(0, 5):
+                    self.assertEqual(strdistance.bounded_levenshtein(a, b, max_dist),
+                                     d if d <= max_dist else max_dist+1,
+                                     msg="{}: {!r} vs {!r}, max_dist={}"
+                                     .format(backend, a, b, max_dist))
+
+    def test_memo(self):
+        memo = strdistance.BoundedDistanceMemo()
+        self.assertEqual(memo('renner', 'rener', 1), 1)
+        self.assertEqual(memo('rener', 'renner', 1), 1)
+        self.assertEqual(memo('renner', 'renner', 1), 0)
+        self.assertEqual(memo('renner', 'wehner', 1), 2)
+        self.assertEqual((memo.num_calls, memo.num_computed), (4, 2))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            strdistance.set_backend('no-such-backend')
+        self.assertIn(strdistance.backend(), strdistance.available_backends())
+
+
+
+if __name__ == '__main__':
+    blogger.setup_simple_console_logging(level=logging.DEBUG)
+    unittest.main()
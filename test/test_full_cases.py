@@ -78,6 +78,9 @@ class FullCaseTester:
                     shutil.copyfile(os.path.join(full_cases_dir, name + auxfext),
                                     os.path.join(tmpdir, name + auxfext))
 
+            # keep the shared cache and the rate limit state out of the user's cache dir
+            self.isolate_user_cache(os.path.join(tmpdir, '_shared_cache'))
+
             time.sleep(0.5)
             
             bfile = BibolamaziFile(tmpbib)
@@ -101,7 +104,8 @@ class FullCaseTester:
 
 
 
-class TestFullCases(unittest.TestCase, FullCaseTester, helpers.CustomAssertions):
+class TestFullCases(unittest.TestCase, FullCaseTester, helpers.CustomAssertions,
+                    helpers.IsolatedUserCache):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import time
+import tempfile
+import multiprocessing
+import unittest
+import unittest.mock
+import logging
+
+from bibolamazi.core import blogger
+from helpers import CustomAssertions, IsolatedUserCache
+from bibolamazi.core import ratelimit
+
+logger = logging.getLogger(__name__)
+
+
+def _rate_limited_worker(state_file, num_requests, timestamps):
+    ratelimit.set_state_file(state_file)
+    ratelimit.set_rate_limit('example.org', 20, burst=2)
+    for n in range(num_requests):
+        ratelimit.acquire('example.org')
+        timestamps.put(time.time())
+
+
+class TestRateLimit(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.tmpdir.name)
+
+    def tearDown(self):
+        ratelimit.set_rate_limit('example.org', None)
+        self.tmpdir.cleanup()
+
+    def test_token_bucket(self):
+        ratelimit.set_rate_limit('example.org', 10, burst=3)
+        self.assertEqual(ratelimit.rate_limit('example.org'), (10.0, 3))
+
+        t0 = time.monotonic()
+        waited = [ ratelimit.acquire('example.org') for n in range(5) ]
+        dt = time.monotonic() - t0
+
+        # the first three requests are a burst, then one request every 0.1s
+        self.assertEqual(waited[:3], [0, 0, 0])
+        self.assertGreater(waited[3], 0.05)
+        self.assertGreater(dt, 0.15)
+        self.assertEqual(ratelimit.acquire('not-limited.example.org'), 0)
+
+        stats = ratelimit.statistics()['example.org']
+        self.assertEqual((stats.requests, stats.waits), (5, 2))
+        self.assertAlmostEqual(stats.wait_time, sum(waited))
+        self.assertNotIn('not-limited.example.org', ratelimit.statistics())
+
+    def test_max_wait(self):
+        ratelimit.set_rate_limit('slow.example.org', 1, burst=1)
+        self.addCleanup(ratelimit.set_rate_limit, 'slow.example.org', None)
+        self.assertEqual(ratelimit.acquire('slow.example.org', max_wait=0.5), 0)
+
+        t0 = time.monotonic()
+        self.assertIsNone(ratelimit.acquire('slow.example.org', max_wait=0.5))
+        self.assertLess(time.monotonic() - t0, 0.5)
+        self.assertEqual(ratelimit.statistics()['slow.example.org'].requests, 1)
+
+        # the failed attempt didn't use up any budget
+        waited = ratelimit.acquire('slow.example.org', max_wait=2)
+        self.assertGreater(waited, 0.5)
+        self.assertLessEqual(waited, 1)
+
+    def test_shared_between_processes(self):
+        num_workers = 3
+        num_requests = 5
+
+        timestamps = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=_rate_limited_worker,
+                                    args=(ratelimit.state_file_name(), num_requests, timestamps))
+            for w in range(num_workers)
+        ]
+        for p in procs:
+            p.start()
+        times = sorted([ timestamps.get(timeout=30) for n in range(num_workers*num_requests) ])
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        # all processes share a budget of 20 requests/second (after the initial
+        # burst of 2), a single process alone would be done after 0.15 seconds
+        self.assertGreater(times[-1] - times[0], (num_workers*num_requests - 2)/20.0 - 0.05)
+
+    def test_state_file_location(self):
+        ratelimit.set_state_file(None)
+        shared_dir = os.path.join(self.tmpdir.name, 'shared')
+        with unittest.mock.patch.dict(os.environ, {'BIBOLAMAZI_SHARED_CACHE_DIR': shared_dir}):
+            self.assertEqual(ratelimit.state_file_name(), os.path.join(shared_dir, 'ratelimit.json'))
+
+
+
+if __name__ == '__main__':
+    blogger.setup_simple_console_logging(level=logging.DEBUG)
+    unittest.main()
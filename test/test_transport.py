@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import unittest
+import tempfile
+import threading
+import http.server
+import logging
+
+from bibolamazi.core import blogger
+from helpers import CustomAssertions, IsolatedUserCache
+from bibolamazi.core import transport
+from bibolamazi.core import ratelimit
+from bibolamazi.core.bibolamazifile import BibolamaziFile
+
+logger = logging.getLogger(__name__)
+
+
+class _FakeHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path == '/slow':
+            time.sleep(2)
+        body = "path={} accept={}".format(self.path, self.headers.get('Accept', '')).encode('utf-8')
+        self.send_response(200 if self.path != '/missing' else 404)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("fake server: " + format, *args)
+
+
+class TestTransport(unittest.TestCase, CustomAssertions, IsolatedUserCache):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.shareddir = tempfile.TemporaryDirectory()
+        self.isolate_user_cache(self.shareddir.name)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FakeHandler)
+        self.server.requests = []
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.base_url = 'http://127.0.0.1:%d'%(self.server.server_address[1])
+
+    def tearDown(self):
+        transport.set_offline(False)
+        transport.set_deadline(None)
+        transport.set_default_timeout(None)
+        transport.set_record_dir(None)
+        transport.set_replay_dir(None)
+        transport.close_session()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+        self.shareddir.cleanup()
+
+    def test_get(self):
+        r = transport.get(self.base_url + '/a', params={'q': 'x y'}, headers={'Accept': 'text/plain'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.text, "path=/a?q=x+y accept=text/plain")
+        self.assertTrue(transport.get_session().headers['User-Agent'].startswith('bibolamazi/'))
+
+    def test_offline(self):
+        transport.set_offline(True)
+        with self.assertRaises(transport.OfflineError):
+            transport.get(self.base_url + '/a')
+        self.assertEqual(self.server.requests, [])
+
+    def test_deadline(self):
+        transport.set_deadline(0.5)
+        self.assertEqual(transport.get(self.base_url + '/a').status_code, 200)
+
+        # a request which would last beyond the deadline is interrupted
+        t0 = time.monotonic()
+        with self.assertRaises(transport.DeadlineExceededError):
+            transport.get(self.base_url + '/slow')
+        self.assertLess(time.monotonic() - t0, 1.5)
+        self.assertEqual(transport.time_remaining(), 0)
+
+        # no more requests are issued after the deadline
+        with self.assertRaises(transport.DeadlineExceededError):
+            transport.get(self.base_url + '/b')
+        self.assertEqual(self.server.requests, ['/a', '/slow'])
+
+    def test_deadline_rate_limit(self):
+        host = self.base_url[len('http://'):]
+        ratelimit.set_rate_limit(host, 0.5)
+        self.addCleanup(ratelimit.set_rate_limit, host, None)
+        transport.set_deadline(1)
+        self.assertEqual(transport.get(self.base_url + '/a').status_code, 200)
+
+        # we don't wait for the rate limit if the deadline would pass meanwhile
+        t0 = time.monotonic()
+        with self.assertRaises(transport.DeadlineExceededError):
+            transport.get(self.base_url + '/b')
+        self.assertLess(time.monotonic() - t0, 0.5)
+        self.assertEqual(self.server.requests, ['/a'])
+
+    def test_default_timeout(self):
+        transport.set_default_timeout(0.2)
+        with self.assertRaises(transport.TransportError):
+            transport.get(self.base_url + '/slow')
+        transport.set_default_timeout(None)
+        self.assertEqual(transport.default_timeout(), transport.default_request_timeout)
+
+    def test_connection_error(self):
+        # nobody listens on the server's port after it is closed
+        url = self.base_url + '/a'
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(transport.TransportError):
+            transport.get(url, timeout=5)
+
+    def test_stream(self):
+        r = transport.get(self.base_url + '/a', stream=True)
+        self.assertEqual(b"".join(transport.iter_content(r, chunk_size=4)), b"path=/a accept=*/*")
+        r.close()
+
+        transport.set_record_dir(self.tmpdir.name)
+        r = transport.get(self.base_url + '/b', stream=True)
+        self.assertEqual(b"".join(transport.iter_content(r)), b"path=/b accept=*/*")
+        transport.set_record_dir(None)
+        transport.set_replay_dir(self.tmpdir.name)
+        r = transport.get(self.base_url + '/b', stream=True)
+        self.assertEqual(b"".join(transport.iter_content(r)), b"path=/b accept=*/*")
+
+    def test_record_replay(self):
+        transport.set_record_dir(self.tmpdir.name)
+        r1 = transport.get(self.base_url + '/a', headers={'Accept': 'application/x-bibtex'})
+        r2 = transport.get(self.base_url + '/a', headers={'Accept': 'text/html'})
+        r3 = transport.get(self.base_url + '/missing')
+        transport.set_record_dir(None)
+        self.assertEqual(len(os.listdir(self.tmpdir.name)), 3)
+
+        # replaying doesn't need the network, not even in offline mode
+        self.server.requests = []
+        transport.set_replay_dir(self.tmpdir.name)
+        transport.set_offline(True)
+        for (r, accept) in [ (r1, 'application/x-bibtex'), (r2, 'text/html') ]:
+            rr = transport.get(self.base_url + '/a', headers={'Accept': accept})
+            self.assertEqual(rr.status_code, 200)
+            self.assertEqual(rr.text, r.text)
+            self.assertEqual(rr.headers['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(transport.get(self.base_url + '/missing').status_code, 404)
+        self.assertEqual(r3.status_code, 404)
+        self.assertEqual(self.server.requests, [])
+
+        with self.assertRaises(transport.NoRecordedResponseError):
+            transport.get(self.base_url + '/not-recorded')
+
+
+_SOURCE_BIB = r"""
+@article{Einstein1935,
+  author = {Einstein, A. and Podolsky, B. and Rosen, N.},
+  title = {Can Quantum-Mechanical Description of Physical Reality Be Considered Complete?},
+  year = {1935}
+}
+"""
+
+class TestSourceUrls(unittest.TestCase, CustomAssertions):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _load(self, src):
+        fname = os.path.join(self.tmpdir.name, 'test.bibolamazi.bib')
+        with open(fname, 'w') as f:
+            f.write("%%%-BIB-OLA-MAZI-BEGIN-%%%\n"
+                    "%\n"
+                    "% src: " + src + "\n"
+                    "%\n"
+                    "%%%-BIB-OLA-MAZI-END-%%%\n")
+        return BibolamaziFile(fname, use_cache=False, use_shared_cache=False)
+
+    def test_file_url(self):
+        srcname = os.path.join(self.tmpdir.name, 'source.bib')
+        with open(srcname, 'w') as f:
+            f.write(_SOURCE_BIB)
+
+        # non-HTTP URLs don't go through the transport layer, not even offline
+        transport.set_offline(True)
+        try:
+            bf = self._load('file://' + srcname)
+        finally:
+            transport.set_offline(False)
+        self.assertEqual(list(bf.bibliographyData().entries.keys()), ['Einstein1935'])
+
+
+
+if __name__ == '__main__':
+    blogger.setup_simple_console_logging(level=logging.DEBUG)
+    unittest.main()